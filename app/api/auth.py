@@ -0,0 +1,80 @@
+"""
+API key authentication and per-key quotas
+"""
+import math
+from typing import Optional
+
+from fastapi import HTTPException, Request, Security
+from fastapi.responses import JSONResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from app.services.api_keys import APIKey
+from app.utils.metrics import RATE_LIMITED
+
+security = HTTPBearer()
+
+
+def verify_api_key(request: Request, credentials: HTTPAuthorizationCredentials = Security(security)) -> APIKey:
+    """
+    Verify API key from Authorization header
+    """
+    # Already resolved by APIKeyMiddleware on /api/ routes
+    api_key = getattr(request.state, "api_key", None) or request.app.state.api_keys.lookup(credentials.credentials)
+    if api_key is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid API key"
+        )
+    return api_key
+
+
+def _bearer_token(scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            return token.strip() if scheme.lower() == "bearer" else None
+    return None
+
+
+class APIKeyMiddleware:
+    """
+    Enforces per-key quotas on /api/ requests before they are parsed: the
+    key's token bucket (request rate) and its max_in_flight (concurrent
+    requests, counted until the response, including streamed batches, has
+    been sent). Refused requests get 429 with Retry-After.
+
+    Requests without a known key pass through unchanged, so the route's
+    verify_api_key answers them with 401 as before. Keys (and their usage)
+    are the worker's APIKeyRegistry, app.state.api_keys.
+    """
+
+    def __init__(self, app, path_prefix: str = "/api/"):
+        self.app = app
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+        api_key = scope["app"].state.api_keys.lookup(_bearer_token(scope))
+        if api_key is None:
+            await self.app(scope, receive, send)
+            return
+
+        refused = api_key.acquire()
+        if refused is not None:
+            limit, retry_after = refused
+            RATE_LIMITED.labels(api_key.name, limit).inc()
+            response = JSONResponse(
+                {"detail": f"Too many {'concurrent requests' if limit == 'concurrency' else 'requests'} for API key {api_key.name}"},
+                status_code=429,
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+            await response(scope, receive, send)
+            return
+
+        scope.setdefault("state", {})["api_key"] = api_key
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            api_key.release()
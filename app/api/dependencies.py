@@ -0,0 +1,21 @@
+"""
+Per-worker services, built by the application lifespan (see app.main) and
+injected into routes
+"""
+from fastapi import Request
+
+from app.services.email_service import EmailService
+from app.services.idempotency import IdempotencyService
+from app.services.queue_service import DeliveryQueue
+
+
+def get_email_service(request: Request) -> EmailService:
+    return request.app.state.email_service
+
+
+def get_delivery_queue(request: Request) -> DeliveryQueue:
+    return request.app.state.delivery_queue
+
+
+def get_idempotency(request: Request) -> IdempotencyService:
+    return request.app.state.idempotency
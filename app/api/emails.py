@@ -1,24 +1,39 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from app.schemas.email import EmailSendRequest
+import asyncio
+import json
+import math
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Path, Query, Request, Response, status
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from app.api.auth import verify_api_key
+from app.api.dependencies import get_delivery_queue, get_email_service, get_idempotency
+from app.services.api_keys import APIKey
+from app.schemas.email import AttachmentRef, EmailBatchRequest, EmailSendRequest, EmailTemplateRequest, parse_email_request
+from app.services.attachment_service import UploadTooLargeError, discard_uploads, receive_upload
+from app.services.attachment_store import AttachmentError, AttachmentNotFoundError
+from app.services.delivery_log import InvalidCursorError
 from app.services.email_service import EmailService
+from app.services.idempotency import IdempotencyConflictError, IdempotencyKeyReusedError, IdempotencyService, fingerprint
+from app.services.queue_service import DeliveryQueue
+from app.services.retry_scheduler import retry_delay
+from app.services.template_service import TemplateNotFoundError
 from app.config import settings
+from app.utils.ndjson import NDJSON_MEDIA_TYPES, NDJSONStreamingResponse, iter_ndjson_lines
+from app.utils.templates import TemplateError
 
-security = HTTPBearer()
+router = APIRouter()
 
-def verify_api_key(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """
-    Verify API key from Authorization header
-    """
-    if credentials.credentials != settings.api_key:
-        raise HTTPException(
-            status_code=401,
-            detail="Invalid API key"
-        )
-    return credentials
+EMAIL_SERVICE = Depends(get_email_service)
 
-router = APIRouter()
-email_service = EmailService()
+IDEMPOTENCY_KEY = Header(
+    None,
+    alias="Idempotency-Key",
+    min_length=1,
+    max_length=255,
+    description="Client-chosen key; retries with the same key return the first response instead of sending again"
+)
 
 @router.post(
     "/send",
@@ -27,25 +42,406 @@ email_service = EmailService()
     status_code=status.HTTP_200_OK,
     dependencies=[Depends(verify_api_key)]
 )
-async def send_email_api(email_request: EmailSendRequest):
+async def send_email_api(
+    email_request: EmailSendRequest,
+    response: Response,
+    api_key: APIKey = Depends(verify_api_key),
+    idempotency_key: Optional[str] = IDEMPOTENCY_KEY,
+    email_service: EmailService = EMAIL_SERVICE,
+    idempotency: IdempotencyService = Depends(get_idempotency)
+):
     """
     Sends an email to the specified recipients.
     
     Supports three email types:
     - plain: Plain text email (requires 'body')
     - html: HTML email (requires 'html_body')
-    - multipart: Both plain text and HTML (requires both 'body' and 'html_body')
+    - multipart: Both plain text and HTML (requires 'html_body'; 'body' is
+      generated from it when omitted)
+    
+    HTML bodies are sanitized (scripts, event handlers and unknown tags are
+    removed) unless NOTIFYHUB_HTML_SANITIZE=false.
+    
+    With template_id, subject and bodies are rendered from a registered
+    template (see /templates) using the request's variables.
+    
+    Attachments uploaded to /attachments are referenced by handle; PDF
+    attachments with "preview" set get images of their first pages
+    embedded in the HTML body.
+    
+    Recipients on the suppression list (see /api/v1/suppressions) are
+    dropped and listed under "suppressed"; if none are left the email is not
+    sent and the status is "suppressed".
+    
+    If the relay rejects only some recipients, the status is "partial" and
+    the response lists the accepted and rejected addresses, and under
+    "deferred" the rejected ones worth retrying (4xx replies). Transient relay
+    failures return 503 with a Retry-After header; permanent ones return 500.
+    
+    With an Idempotency-Key header, a retry of the same request returns the
+    first successful response (marked "Idempotent-Replayed: true") without
+    sending again, and a retry arriving while the first attempt is still
+    sending waits for it. Reusing a key for a different request returns 422.
+    
+    Requires API key authentication.
+    """
+    async def send():
+        try:
+            result = await email_service.send_email(email_request)
+        except (AttachmentError, TemplateError) as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+        return _send_result(result)
+
+    return await _idempotent(idempotency, f"send:{api_key.name}", idempotency_key, email_request, response, send)
+
+async def _idempotent(
+    idempotency: IdempotencyService,
+    scope: str,
+    idempotency_key: Optional[str],
+    email_request: EmailSendRequest,
+    response: Response,
+    call
+):
+    """
+    Runs call() once per Idempotency-Key within scope (endpoint and API
+    key); repeats get the stored response with an Idempotent-Replayed header
+    """
+    if idempotency_key is None:
+        return await call()
+    try:
+        result, replayed = await idempotency.run(
+            f"{scope}:{idempotency_key}", fingerprint(email_request.model_dump_json()), call
+        )
+    except IdempotencyKeyReusedError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e), headers={"Retry-After": "1"})
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+def _send_result(result: dict) -> dict:
+    """
+    Maps a send_email() result onto the /send response or error
+    """
+    if result["status"] in ("success", "partial", "suppressed"):
+        return result
+    if result.get("retryable"):
+        # Transient relay trouble: tell the client when to come back, with
+        # jitter so retries from many clients don't arrive together
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=result["message"],
+            headers={"Retry-After": str(math.ceil(retry_delay(1)))}
+        )
+    raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=result["message"])
+
+@router.post(
+    "/send-with-attachments",
+    summary="Send Email with Attachments",
+    response_model=dict,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(verify_api_key)],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "required": ["email"],
+                        "properties": {
+                            "email": {"type": "string", "description": "EmailSendRequest as JSON"},
+                            "files": {"type": "array", "items": {"type": "string", "format": "binary"}}
+                        }
+                    }
+                }
+            }
+        }
+    }
+)
+async def send_email_with_attachments_api(request: Request, email_service: EmailService = EMAIL_SERVICE):
+    """
+    Sends an email with file attachments from a multipart/form-data body:
+    an "email" field holding the EmailSendRequest JSON plus one or more files.
     
+    Files are streamed to disk while uploading and kept in the attachment
+    store (see /attachments), so large attachments are never held in memory
+    and a file sent repeatedly is stored and encoded once. Allowed types and size
+    limits come from the file storage settings; oversized uploads are
+    rejected with 413 as soon as the limit is crossed.
     Requires API key authentication.
     """
+    fields, uploads = await _receive_upload(request)
+    try:
+        try:
+            email_request = EmailSendRequest.model_validate_json(fields.get("email", ""))
+        except ValidationError as e:
+            raise RequestValidationError(e.errors(include_url=False))
+        # Uploads go through the attachment store, so repeated files are
+        # stored and encoded once
+        stored = [await asyncio.to_thread(email_service.attachments.put, upload) for upload in uploads]
+    except BaseException:
+        await asyncio.to_thread(discard_uploads, uploads)
+        raise
+
+    email_request.attachments = [
+        *(email_request.attachments or ()),
+        *(AttachmentRef(id=attachment.attachment_id, filename=upload.attachment.filename)
+          for (attachment, _), upload in zip(stored, uploads))
+    ]
     try:
         result = await email_service.send_email(email_request)
-        if result["status"] == "success":
-            return result
-        else:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=result["message"])
+    except (AttachmentError, TemplateError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    return _send_result(result)
+
+async def _receive_upload(request: Request):
+    try:
+        return await receive_upload(request)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.post(
+    "/attachments",
+    summary="Upload Attachments",
+    response_model=dict,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(verify_api_key)],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "files": {"type": "array", "items": {"type": "string", "format": "binary"}}
+                        }
+                    }
+                }
+            }
+        }
+    }
+)
+async def upload_attachments_api(request: Request, email_service: EmailService = EMAIL_SERVICE):
+    """
+    Uploads files once and returns a handle for each, to be referenced from
+    the "attachments" field of later send requests ([{"id": <handle>}]).
+    
+    Handles are the SHA-256 of the content: uploading the same file again
+    returns the same handle ("deduplicated": true) without storing it twice.
+    Unreferenced attachments are removed after attachment_store_ttl.
+    Requires API key authentication.
+    """
+    _, uploads = await _receive_upload(request)
+    if not uploads:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No files uploaded")
+    try:
+        stored = [await asyncio.to_thread(email_service.attachments.put, upload) for upload in uploads]
+    except BaseException:
+        await asyncio.to_thread(discard_uploads, uploads)
+        raise
+    return {
+        "attachments": [
+            {**attachment._asdict(), "deduplicated": deduplicated}
+            for attachment, deduplicated in stored
+        ]
+    }
+
+@router.get(
+    "/attachments/{attachment_id}",
+    summary="Get Attachment Metadata",
+    response_model=dict,
+    dependencies=[Depends(verify_api_key)]
+)
+async def get_attachment_api(attachment_id: str, email_service: EmailService = EMAIL_SERVICE):
+    """
+    Returns the metadata of an uploaded attachment.
+    Requires API key authentication.
+    """
+    try:
+        attachment = await asyncio.to_thread(email_service.attachments.get, attachment_id)
+    except AttachmentNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    return attachment._asdict()
+
+TEMPLATE_ID = Path(..., pattern=r"^[A-Za-z0-9_.-]{1,64}$", description="Template identifier")
+
+@router.put(
+    "/templates/{template_id}",
+    summary="Register or Update a Template",
+    response_model=dict,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(verify_api_key)]
+)
+async def save_template_api(
+    template_request: EmailTemplateRequest,
+    template_id: str = TEMPLATE_ID,
+    email_service: EmailService = EMAIL_SERVICE
+):
+    """
+    Stores a template under template_id, replacing any previous version.
+    
+    subject, body and html_body may use {{ name }} placeholders, filled from
+    the "variables" of each send request (or each row of a batch). Values are
+    HTML-escaped in html_body unless written {{ name | safe }}. The response
+    lists the variables the template uses.
+    Requires API key authentication.
+    """
+    try:
+        return await email_service.templates.save(template_id, template_request)
+    except TemplateError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.get(
+    "/templates/{template_id}",
+    summary="Get Template",
+    response_model=dict,
+    dependencies=[Depends(verify_api_key)]
+)
+async def get_template_api(template_id: str = TEMPLATE_ID, email_service: EmailService = EMAIL_SERVICE):
+    """
+    Returns a registered template and the variables it uses.
+    Requires API key authentication.
+    """
+    try:
+        return await email_service.templates.describe(template_id)
+    except TemplateNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+@router.delete(
+    "/templates/{template_id}",
+    summary="Delete Template",
+    status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=[Depends(verify_api_key)]
+)
+async def delete_template_api(template_id: str = TEMPLATE_ID, email_service: EmailService = EMAIL_SERVICE):
+    """
+    Removes a template. Queued emails that still reference it will fail.
+    Requires API key authentication.
+    """
+    try:
+        await email_service.templates.delete(template_id)
+    except TemplateNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+@router.post(
+    "/enqueue",
+    summary="Queue Email for Background Delivery",
+    response_model=dict,
+    status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(verify_api_key)]
+)
+async def enqueue_email_api(
+    email_request: EmailSendRequest,
+    response: Response,
+    api_key: APIKey = Depends(verify_api_key),
+    idempotency_key: Optional[str] = IDEMPOTENCY_KEY,
+    delivery_queue: DeliveryQueue = Depends(get_delivery_queue),
+    idempotency: IdempotencyService = Depends(get_idempotency)
+):
+    """
+    Persists the email and returns its email_id immediately.
+    
+    Delivery happens in background workers, so API latency no longer depends
+    on the SMTP relay and the email survives relay outages. With an
+    Idempotency-Key header, retries return the first email_id instead of
+    queueing the email again (see /send).
+    Requires API key authentication and NOTIFYHUB_QUEUE_ENABLED=true.
+    """
+    if not settings.queue_enabled:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Delivery queue is disabled")
+
+    async def enqueue():
+        try:
+            email_id = await delivery_queue.enqueue(email_request)
+        except (AttachmentNotFoundError, TemplateNotFoundError) as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to queue email: {e}")
+        return {
+            "email_id": email_id,
+            "status": "queued",
+            "message": "Email accepted for delivery."
+        }
+
+    return await _idempotent(idempotency, f"enqueue:{api_key.name}", idempotency_key, email_request, response, enqueue)
+
+@router.post(
+    "/send-batch",
+    summary="Send a Batch of Emails",
+    response_class=NDJSONStreamingResponse,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(verify_api_key)]
+)
+async def send_batch_api(batch_request: EmailBatchRequest, email_service: EmailService = EMAIL_SERVICE):
+    """
+    Sends many emails in one call.
+    
+    Accepts either a list of messages or a template plus a list of recipients.
+    A template with a registered template_id can carry one row of
+    "variables" per recipient; the template is compiled once for the batch.
+    Every item is validated once; results are streamed back as NDJSON, one
+    line per item ({"index", "email_id", "status", "message"}) in completion order.
+    Requires API key authentication.
+    """
+    async def results():
+        async for result in email_service.send_batch(batch_request.iter_requests()):
+            yield json.dumps(result) + "\n"
+
+    return NDJSONStreamingResponse(results())
+
+@router.post(
+    "/send-stream",
+    summary="Stream Emails as NDJSON",
+    response_class=NDJSONStreamingResponse,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(verify_api_key)],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/x-ndjson": {"schema": {"type": "string"}}}
+        }
+    }
+)
+async def send_stream_api(request: Request, email_service: EmailService = EMAIL_SERVICE):
+    """
+    Sends an unbounded number of emails from an application/x-ndjson body,
+    one EmailSendRequest JSON object per line.
+    
+    Lines are parsed and validated as they arrive and results are streamed
+    back as NDJSON ({"index": <line number>, ...}), so memory use does not
+    depend on the size of the upload.
+    Requires API key authentication.
+    """
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if media_type not in NDJSON_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Content-Type must be application/x-ndjson"
+        )
+
+    max_line_bytes = settings.stream_max_line_bytes
+
+    async def items():
+        async for index, line in iter_ndjson_lines(request.stream(), max_line_bytes):
+            if line is None:
+                yield index, f"Line exceeds {max_line_bytes} bytes"
+            else:
+                yield index, parse_email_request(line)
+
+    async def results():
+        async for result in email_service.send_batch(items()):
+            yield json.dumps(result) + "\n"
+
+    return NDJSONStreamingResponse(results())
 
 @router.post(
     "/send-plain",
@@ -54,7 +450,7 @@ async def send_email_api(email_request: EmailSendRequest):
     status_code=status.HTTP_200_OK,
     dependencies=[Depends(verify_api_key)]
 )
-async def send_plain_text_email_api(email_request: EmailSendRequest):
+async def send_plain_text_email_api(email_request: EmailSendRequest, email_service: EmailService = EMAIL_SERVICE):
     """
     Sends a plain text email to the specified recipients.
     
@@ -63,9 +459,62 @@ async def send_plain_text_email_api(email_request: EmailSendRequest):
     """
     try:
         result = await email_service.send_plain_text_email(email_request)
-        if result["status"] == "success":
+        if result["status"] in ("success", "partial", "suppressed"):
             return result
         else:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=result["message"])
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+@router.get(
+    "",
+    summary="Query the Delivery Log",
+    response_model=dict,
+    dependencies=[Depends(verify_api_key)]
+)
+async def query_delivery_log_api(
+    status_filter: Optional[str] = Query(None, alias="status", pattern="^(sent|rejected|failed|suppressed)$", description="Per-recipient outcome"),
+    recipient: Optional[str] = Query(None, description="Exact recipient address"),
+    since: Optional[datetime] = Query(None, description="Only entries at or after this time (ISO 8601)"),
+    until: Optional[datetime] = Query(None, description="Only entries before this time (ISO 8601)"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(100, ge=1, le=1000),
+    email_service: EmailService = EMAIL_SERVICE
+):
+    """
+    Lists delivery log entries (one per email and recipient), newest first.
+    
+    Pages are keyset-paginated: pass next_cursor from the response to get
+    the next page; it is null on the last one. Entries are written in the
+    background, so the newest sends may take up to
+    delivery_log_flush_interval to show up here.
+    Requires API key authentication.
+    """
+    if not email_service.delivery_log.enabled:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Delivery log is disabled")
+    try:
+        return await email_service.delivery_log.query(
+            status=status_filter, recipient=recipient, since=since, until=until, cursor=cursor, limit=limit
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.get(
+    "/{email_id}",
+    summary="Get Email Delivery Status",
+    response_model=dict,
+    dependencies=[Depends(verify_api_key)]
+)
+async def get_email_status_api(email_id: str = Path(..., max_length=36), email_service: EmailService = EMAIL_SERVICE):
+    """
+    Returns the delivery status of an email by the email_id returned from
+    /send, /send-batch, /send-stream or /enqueue: the overall status, the
+    latest outcome per recipient and every delivery attempt.
+    Requires API key authentication.
+    """
+    if not (email_service.delivery_log.enabled or settings.queue_enabled):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Delivery log is disabled")
+    result = await email_service.delivery_log.get(email_id)
+    if result is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown email {email_id}")
+    return result
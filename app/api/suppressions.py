@@ -0,0 +1,108 @@
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, status
+
+from app.api.auth import verify_api_key
+from app.api.dependencies import get_email_service
+from app.config import settings
+from app.schemas.email import SuppressionRequest
+from app.services.email_service import EmailService
+from app.utils.ndjson import iter_ndjson_lines
+from app.utils.suppression_index import SUPPRESSION_REASONS
+
+router = APIRouter()
+
+EMAIL_SERVICE = Depends(get_email_service)
+
+IMPORT_MEDIA_TYPES = {"text/plain", "text/csv"}
+
+ADDRESS = Path(..., max_length=320, description="Suppressed email address (case-insensitive)")
+
+
+def _enabled(email_service: EmailService) -> None:
+    if not email_service.suppressions.enabled:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Suppression list is disabled")
+
+@router.post(
+    "",
+    summary="Suppress Addresses",
+    response_model=dict,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(verify_api_key)]
+)
+async def add_suppressions_api(suppression_request: SuppressionRequest, email_service: EmailService = EMAIL_SERVICE):
+    """
+    Adds addresses to the suppression list; sends to them are dropped from
+    then on (by other workers within NOTIFYHUB_SUPPRESSION_REFRESH_INTERVAL).
+    Adding an address again updates its reason.
+    Requires API key authentication.
+    """
+    _enabled(email_service)
+    added = await email_service.suppressions.add(suppression_request.addresses, suppression_request.reason)
+    return {"added": added, "reason": suppression_request.reason}
+
+@router.post(
+    "/import",
+    summary="Bulk Import Suppressed Addresses",
+    response_model=dict,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(verify_api_key)],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"text/plain": {"schema": {"type": "string"}}, "text/csv": {"schema": {"type": "string"}}}
+        }
+    }
+)
+async def import_suppressions_api(
+    request: Request,
+    reason: str = Query("manual", pattern=f"^({'|'.join(SUPPRESSION_REASONS)})$"),
+    email_service: EmailService = EMAIL_SERVICE
+):
+    """
+    Imports a text/plain or text/csv body with one address per line (the
+    first column for CSV, e.g. a bounce export). The upload is read and
+    written in batches as it arrives, so lists of millions of addresses
+    can be imported in one request. Invalid lines are skipped; the first
+    ones are listed in "errors".
+    Requires API key authentication.
+    """
+    _enabled(email_service)
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if media_type not in IMPORT_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Content-Type must be text/plain or text/csv"
+        )
+    lines = iter_ndjson_lines(request.stream(), settings.stream_max_line_bytes)
+    return await email_service.suppressions.import_lines(lines, reason)
+
+@router.get(
+    "/{address}",
+    summary="Get Suppressed Address",
+    response_model=dict,
+    dependencies=[Depends(verify_api_key)]
+)
+async def get_suppression_api(address: str = ADDRESS, email_service: EmailService = EMAIL_SERVICE):
+    """
+    Returns the suppression entry of an address, or 404 if mail to it is allowed.
+    Requires API key authentication.
+    """
+    _enabled(email_service)
+    entry = await email_service.suppressions.get(address)
+    if entry is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{address} is not suppressed")
+    return entry
+
+@router.delete(
+    "/{address}",
+    summary="Remove Suppressed Address",
+    status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=[Depends(verify_api_key)]
+)
+async def delete_suppression_api(address: str = ADDRESS, email_service: EmailService = EMAIL_SERVICE):
+    """
+    Allows mail to an address again.
+    Requires API key authentication.
+    """
+    _enabled(email_service)
+    if not await email_service.suppressions.remove(address):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{address} is not suppressed")
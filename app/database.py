@@ -1,27 +1,159 @@
 """
 Database connection and session management
+
+SQLAlchemy itself is only imported once the database is first used (or a
+model is imported), so workers that never touch it don't pay for it.
 """
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import asyncio
+import threading
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Callable, List, Optional, TypeVar
+
 from app.config import settings
 
-# Create database engine
-engine = create_engine(
-    settings.database_url,
-    echo=settings.debug,  # Log SQL queries in debug mode
-    pool_pre_ping=True,   # Verify connections before use
-    pool_recycle=300      # Recycle connections every 5 minutes
-)
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+    from sqlalchemy.orm import Session
+
+T = TypeVar("T")
+
+# Drivers used by the async engine (NOTIFYHUB_DATABASE_ASYNC=true)
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+# SQLite (e.g. NOTIFYHUB_DATABASE_URL=sqlite:///./notifyhub.db) is supported
+# for local testing; its connections are shared with worker threads.
+connect_args = {}
+if settings.database_url.startswith("sqlite"):
+    connect_args["check_same_thread"] = False
+
+engine_args = {
+    "echo": settings.database_echo,  # Not tied to debug, which is on by default
+    "pool_pre_ping": True,           # Verify connections before use
+    "pool_recycle": 300,             # Recycle connections every 5 minutes
+    "pool_size": settings.database_pool_size,
+    "max_overflow": settings.database_max_overflow,
+    "pool_timeout": settings.database_pool_timeout,
+    "query_cache_size": settings.database_statement_cache_size,
+}
+if settings.database_url in ("sqlite://", "sqlite:///:memory:"):
+    # The database lives in its only connection: keep it open for good and
+    # lend it to one session at a time, whichever thread or task asks
+    engine_args.update(pool_size=1, max_overflow=0, pool_recycle=-1)
+
+# Engines are created on first use rather than at import: that loads the
+# database driver and, for most requests, never happens at all
+_engine: Optional["Engine"] = None
+_SessionLocal = None
+_async_engine = None
+_AsyncSessionLocal = None
+_engine_lock = threading.Lock()
+
+# Tables are created before the first query rather than at startup
+_tables_ready = False
+_tables_lock = threading.Lock()
+_async_tables_lock: Optional[asyncio.Lock] = None
+
+# Base class for models and metadata for migrations, see __getattr__
+_base = None
+_metadata = None
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def get_engine() -> "Engine":
+    """
+    The database engine, created on first call
+    """
+    global _engine, _SessionLocal
+    if _engine is None:
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from sqlalchemy.pool import QueuePool
+
+        with _engine_lock:
+            if _engine is None:
+                engine = create_engine(
+                    settings.database_url, poolclass=QueuePool, connect_args=connect_args, **engine_args
+                )
+                _SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                _engine = engine
+    return _engine
+
+
+def SessionLocal() -> "Session":
+    """
+    New session on the database engine
+    """
+    get_engine()
+    return _SessionLocal()
+
+
+def async_database_url(database_url: str):
+    """
+    database_url with its driver swapped for the asyncio one
+    """
+    from sqlalchemy.engine import make_url
+
+    url = make_url(database_url)
+    url = url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+    if url.drivername == "postgresql+asyncpg":
+        # Prepared statements are kept per connection and reused across calls
+        url = url.update_query_dict({"prepared_statement_cache_size": str(settings.database_statement_cache_size)})
+    return url
+
+
+def get_async_engine():
+    """
+    The async engine (NOTIFYHUB_DATABASE_ASYNC=true), created on first call;
+    None otherwise, so its driver stays optional
+    """
+    global _async_engine, _AsyncSessionLocal
+    if settings.database_async and _async_engine is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+        with _engine_lock:
+            if _async_engine is None:
+                engine = create_async_engine(
+                    async_database_url(settings.database_url), poolclass=AsyncAdaptedQueuePool, **engine_args
+                )
+                _AsyncSessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+                _async_engine = engine
+    return _async_engine
+
 
-# Create SessionLocal class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def AsyncSessionLocal():
+    """
+    New session on the async engine
+    """
+    get_async_engine()
+    return _AsyncSessionLocal()
+
+
+def _declarative_base():
+    global _base, _metadata
+    if _base is None:
+        from sqlalchemy import MetaData
+        from sqlalchemy.orm import declarative_base
 
-# Create Base class for models
-Base = declarative_base()
+        with _engine_lock:
+            if _base is None:
+                _metadata = MetaData()  # For migrations
+                _base = declarative_base()
+    return _base
 
-# Metadata for migrations
-metadata = MetaData()
+
+def __getattr__(name: str):
+    # Base class for models and metadata for migrations, built when a model
+    # is first imported
+    if name == "Base":
+        return _declarative_base()
+    if name == "metadata":
+        _declarative_base()
+        return _metadata
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_db():
@@ -35,15 +167,92 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """
+    Dependency to get an async database session (NOTIFYHUB_DATABASE_ASYNC=true)
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def run_db(fn: Callable[..., T], *args) -> T:
+    """
+    Run fn(session, *args) without blocking the event loop.
+
+    fn is plain synchronous ORM code and commits its own work. In async
+    mode it runs on a connection of the async engine; otherwise it gets a
+    regular session in a worker thread.
+    """
+    if settings.database_async:
+        if not _tables_ready:
+            await init_db()
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(fn, *args)
+
+    def call() -> T:
+        ensure_tables()
+        with SessionLocal() as db:
+            return fn(db, *args)
+
+    return await asyncio.to_thread(call)
+
+
+def bulk_update(db: "Session", model, rows: List[dict]) -> None:
+    """
+    Update many rows by primary key in one round trip.
+
+    Each row holds the primary key and the new values; rows sharing the same
+    columns are sent as one executemany of a single UPDATE, which is compiled
+    once and then served from the statement caches on every later call.
+    """
+    if rows:
+        from sqlalchemy import update
+
+        db.execute(update(model), rows)
+
+
 def create_tables():
     """
     Create all tables in the database
     """
-    Base.metadata.create_all(bind=engine)
+    import app.models  # noqa: F401 - register models on Base.metadata
+    _declarative_base().metadata.create_all(bind=get_engine())
+
+
+def ensure_tables() -> None:
+    """
+    Create the tables once, before the first query; a failed attempt
+    (e.g. the database is down) is retried by the next query
+    """
+    global _tables_ready
+    if not _tables_ready:
+        with _tables_lock:
+            if not _tables_ready:
+                create_tables()
+                _tables_ready = True
+
+
+async def init_db():
+    """
+    Create all tables through the engine the services use, unless done already
+    """
+    global _tables_ready, _async_tables_lock
+    async_engine = get_async_engine()
+    if async_engine is None:
+        await asyncio.to_thread(ensure_tables)
+        return
+    if _async_tables_lock is None:
+        _async_tables_lock = asyncio.Lock()
+    async with _async_tables_lock:
+        if not _tables_ready:
+            import app.models  # noqa: F401 - register models on Base.metadata
+            async with async_engine.begin() as connection:
+                await connection.run_sync(_declarative_base().metadata.create_all)
+            _tables_ready = True
 
 
 def drop_tables():
     """
     Drop all tables in the database (for testing)
     """
-    Base.metadata.drop_all(bind=engine)
+    _declarative_base().metadata.drop_all(bind=get_engine())
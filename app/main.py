@@ -1,47 +1,129 @@
 """
 NotifyHubLite FastAPI Application
 """
-from fastapi import FastAPI, Depends, HTTPException, Security
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
-import uvicorn
+from fastapi.responses import PlainTextResponse
+from contextlib import asynccontextmanager, contextmanager
+from time import perf_counter
+import asyncio
+import logging
 
+from app.api.auth import APIKeyMiddleware, verify_api_key
 from app.config import settings
-from app.database import create_tables
-
+from app.services.api_keys import APIKey, APIKeyRegistry
+from app.services.email_service import EmailService
+from app.services.idempotency import IdempotencyService
+from app.services.queue_service import DeliveryQueue
+from app.utils.metrics import (
+    QUEUE_DEPTH,
+    REGISTRY,
+    SMTP_LANE_DEPTH,
+    SMTP_POOL_CONNECTIONS,
+    SMTP_RELAY_OUTSTANDING,
+    SMTP_RELAY_UP,
+)
+from app.utils.smtp_relays import CLOSED
 
-# Security scheme for API key authentication
-security = HTTPBearer()
+logger = logging.getLogger(__name__)
 
 
-def verify_api_key(credentials: HTTPAuthorizationCredentials = Security(security)):
+def _register_gauges(state):
     """
-    Verify API key from Authorization header
+    Read pool and queue gauges from their owners when /metrics is scraped
     """
-    if credentials.credentials != settings.api_key:
-        raise HTTPException(
-            status_code=401,
-            detail="Invalid API key"
-        )
-    return credentials
+    smtp_client = state.email_service.smtp_client
+
+    def pool_connections():
+        stats = smtp_client.pool_stats()
+        return {("open",): stats["open"], ("idle",): stats["idle"], ("in_use",): stats["in_use"], ("size",): stats["size"]}
+
+    SMTP_POOL_CONNECTIONS.set_function(pool_connections)
+    SMTP_RELAY_UP.set_function(
+        lambda: {(relay.name,): int(relay.state == CLOSED) for relay in smtp_client.relays}
+    )
+    SMTP_RELAY_OUTSTANDING.set_function(
+        lambda: {(relay.name,): relay.outstanding for relay in smtp_client.relays}
+    )
+    SMTP_LANE_DEPTH.set_function(
+        lambda: {(name,): len(lane.waiters) for name, lane in smtp_client.scheduler.lanes.items()}
+    )
+
+    if settings.queue_enabled:
+        def queue_depth():
+            stats = state.delivery_queue.stats()
+            return {("pending",): stats["pending"], ("retry",): stats["retry_depth"]}
+
+        QUEUE_DEPTH.set_function(queue_depth)
+
+
+@contextmanager
+def _timed(timings: dict, step: str):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings[step] = perf_counter() - start
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
-    Application lifespan events
+    Application lifespan events.
+
+    Everything a worker owns (SMTP executor and pools, caches, queue workers,
+    API key usage) is built here rather than at import, so each worker
+    process of app.server gets its own and nothing is shared or started
+    before the worker serves.
+
+    Shutdown drains: the server has already stopped accepting connections
+    and waited (up to shutdown_timeout) for in-flight requests; then claimed
+    queue emails are finished, buffered delivery log rows are flushed and
+    the SMTP executor is shut down once running sends complete.
+
+    Nothing here connects to the database: tables are created by the first
+    query of a feature that uses it (queue, delivery log, suppression list,
+    templates, persisted idempotency keys), so a worker without those
+    starts without one. Seconds spent in each startup step are kept in
+    app.state.startup_timings (see benchmarks.startup_profile).
     """
     # Startup
     print("🚀 Starting NotifyHubLite API...")
-    # TODO: Initialize database tables after fixing connection
-    # create_tables()
+    state = app.state
+    state.startup_timings = timings = {}
+    with _timed(timings, "api_keys"):
+        state.api_keys = APIKeyRegistry()
+    with _timed(timings, "email_service"):
+        state.email_service = EmailService()
+    with _timed(timings, "delivery_queue"):
+        state.delivery_queue = DeliveryQueue(state.email_service)
+    with _timed(timings, "idempotency"):
+        state.idempotency = IdempotencyService()
+    if settings.queue_enabled:
+        with _timed(timings, "queue_start"):
+            await state.delivery_queue.start()
+    with _timed(timings, "background_tasks"):
+        state.email_service.attachments.start()
+        state.email_service.delivery_log.start()
+        state.email_service.suppressions.start()
+    if settings.metrics_enabled:
+        _register_gauges(state)
     print("✅ API startup complete")
     
     yield
     
     # Shutdown
     print("🛑 Shutting down NotifyHubLite API...")
+    if settings.queue_enabled:
+        try:
+            await asyncio.wait_for(state.delivery_queue.stop(), settings.shutdown_timeout)
+        except asyncio.TimeoutError:
+            # Still marked 'sending'; requeued as stale by the next worker to start
+            logger.warning(f"Queued emails still sending after {settings.shutdown_timeout}s, leaving them for restart")
+    await state.email_service.attachments.stop()
+    await state.email_service.suppressions.stop()
+    await state.email_service.delivery_log.stop()
+    await asyncio.to_thread(state.email_service.close)
 
 
 # Create FastAPI application
@@ -52,6 +134,9 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Per-key rate and concurrency limits (added first so CORS headers wrap its 429s)
+app.add_middleware(APIKeyMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -79,30 +164,53 @@ async def health_check():
     """
     Health check endpoint
     """
-    return {
+    health = {
         "status": "healthy",
         "service": settings.app_name,
         "version": settings.app_version
     }
+    if settings.queue_enabled:
+        health["queue"] = app.state.delivery_queue.stats()
+    smtp_client = app.state.email_service.smtp_client
+    health["smtp_lanes"] = smtp_client.scheduler.stats()
+    if len(settings.smtp_relays) > 1:
+        health["smtp_relays"] = smtp_client.router.stats()
+    if settings.suppression_enabled:
+        health["suppressions"] = app.state.email_service.suppressions.stats()
+    return health
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Prometheus metrics in the text exposition format
+    """
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/protected")
-async def protected_endpoint(credentials: HTTPAuthorizationCredentials = Depends(verify_api_key)):
+async def protected_endpoint(api_key: APIKey = Depends(verify_api_key)):
     """
     Example protected endpoint
     """
     return {
         "message": "Access granted",
-        "authenticated": True
+        "authenticated": True,
+        "api_key": api_key.name
     }
 
 
 # Include API routers
-from app.api import emails
+from app.api import emails, suppressions
 app.include_router(emails.router, prefix="/api/v1/emails", tags=["emails"])
+app.include_router(suppressions.router, prefix="/api/v1/suppressions", tags=["suppressions"])
 
 
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(
         "app.main:app",
         host=settings.host,
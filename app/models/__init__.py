@@ -0,0 +1,10 @@
+"""
+Database models
+"""
+from app.models.delivery_log import DeliveryLog
+from app.models.email_template import EmailTemplate
+from app.models.idempotency_key import IdempotencyKey
+from app.models.outbound_email import OutboundEmail
+from app.models.suppression import Suppression
+
+__all__ = ["DeliveryLog", "EmailTemplate", "IdempotencyKey", "OutboundEmail", "Suppression"]
@@ -0,0 +1,30 @@
+"""
+Delivery log model
+"""
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer, String, Text
+
+from app.database import Base
+from app.models.outbound_email import utcnow
+
+
+class DeliveryLog(Base):
+    """Outcome of one delivery attempt of an email for one recipient"""
+
+    __tablename__ = "delivery_logs"
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    email_id = Column(String(36), nullable=False)
+    recipient = Column(String(320), nullable=False)
+    status = Column(String(16), nullable=False)  # sent, rejected (by the relay, for this recipient), failed, suppressed
+    email_type = Column(String(16), nullable=False)
+    subject = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+
+    __table_args__ = (
+        Index("ix_delivery_logs_email_id", "email_id"),
+        # Keyset pagination over (created_at, id), optionally filtered
+        Index("ix_delivery_logs_created_at_id", "created_at", "id"),
+        Index("ix_delivery_logs_status_created_at", "status", "created_at"),
+        Index("ix_delivery_logs_recipient_created_at", "recipient", "created_at"),
+    )
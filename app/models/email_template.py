@@ -0,0 +1,22 @@
+"""
+Server-side email template model
+"""
+from sqlalchemy import Column, DateTime, Integer, String, Text
+
+from app.database import Base
+from app.models.outbound_email import utcnow
+
+
+class EmailTemplate(Base):
+    """A registered template, rendered per recipient with template variables"""
+
+    __tablename__ = "email_templates"
+
+    id = Column(String(64), primary_key=True)  # template_id chosen by the caller
+    email_type = Column(String(16), nullable=False, default="plain")
+    subject = Column(Text, nullable=False)
+    body = Column(Text, nullable=True)
+    html_body = Column(Text, nullable=True)
+    version = Column(Integer, nullable=False, default=1)  # bumped on every update; invalidates compiled copies
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow)
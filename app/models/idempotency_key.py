@@ -0,0 +1,24 @@
+"""
+Idempotency key model
+"""
+from sqlalchemy import Column, DateTime, Index, JSON, String
+
+from app.database import Base
+from app.models.outbound_email import utcnow
+
+
+class IdempotencyKey(Base):
+    """The outcome of a request sent with an Idempotency-Key header"""
+
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(400), primary_key=True)  # "<endpoint>:<API key name>:<Idempotency-Key>"
+    fingerprint = Column(String(64), nullable=False)  # SHA-256 of the request it was first used with
+    response = Column(JSON(none_as_null=True), nullable=True)  # NULL while the first request is in progress
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        # Purge of expired keys
+        Index("ix_idempotency_keys_expires_at", "expires_at"),
+    )
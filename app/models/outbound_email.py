@@ -0,0 +1,28 @@
+"""
+Outbound email queue model
+"""
+from sqlalchemy import Column, DateTime, Index, Integer, JSON, String, Text
+
+from app.database import Base, utcnow
+
+
+class OutboundEmail(Base):
+    """A persisted send request waiting for (or done with) background delivery"""
+
+    __tablename__ = "outbound_emails"
+
+    id = Column(String(36), primary_key=True)  # email_id returned to the caller
+    status = Column(String(16), nullable=False, default="queued")  # queued, sending, retrying, sent, failed
+    payload = Column(JSON, nullable=False)  # EmailSendRequest as JSON
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)  # set while status is 'retrying'
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow)
+
+    __table_args__ = (
+        # Workers claim the oldest queued rows first
+        Index("ix_outbound_emails_status_created_at", "status", "created_at"),
+        # Recovery sweep for retries orphaned by a restart
+        Index("ix_outbound_emails_status_next_attempt_at", "status", "next_attempt_at"),
+    )
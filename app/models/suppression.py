@@ -0,0 +1,26 @@
+"""
+Suppression list model
+"""
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Index, String
+
+from app.database import Base
+from app.models.outbound_email import utcnow
+
+
+class Suppression(Base):
+    """An address no email is sent to (hard bounce, unsubscribe, complaint)"""
+
+    __tablename__ = "suppressions"
+
+    address = Column(String(320), primary_key=True)  # lowercased
+    address_hash = Column(BigInteger, nullable=False)  # app.utils.suppression_index.address_hash(address)
+    reason = Column(String(32), nullable=False, default="manual")
+    active = Column(Boolean, nullable=False, default=True)  # False once removed, so other workers see the removal
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow)
+
+    __table_args__ = (
+        # Loading the index in hash order, incremental refreshes
+        Index("ix_suppressions_address_hash", "address_hash"),
+        Index("ix_suppressions_updated_at", "updated_at"),
+    )
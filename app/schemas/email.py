@@ -1,48 +1,334 @@
-from typing import List, Optional
-from pydantic import BaseModel, EmailStr, Field, validator
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, ValidationError, field_validator, model_validator
 from datetime import datetime
+from time import perf_counter
+
+from app.config import settings
+from app.utils.addresses import normalize_address, normalize_addresses
+from app.utils.metrics import VALIDATION_SECONDS
+from app.utils.scheduler import PRIORITIES
+from app.utils.suppression_index import SUPPRESSION_REASONS
+
+_validation_seconds = VALIDATION_SECONDS.labels()
+
+class AttachmentRef(BaseModel):
+    """Reference to an attachment uploaded to /attachments"""
+
+    id: str = Field(..., pattern=r"^[0-9a-f]{64}$", description="Attachment handle (SHA-256 of the content) returned by /attachments.")
+    filename: Optional[str] = Field(None, min_length=1, description="Optional file name to use instead of the uploaded one.")
+    preview: bool = Field(False, description="Embed images of the first pages of a PDF in the HTML body.")
+    preview_pages: Optional[int] = Field(None, ge=1, le=settings.pdf_preview_pages_max, description="Number of pages to preview; implies preview. Defaults to pdf_preview_pages_default.")
+
+    @property
+    def preview_page_count(self) -> int:
+        """
+        Number of pages to embed, 0 for none
+        """
+        if self.preview_pages:
+            return self.preview_pages
+        return settings.pdf_preview_pages_default if self.preview else 0
+
+
+def _check_content(email_type: str, body: Optional[str], html_body: Optional[str]) -> None:
+    if email_type == 'plain' and not body:
+        raise ValueError('body is required for plain text emails')
+    elif email_type == 'html' and not html_body:
+        raise ValueError('html_body is required for HTML emails')
+    elif email_type == 'multipart' and not html_body:
+        # body is optional: the plain-text part is generated from html_body
+        raise ValueError('html_body is required for multipart emails')
+
+
+# Addresses are validated by normalize_addresses(), but documented as emails
+_ADDRESS_LIST_SCHEMA = {"items": {"type": "string", "format": "email"}}
+
 
 class EmailSendRequest(BaseModel):
-    recipients: List[EmailStr] = Field(..., description="List of recipient email addresses.")
-    cc: Optional[List[EmailStr]] = Field(None, description="List of CC recipient email addresses.")
-    bcc: Optional[List[EmailStr]] = Field(None, description="List of BCC recipient email addresses.")
-    subject: str = Field(..., min_length=1, description="Subject of the email.")
-    body: Optional[str] = Field(None, description="Plain text body of the email.")
-    html_body: Optional[str] = Field(None, description="HTML body of the email.")
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "recipients": ["johnnyj@nvidia.com"],
+                "subject": "Test Email from NotifyHubLite",
+                "body": "Hello Johnny,\n\nThis is a plain text test email from NotifyHubLite API.",
+                "sender_email": "noreply@example.com",
+                "sender_name": "NotifyHub System"
+            }
+        }
+    )
+
+    recipients: List[str] = Field(..., description="List of recipient email addresses.", json_schema_extra=_ADDRESS_LIST_SCHEMA)
+    cc: Optional[List[str]] = Field(None, description="List of CC recipient email addresses.", json_schema_extra=_ADDRESS_LIST_SCHEMA)
+    bcc: Optional[List[str]] = Field(None, description="List of BCC recipient email addresses.", json_schema_extra=_ADDRESS_LIST_SCHEMA)
+    template_id: Optional[str] = Field(None, description="Registered template to render instead of subject/body/html_body.")
+    variables: Optional[Dict[str, Any]] = Field(None, description="Values for the {{ placeholders }} of the template.")
+    subject: Optional[str] = Field(None, min_length=1, description="Subject of the email. Optional with template_id, where it overrides the template subject.")
+    body: Optional[str] = Field(None, description="Plain text body of the email. Generated from html_body for multipart emails when omitted.")
+    html_body: Optional[str] = Field(None, description="HTML body of the email; sanitized before sending.")
     email_type: str = Field(default="plain", description="Email type: plain, html, or multipart")
     sender_email: Optional[EmailStr] = Field(None, description="Optional sender email address. If not provided, uses default from settings.")
     sender_name: Optional[str] = Field(None, description="Optional sender name. If not provided, uses default from settings.")
+    attachments: Optional[List[AttachmentRef]] = Field(None, description="Previously uploaded attachments to include.")
+    priority: str = Field(default="normal", description="Delivery priority: high (transactional, e.g. password resets), normal, or bulk (campaigns)")
 
-    @validator('email_type')
+    @model_validator(mode='wrap')
+    @classmethod
+    def time_validation(cls, data, handler):
+        start = perf_counter()
+        try:
+            return handler(data)
+        finally:
+            _validation_seconds.observe(perf_counter() - start)
+
+    @field_validator('recipients', 'cc', 'bcc')
+    @classmethod
+    def validate_addresses(cls, v):
+        # One pass over the whole list instead of a validator call per item
+        return v if v is None else normalize_addresses(v)
+
+    @field_validator('email_type')
+    @classmethod
     def validate_email_type(cls, v):
         if v not in ['plain', 'html', 'multipart']:
             raise ValueError('email_type must be one of: plain, html, multipart')
         return v
 
-    @validator('email_type', always=True)
-    def validate_content_requirements(cls, v, values):
-        body = values.get('body')
-        html_body = values.get('html_body')
-        
-        if v == 'plain' and not body:
-            raise ValueError('body is required for plain text emails')
-        elif v == 'html' and not html_body:
-            raise ValueError('html_body is required for HTML emails')
-        elif v == 'multipart' and not (body and html_body):
-            raise ValueError('Both body and html_body are required for multipart emails')
-        
+    @field_validator('priority')
+    @classmethod
+    def validate_priority(cls, v):
+        if v not in PRIORITIES:
+            raise ValueError('priority must be one of: high, normal, bulk')
         return v
 
-    class Config:
-        json_schema_extra = {
+    @model_validator(mode='after')
+    def validate_content_requirements(self):
+        if self.template_id:
+            # Content comes from the template, which was validated when registered,
+            # and so are PDF previews against its email_type (when rendering)
+            if self.body or self.html_body:
+                raise ValueError('body and html_body come from the template when template_id is set')
+            return self
+        if self.variables is not None:
+            raise ValueError('variables require a template_id')
+        if not self.subject:
+            raise ValueError('subject is required')
+        _check_content(self.email_type, self.body, self.html_body)
+        if (
+            self.attachments
+            and any(ref.preview_page_count for ref in self.attachments)
+            and self.email_type not in ('html', 'multipart')
+        ):
+            raise ValueError('PDF previews require an html or multipart email')
+        return self
+
+    @model_validator(mode='after')
+    def collapse_duplicates(self):
+        """
+        Each address gets the email once: repeats within a list are dropped,
+        then cc loses addresses already in recipients and bcc those in
+        recipients or cc
+        """
+        seen = set()
+
+        def unique(addresses: Optional[List[str]]) -> Optional[List[str]]:
+            if not addresses:
+                return addresses
+            kept = [address for address in addresses if not (address in seen or seen.add(address))]
+            return kept or None
+
+        self.recipients = unique(self.recipients)
+        self.cc = unique(self.cc)
+        self.bcc = unique(self.bcc)
+        return self
+
+
+class EmailTemplateRequest(BaseModel):
+    """
+    Request schema for registering or updating a template.
+
+    subject, body and html_body may contain {{ name }} placeholders (dotted
+    names reach into nested variables); values are HTML-escaped in html_body
+    unless written as {{ name | safe }}.
+    """
+
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
-                "recipients": ["johnnyj@nvidia.com"],
-                "subject": "Test Email from NotifyHubLite",
-                "body": "Hello Johnny,\n\nThis is a plain text test email from NotifyHubLite API.",
-                "sender_email": "noreply@example.com",
-                "sender_name": "NotifyHub System"
+                "subject": "Welcome, {{ first_name }}!",
+                "body": "Hello {{ first_name }},\n\nYour account {{ account.id }} is ready.",
+                "html_body": "<p>Hello <b>{{ first_name }}</b>,</p><p>Your account {{ account.id }} is ready.</p>",
+                "email_type": "multipart"
             }
         }
+    )
+
+    subject: str = Field(..., min_length=1, description="Subject template.")
+    body: Optional[str] = Field(None, description="Plain text body template.")
+    html_body: Optional[str] = Field(None, description="HTML body template.")
+    email_type: str = Field(default="plain", description="Email type: plain, html, or multipart")
+
+    @field_validator('email_type')
+    @classmethod
+    def validate_email_type(cls, v):
+        if v not in ['plain', 'html', 'multipart']:
+            raise ValueError('email_type must be one of: plain, html, multipart')
+        return v
+
+    @model_validator(mode='after')
+    def validate_content_requirements(self):
+        _check_content(self.email_type, self.body, self.html_body)
+        return self
+
+
+class SuppressionRequest(BaseModel):
+    """Request schema for adding addresses to the suppression list"""
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "addresses": ["bounced@example.com", "unsubscribed@example.com"],
+                "reason": "hard_bounce"
+            }
+        }
+    )
+
+    addresses: List[str] = Field(
+        ..., min_length=1, max_length=10000, description="Addresses to stop sending to.", json_schema_extra=_ADDRESS_LIST_SCHEMA
+    )
+    reason: str = Field(default="manual", description="Why: hard_bounce, unsubscribe, complaint or manual")
+
+    @field_validator('addresses')
+    @classmethod
+    def validate_addresses(cls, v):
+        return normalize_addresses(v)
+
+    @field_validator('reason')
+    @classmethod
+    def validate_reason(cls, v):
+        if v not in SUPPRESSION_REASONS:
+            raise ValueError('reason must be one of: hard_bounce, unsubscribe, complaint, manual')
+        return v
+
+
+# Stand-in recipient for validating a batch template's shared fields on
+# their own; it would only be dropped from a template cc/bcc listing itself
+_TEMPLATE_PLACEHOLDER = "notifyhub-batch-placeholder@example.com"
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc']) or 'value'}: {err['msg']}" for err in error.errors()
+    )
+
+
+def parse_email_request(line: Union[str, bytes]) -> Union["EmailSendRequest", str]:
+    """
+    Parses and validates one JSON-encoded EmailSendRequest.
+
+    Returns:
+        EmailSendRequest, or the validation error message
+    """
+    try:
+        return EmailSendRequest.model_validate_json(line)
+    except ValidationError as e:
+        return _validation_message(e)
+
+
+class EmailBatchRequest(BaseModel):
+    """
+    Request schema for batch sending.
+
+    Either a list of individual messages, or one shared template plus a list
+    of recipients (each recipient gets their own email). Items are validated
+    one by one so a bad item is reported instead of rejecting the batch.
+    A template referencing a registered template_id can be personalized
+    with one row of variables per recipient.
+    """
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "template": {
+                    "subject": "Monthly Report",
+                    "body": "Hello,\n\nYour monthly report is ready.",
+                    "email_type": "plain"
+                },
+                "recipients": ["user1@example.com", "user2@example.com"]
+            }
+        }
+    )
+
+    messages: Optional[List[Dict[str, Any]]] = Field(None, description="Individual emails, each shaped like EmailSendRequest.")
+    template: Optional[Dict[str, Any]] = Field(None, description="Shared EmailSendRequest fields (without recipients) used for every address in 'recipients'.")
+    recipients: Optional[List[str]] = Field(None, description="Recipient addresses for template mode; one email per address.")
+    variables: Optional[List[Dict[str, Any]]] = Field(None, description="Template mode with a template_id: one row of template variables per recipient.")
+
+    @model_validator(mode='after')
+    def validate_batch_shape(self):
+        messages = self.messages
+        template = self.template
+        v = self.recipients
+
+        if messages is not None and template is not None:
+            raise ValueError('Provide either messages or template + recipients, not both')
+        if messages is None and template is None:
+            raise ValueError('Either messages or template + recipients is required')
+        if template is not None and not v:
+            raise ValueError('recipients is required in template mode')
+
+        size = len(messages) if messages is not None else len(v)
+        if size > settings.batch_max_items:
+            raise ValueError(f'Batch exceeds the maximum of {settings.batch_max_items} emails')
+
+        if template is not None:
+            # Validate the shared content once, up front, with a stand-in
+            # recipient so a bad address stays a per-item error
+            try:
+                EmailSendRequest.model_validate({**template, "recipients": [_TEMPLATE_PLACEHOLDER]})
+            except ValidationError as e:
+                raise ValueError(f'Invalid template: {_validation_message(e)}')
+        return self
+
+    @model_validator(mode='after')
+    def validate_variable_rows(self):
+        if self.variables is None:
+            return self
+        if self.template is None or not self.template.get('template_id'):
+            raise ValueError('variables rows require template mode with a template_id')
+        if self.recipients is not None and len(self.variables) != len(self.recipients):
+            raise ValueError('variables must have one row per recipient')
+        return self
+
+    def iter_requests(self) -> Iterator[Tuple[int, Union["EmailSendRequest", str]]]:
+        """
+        Yields (index, EmailSendRequest) for valid items and
+        (index, error message) for invalid ones, in a single pass.
+        """
+        if self.messages is not None:
+            for index, item in enumerate(self.messages):
+                try:
+                    yield index, EmailSendRequest.model_validate(item)
+                except ValidationError as e:
+                    yield index, _validation_message(e)
+            return
+
+        # Template mode: the content was validated once, only addresses vary.
+        # model_copy() skips the validators, so the address is normalized and
+        # dropped from the shared cc/bcc here, as collapse_duplicates() would
+        base = EmailSendRequest.model_validate({**self.template, "recipients": [_TEMPLATE_PLACEHOLDER]})
+        for index, address in enumerate(self.recipients):
+            try:
+                address = normalize_address(address)
+            except ValidationError as e:
+                yield index, _validation_message(e)
+                continue
+            update = {"recipients": [address]}
+            if base.cc and address in base.cc:
+                update["cc"] = [cc for cc in base.cc if cc != address] or None
+            if base.bcc and address in base.bcc:
+                update["bcc"] = [bcc for bcc in base.bcc if bcc != address] or None
+            if self.variables is not None:
+                update["variables"] = self.variables[index]
+            yield index, base.model_copy(update=update)
 
 
 class EmailSendResponse(BaseModel):
@@ -0,0 +1,36 @@
+"""
+Production entry point: multi-worker uvicorn without reload
+
+Usage:
+    python -m app.server
+"""
+import os
+
+import uvicorn
+
+from app.config import settings
+
+
+def worker_count() -> int:
+    """
+    NOTIFYHUB_WORKERS, or one worker per CPU core this process may run on
+    """
+    if settings.workers > 0:
+        return settings.workers
+    if hasattr(os, "sched_getaffinity"):
+        return max(len(os.sched_getaffinity(0)), 1)
+    return os.cpu_count() or 1
+
+
+def main() -> None:
+    uvicorn.run(
+        "app.main:app",
+        host=settings.host,
+        port=settings.port,
+        workers=worker_count(),
+        timeout_graceful_shutdown=settings.shutdown_timeout
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.utils.rate_limit import TokenBucket, default_burst
+
+logger = logging.getLogger(__name__)
+
+
+def digest_key(token: str) -> bytes:
+    """
+    SHA-256 of an API key; keys are only held and compared in this form
+    """
+    return hashlib.sha256(token.encode("utf-8", "surrogatepass")).digest()
+
+
+class APIKey:
+    """
+    A caller's key with its quotas and usage: a token bucket for the request
+    rate and a counter of requests in flight.
+    """
+
+    __slots__ = ("name", "digest", "bucket", "max_in_flight", "in_flight")
+
+    def __init__(self, name: str, digest: bytes):
+        self.name = name
+        self.digest = digest
+        self.bucket: Optional[TokenBucket] = None
+        self.max_in_flight = 0
+        self.in_flight = 0
+
+    def configure(self, digest: bytes, rate_limit: float, burst: int, max_in_flight: int) -> None:
+        """
+        Apply (new) limits; usage so far is kept across reloads
+        """
+        self.digest = digest
+        self.max_in_flight = max_in_flight
+        if rate_limit <= 0:
+            self.bucket = None
+        elif self.bucket is None:
+            self.bucket = TokenBucket(rate_limit, burst or default_burst(rate_limit))
+        else:
+            self.bucket.configure(rate_limit, burst or default_burst(rate_limit))
+
+    def acquire(self) -> Optional[Tuple[str, float]]:
+        """
+        Admit one request
+
+        Returns:
+            None if admitted (call release() when it finishes), otherwise the
+            exceeded limit ("concurrency" or "rate") and the seconds to wait
+        """
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return "concurrency", 1.0
+        if self.bucket is not None:
+            wait = self.bucket.take()
+            if wait:
+                return "rate", wait
+        self.in_flight += 1
+        return None
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+
+class APIKeyRegistry:
+    """
+    API keys accepted by the service, indexed by the SHA-256 of the key.
+
+    Besides settings.api_key (named "default"), keys and their limits can be
+    listed in the JSON file at api_keys_file:
+
+        {"keys": [{"name": "billing", "key": "...", "rate_limit": 20,
+                   "burst": 40, "max_in_flight": 8}]}
+
+    ("key_sha256": "<hex digest>" may be given instead of "key"). Limits left
+    out fall back to rate_limit_per_second, rate_limit_burst and
+    max_in_flight_per_key. The file is checked for changes every
+    api_keys_reload_interval seconds and reloaded without a restart; keys
+    that stay keep their usage. A file that fails to load leaves the current
+    keys in place.
+    """
+
+    def __init__(self):
+        self.path = settings.api_keys_file
+        self.reload_interval = settings.api_keys_reload_interval
+        self._keys: Dict[bytes, APIKey] = {}
+        self._by_name: Dict[str, APIKey] = {}
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        self.load()
+
+    def _definitions(self) -> List[dict]:
+        definitions = []
+        if settings.api_key:
+            definitions.append({"name": "default", "key": settings.api_key})
+        if self.path:
+            with open(self.path, encoding="utf-8") as f:
+                definitions.extend(json.load(f)["keys"])
+        return definitions
+
+    def load(self) -> None:
+        """
+        (Re)build the key index from settings and api_keys_file
+
+        Raises:
+            OSError, ValueError, KeyError: the key file can't be read or is malformed
+        """
+        if self.path:
+            self._mtime = os.stat(self.path).st_mtime
+        parsed = {}
+        for definition in self._definitions():
+            name = definition["name"]
+            if "key_sha256" in definition:
+                digest = bytes.fromhex(definition["key_sha256"])
+            else:
+                digest = digest_key(definition["key"])
+            if name in parsed or any(digest == other[0] for other in parsed.values()):
+                raise ValueError(f"Duplicate API key {name}")
+            parsed[name] = (
+                digest,
+                float(definition.get("rate_limit", settings.rate_limit_per_second)),
+                int(definition.get("burst", settings.rate_limit_burst)),
+                int(definition.get("max_in_flight", settings.max_in_flight_per_key))
+            )
+
+        # Only touch live keys once the whole file is known to be valid
+        keys: Dict[bytes, APIKey] = {}
+        by_name: Dict[str, APIKey] = {}
+        for name, (digest, *limits) in parsed.items():
+            api_key = self._by_name.get(name) or APIKey(name, digest)
+            api_key.configure(digest, *limits)
+            keys[digest] = by_name[name] = api_key
+        self._keys, self._by_name = keys, by_name
+        logger.info(f"Loaded {len(keys)} API keys")
+
+    def _reload_if_changed(self) -> None:
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.reload_interval
+        try:
+            if os.stat(self.path).st_mtime != self._mtime:
+                self.load()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Keeping the current API keys, failed to reload {self.path}: {e}")
+
+    def lookup(self, token: Optional[str]) -> Optional[APIKey]:
+        """
+        The key matching a presented token, or None. One hash and one dict
+        lookup regardless of the number of keys.
+        """
+        if self.path:
+            self._reload_if_changed()
+        if not token:
+            return None
+        digest = digest_key(token)
+        api_key = self._keys.get(digest)
+        # Constant-time check of the match, so timing says nothing about stored keys
+        if api_key is None or not hmac.compare_digest(api_key.digest, digest):
+            return None
+        return api_key
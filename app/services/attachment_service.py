@@ -0,0 +1,191 @@
+import hashlib
+import logging
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from uuid import uuid4
+
+import aiofiles
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.multipart import parse_options_header
+
+from app.config import settings
+from app.utils.mime_builder import FileAttachment
+
+logger = logging.getLogger(__name__)
+
+MAX_FORM_FIELD_BYTES = 1048576  # Non-file form fields (e.g. the email JSON) are kept in memory
+
+
+class UploadTooLargeError(ValueError):
+    """An uploaded file or the whole upload exceeds the configured size limits"""
+
+
+class UploadedFile(NamedTuple):
+    """A file received by receive_upload()"""
+
+    attachment: FileAttachment
+    size: int
+    sha256: str
+
+
+def attachment_size_limit(content_type: str) -> int:
+    """
+    Per-file size limit for a content type
+    """
+    if content_type in settings.allowed_image_types:
+        return settings.max_image_size
+    if content_type == "application/pdf":
+        return settings.max_pdf_size
+    return settings.max_file_size
+
+
+def discard_uploads(uploads: List[UploadedFile]) -> None:
+    """
+    Delete uploaded files once they are no longer needed
+    """
+    for upload in uploads:
+        try:
+            os.remove(upload.attachment.path)
+        except FileNotFoundError:
+            pass
+
+
+class _UploadState:
+    """Part being received by the parser callbacks"""
+
+    def __init__(self):
+        # Callbacks run synchronously inside parser.write(); events are
+        # collected here and handled (with async file I/O) after each chunk
+        self.events: List[Tuple[str, Any]] = []
+        self.header_field = b""
+        self.header_value = b""
+        self.headers: Dict[bytes, bytes] = {}
+
+    def on_part_begin(self) -> None:
+        self.headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self.header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = self.header_value = b""
+
+    def on_headers_finished(self) -> None:
+        self.events.append(("headers", self.headers))
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        # Copy: the parser reuses its buffer once the callback returns
+        self.events.append(("data", bytes(data[start:end])))
+
+    def on_part_end(self) -> None:
+        self.events.append(("end", b""))
+
+
+async def receive_upload(request) -> Tuple[Dict[str, str], List[UploadedFile]]:
+    """
+    Streams a multipart/form-data request body to upload_dir.
+
+    File parts are written chunk by chunk as the body arrives, so an upload
+    is never held in memory; size limits (per content type and max_file_size
+    for the upload as a whole) are enforced while streaming and the request
+    is rejected as soon as one is exceeded. The SHA-256 of each file is
+    computed on the way. Non-file fields are returned as strings. On error
+    every file written so far is removed.
+
+    Returns:
+        (form fields, uploaded files) - the caller must discard_uploads() the files
+
+    Raises:
+        ValueError: not a multipart body, or a disallowed content type
+        UploadTooLargeError: a size limit was exceeded
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise ValueError("Content-Type must be multipart/form-data")
+
+    allowed_types = set(settings.allowed_image_types) | set(settings.allowed_document_types)
+    directory = os.path.join(settings.upload_dir, "incoming")
+    os.makedirs(directory, exist_ok=True)
+
+    state = _UploadState()
+    parser = multipart.MultipartParser(params[b"boundary"], callbacks={
+        "on_part_begin": state.on_part_begin,
+        "on_header_field": state.on_header_field,
+        "on_header_value": state.on_header_value,
+        "on_header_end": state.on_header_end,
+        "on_headers_finished": state.on_headers_finished,
+        "on_part_data": state.on_part_data,
+        "on_part_end": state.on_part_end,
+    })
+
+    fields: Dict[str, str] = {}
+    uploads: List[UploadedFile] = []
+    total = 0
+    name = ""
+    field_value = b""
+    current: Optional[FileAttachment] = None
+    digest = None
+    file = None
+    size = limit = 0
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for event, data in state.events:
+                if event == "headers":
+                    headers = data
+                    _, disposition = parse_options_header(headers.get(b"content-disposition", b""))
+                    name = disposition.get(b"name", b"").decode("utf-8", "replace")
+                    if b"filename" not in disposition:
+                        current, field_value = None, b""
+                        continue
+                    filename = os.path.basename(disposition[b"filename"].decode("utf-8", "replace")) or "attachment"
+                    part_type = headers.get(b"content-type", b"application/octet-stream").decode("latin-1").strip().lower()
+                    if part_type not in allowed_types:
+                        raise ValueError(f"File type {part_type} is not allowed for {filename}")
+                    current = FileAttachment(os.path.join(directory, uuid4().hex), filename, part_type)
+                    file = await aiofiles.open(current.path, "wb")
+                    digest = hashlib.sha256()
+                    size, limit = 0, attachment_size_limit(part_type)
+                elif event == "data":
+                    if current is None:
+                        field_value += data
+                        if len(field_value) > MAX_FORM_FIELD_BYTES:
+                            raise UploadTooLargeError(f"Form field {name} exceeds {MAX_FORM_FIELD_BYTES} bytes")
+                        continue
+                    size += len(data)
+                    total += len(data)
+                    if size > limit:
+                        raise UploadTooLargeError(f"{current.filename} exceeds {limit} bytes")
+                    if total > settings.max_file_size:
+                        raise UploadTooLargeError(f"Attachments exceed {settings.max_file_size} bytes in total")
+                    digest.update(data)
+                    await file.write(data)
+                elif event == "end":
+                    if current is None:
+                        fields[name] = field_value.decode("utf-8", "replace")
+                    else:
+                        await file.close()
+                        uploads.append(UploadedFile(current, size, digest.hexdigest()))
+                        file = None
+                        current = None
+            state.events.clear()
+        parser.finalize()
+    except BaseException:
+        if file is not None:
+            await file.close()
+            os.remove(current.path)
+        discard_uploads(uploads)
+        raise
+
+    logger.info(f"Received {len(uploads)} attachments ({total} bytes)")
+    return fields, uploads
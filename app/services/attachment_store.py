@@ -0,0 +1,494 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from app.config import settings
+from app.services.attachment_service import UploadedFile
+from app.utils.mime_builder import FileAttachment
+
+logger = logging.getLogger(__name__)
+
+TOUCH_INTERVAL = 60.0  # Seconds between last-used updates on disk for one attachment
+LOCK_FILE = ".lock"
+_ATTACHMENT_ID = re.compile(r"[0-9a-f]{64}")
+
+
+class AttachmentError(Exception):
+    """An attachment referenced by a send request can't be used"""
+
+
+class AttachmentNotFoundError(AttachmentError, LookupError):
+    """An attachment handle does not exist in the store"""
+
+
+class StoredAttachment(NamedTuple):
+    """Metadata of one stored attachment"""
+
+    attachment_id: str
+    filename: str
+    content_type: str
+    size: int
+
+
+class _Entry:
+    __slots__ = ("meta", "refcount", "pins", "handle", "last_used", "touched", "lock")
+
+    def __init__(self, meta: StoredAttachment, refcount: int, last_used: float):
+        self.meta = meta
+        self.refcount = refcount    # Durable references as last read from disk, where they are kept
+        self.pins = 0               # In-process sends currently using the file
+        self.handle: Optional[BinaryIO] = None  # Holds a shared lock on the file while pinned
+        self.last_used = last_used
+        self.touched = last_used
+        self.lock = threading.Lock()  # Serializes encoding of the base64 cache
+
+
+class AttachmentStore:
+    """
+    Content-addressed attachment store under upload_dir/store.
+
+    Files are keyed by their SHA-256, so uploading the same content twice
+    stores it once and returns the same handle. Next to each file the store
+    keeps its metadata (<id>.json) and, after the first send, its base64
+    MIME encoding (<id>.b64), which every later send streams as is: bulk
+    sends of the same attachment pay the encoding cost once.
+
+    Attachments are reference counted. Durable references (queued emails)
+    are persisted in the metadata; in-flight sends pin entries in memory.
+    Unreferenced attachments are garbage collected when unused for
+    attachment_store_ttl seconds, and least recently used first while the
+    store exceeds attachment_store_max_bytes.
+
+    Several worker processes share one store. Each indexes it in memory,
+    falling back to the metadata on disk for attachments uploaded through
+    another worker. Durable references are only changed on disk, under a
+    store-wide file lock that garbage collection takes too, and a pinned
+    file holds a shared lock that keeps every worker from collecting it.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.path.join(settings.upload_dir, "store")
+        self.max_bytes = settings.attachment_store_max_bytes
+        self.ttl = settings.attachment_store_ttl
+        self.gc_interval = settings.attachment_store_gc_interval
+        self._entries: Optional[Dict[str, _Entry]] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    # Layout
+
+    def _path(self, attachment_id: str, suffix: str = "") -> str:
+        return os.path.join(self.root, attachment_id[:2], attachment_id + suffix)
+
+    def preview_dir(self, attachment_id: str) -> str:
+        """
+        Directory for files derived from an attachment (e.g. rendered PDF
+        pages); it is removed together with the attachment
+        """
+        return self._path(attachment_id, ".preview")
+
+    def _write_meta(self, meta: StoredAttachment, refcount: int) -> None:
+        path = self._path(meta.attachment_id, ".json")
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, "w") as f:
+            json.dump({**meta._asdict(), "refcount": refcount}, f)
+        os.replace(temp, path)
+
+    def _read_meta(self, attachment_id: str) -> Optional[_Entry]:
+        """
+        Entry for the metadata on disk, None if there is none
+
+        Raises:
+            OSError, ValueError, TypeError: the metadata is unreadable
+        """
+        path = self._path(attachment_id, ".json")
+        try:
+            with open(path) as f:
+                data = json.load(f)
+                modified = os.fstat(f.fileno()).st_mtime
+        except FileNotFoundError:
+            return None
+        refcount = data.pop("refcount", 0)
+        return _Entry(StoredAttachment(**data), refcount, modified)
+
+    @contextmanager
+    def _store_lock(self) -> Iterator[None]:
+        """
+        Exclusive lock across worker processes (and threads), held while
+        durable references change and while garbage is collected
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self) -> Dict[str, _Entry]:
+        """
+        Index the store on first use
+        """
+        if self._entries is not None:
+            return self._entries
+        with self._lock:
+            if self._entries is None:
+                entries = {}
+                os.makedirs(self.root, exist_ok=True)
+                for directory, _, files in os.walk(self.root):
+                    for name in files:
+                        attachment_id = name[:-len(".json")]
+                        if not name.endswith(".json") or not _ATTACHMENT_ID.fullmatch(attachment_id):
+                            continue
+                        try:
+                            entry = self._read_meta(attachment_id)
+                        except (OSError, ValueError, TypeError) as e:
+                            logger.warning(f"Skipping unreadable attachment metadata {os.path.join(directory, name)}: {e}")
+                            continue
+                        if entry is not None:
+                            entries[attachment_id] = entry
+                self._entries = entries
+                logger.info(f"Attachment store loaded with {len(entries)} attachments")
+        return self._entries
+
+    def _lookup(self, attachment_id: str) -> Optional[_Entry]:
+        """
+        Indexed entry, or the one on disk if another worker process stored
+        it after this one loaded the index
+        """
+        entries = self._load()
+        entry = entries.get(attachment_id)
+        if entry is not None or not _ATTACHMENT_ID.fullmatch(attachment_id):
+            return entry
+        try:
+            entry = self._read_meta(attachment_id)
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"Unreadable attachment metadata for {attachment_id}: {e}")
+            return None
+        if entry is None:
+            return None
+        with self._lock:
+            return entries.setdefault(attachment_id, entry)
+
+    # Upload
+
+    def put(self, upload: UploadedFile) -> Tuple[StoredAttachment, bool]:
+        """
+        Move an uploaded file into the store. Blocking.
+
+        Returns:
+            (stored attachment, whether the content was already stored)
+        """
+        entries = self._load()
+        attachment_id = upload.sha256
+        entry = self._lookup(attachment_id)
+        if entry is not None:
+            entry.last_used = time.time()
+            os.remove(upload.attachment.path)
+            try:
+                # Tells the other workers' clean-ups it is in use again
+                os.utime(self._path(attachment_id, ".json"))
+            except OSError:
+                pass
+            return entry.meta, True
+
+        os.makedirs(os.path.dirname(self._path(attachment_id)), exist_ok=True)
+        with self._store_lock():
+            # Another worker may have stored the same content meanwhile
+            entry = self._read_meta(attachment_id)
+            existed = entry is not None
+            if existed:
+                os.remove(upload.attachment.path)
+            else:
+                os.replace(upload.attachment.path, self._path(attachment_id))
+                meta = StoredAttachment(
+                    attachment_id, upload.attachment.filename, upload.attachment.content_type, upload.size
+                )
+                self._write_meta(meta, 0)
+                entry = _Entry(meta, 0, time.time())
+        with self._lock:
+            existing = entries.setdefault(attachment_id, entry)
+        return existing.meta, existed or existing is not entry
+
+    def get(self, attachment_id: str) -> StoredAttachment:
+        """
+        Metadata of a stored attachment
+        """
+        entry = self._lookup(attachment_id)
+        if entry is None:
+            raise AttachmentNotFoundError(f"Unknown attachment {attachment_id}")
+        return entry.meta
+
+    # References
+
+    def _add_references(self, attachment_id: str, delta: int) -> bool:
+        # Read-modify-write of the count on disk; the caller holds the store lock
+        current = self._read_meta(attachment_id) if _ATTACHMENT_ID.fullmatch(attachment_id) else None
+        if current is None:
+            return False
+        refcount = max(current.refcount + delta, 0)
+        self._write_meta(current.meta, refcount)
+        entries = self._load()
+        with self._lock:
+            entry = entries.setdefault(attachment_id, current)
+            entry.refcount = refcount
+            entry.last_used = time.time()
+        return True
+
+    def retain(self, attachment_ids: List[str]) -> None:
+        """
+        Add durable references (e.g. from a queued email). Blocking.
+
+        Raises:
+            AttachmentNotFoundError: a handle is not in the store
+        """
+        with self._store_lock():
+            for done, attachment_id in enumerate(attachment_ids):
+                if not self._add_references(attachment_id, 1):
+                    for retained in attachment_ids[:done]:
+                        self._add_references(retained, -1)
+                    raise AttachmentNotFoundError(f"Unknown attachment {attachment_id}")
+
+    def release(self, attachment_ids: List[str]) -> None:
+        """
+        Drop durable references added by retain(), possibly in another
+        worker process. Blocking.
+        """
+        with self._store_lock():
+            for attachment_id in attachment_ids:
+                self._add_references(attachment_id, -1)
+
+    def _encoded(self, entry: _Entry) -> str:
+        """
+        Path of the cached base64 encoding, creating it on first use
+        """
+        path = self._path(entry.meta.attachment_id, ".b64")
+        if os.path.exists(path):
+            return path
+        with entry.lock:
+            if not os.path.exists(path):
+                temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                source = FileAttachment(self._path(entry.meta.attachment_id), entry.meta.filename)
+                with open(temp, "wb") as target:
+                    for block in source.iter_base64():
+                        target.write(block)
+                os.replace(temp, path)
+        return path
+
+    def pin(self, refs: List[Tuple[str, Optional[str]]]) -> List[FileAttachment]:
+        """
+        Resolve (attachment_id, filename override) pairs for a send and
+        protect them from garbage collection until unpin(). Encodes
+        attachments on their first use, so call off the event loop.
+
+        Raises:
+            AttachmentNotFoundError: a handle is not in the store
+        """
+        entries = []
+        now = time.time()
+        try:
+            for attachment_id, _ in refs:
+                entries.append(self._pin(attachment_id))
+            attachments = []
+            for entry, (_, filename) in zip(entries, refs):
+                attachments.append(FileAttachment(
+                    self._path(entry.meta.attachment_id),
+                    filename or entry.meta.filename,
+                    entry.meta.content_type,
+                    self._encoded(entry)
+                ))
+                if now - entry.touched > TOUCH_INTERVAL:
+                    # Keep last-used on disk roughly current for other workers and the next load
+                    entry.touched = now
+                    os.utime(self._path(entry.meta.attachment_id, ".json"))
+        except BaseException:
+            self.unpin([entry.meta.attachment_id for entry in entries])
+            raise
+        return attachments
+
+    def _pin(self, attachment_id: str) -> _Entry:
+        entry = self._lookup(attachment_id)
+        if entry is None:
+            raise AttachmentNotFoundError(f"Unknown attachment {attachment_id}")
+        with self._lock:
+            if entry.pins:
+                # This process already holds the shared lock on the file
+                entry.pins += 1
+                entry.last_used = time.time()
+                return entry
+        # The file lock is taken before the index lock, as in _collect(), and
+        # never while holding it: waiting for a clean-up must not block unpin()
+        handle = self._lock_shared(entry)
+        with self._lock:
+            if entry.handle is None:
+                entry.handle = handle
+            else:
+                handle.close()  # Pinned concurrently; one shared lock is enough
+            entry.pins += 1
+            entry.last_used = time.time()
+        return entry
+
+    def _lock_shared(self, entry: _Entry) -> BinaryIO:
+        """
+        Open the file with a shared lock, which collect() in any worker
+        process respects; waits while one is removing it
+
+        Raises:
+            AttachmentNotFoundError: it was removed
+        """
+        attachment_id = entry.meta.attachment_id
+        try:
+            handle = open(self._path(attachment_id), "rb")
+        except FileNotFoundError:
+            handle = None
+        if handle is not None:
+            fcntl.flock(handle, fcntl.LOCK_SH)
+            if os.fstat(handle.fileno()).st_nlink:
+                return handle
+            handle.close()
+        # Collected, by this or another worker process
+        with self._lock:
+            if self._entries.get(attachment_id) is entry and not entry.pins:
+                del self._entries[attachment_id]
+        raise AttachmentNotFoundError(f"Unknown attachment {attachment_id}")
+
+    def unpin(self, attachment_ids: List[str]) -> None:
+        """
+        Release pins taken by pin()
+        """
+        entries = self._load()
+        with self._lock:
+            for attachment_id in attachment_ids:
+                entry = entries.get(attachment_id)
+                if entry is None or entry.pins == 0:
+                    continue
+                entry.pins -= 1
+                if entry.pins == 0 and entry.handle is not None:
+                    entry.handle.close()
+                    entry.handle = None
+
+    # Garbage collection
+
+    def _remove(self, attachment_id: str) -> None:
+        for suffix in (".json", "", ".b64"):
+            try:
+                os.remove(self._path(attachment_id, suffix))
+            except FileNotFoundError:
+                pass
+        shutil.rmtree(self.preview_dir(attachment_id), ignore_errors=True)
+
+    def collect(self) -> int:
+        """
+        Remove unreferenced attachments that expired, then least recently
+        used ones while the store is over its size limit. Blocking.
+
+        Returns:
+            number of attachments removed
+        """
+        entries = self._load()
+        now = time.time()
+        with self._lock:
+            total = sum(entry.meta.size for entry in entries.values())
+            candidates = sorted(
+                # Refcounts may have been released by another worker; _collect() reads them from disk
+                (entry for entry in entries.values() if entry.pins == 0),
+                key=lambda entry: entry.last_used
+            )
+        removed = 0
+        with self._store_lock():
+            for entry in candidates:
+                if not (now - entry.last_used > self.ttl or total > self.max_bytes):
+                    continue
+                outcome = self._collect(entry, now, total > self.max_bytes)
+                if outcome is not None:
+                    total -= entry.meta.size
+                    removed += outcome
+        if removed:
+            logger.info(f"Removed {removed} unused attachments")
+        return removed
+
+    def _collect(self, entry: _Entry, now: float, over_size: bool) -> Optional[bool]:
+        """
+        Remove one candidate unless another worker process referenced or
+        used it since this one looked; the caller holds the store lock
+
+        Returns:
+            True if removed, False if it was already gone, None if kept
+        """
+        entries = self._entries
+        attachment_id = entry.meta.attachment_id
+        try:
+            current = self._read_meta(attachment_id)
+        except (OSError, ValueError, TypeError):
+            return None
+        if current is None:
+            with self._lock:
+                if entries.get(attachment_id) is entry:
+                    del entries[attachment_id]
+            return False
+        entry.refcount = current.refcount
+        entry.last_used = max(entry.last_used, current.last_used)
+        if entry.refcount or not (now - entry.last_used > self.ttl or over_size):
+            return None
+        try:
+            handle = open(self._path(attachment_id), "rb")
+        except FileNotFoundError:
+            handle = None
+        try:
+            if handle is not None:
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return None  # Pinned by a send in some worker
+            with self._lock:
+                if entry.pins:
+                    return None
+                if entries.get(attachment_id) is entry:
+                    del entries[attachment_id]
+            self._remove(attachment_id)
+            return True
+        finally:
+            if handle is not None:
+                handle.close()
+
+    def stats(self) -> dict:
+        """
+        Store size and reference counts
+        """
+        entries = self._load()
+        with self._lock:
+            return {
+                "attachments": len(entries),
+                "bytes": sum(entry.meta.size for entry in entries.values()),
+                "max_bytes": self.max_bytes,
+                "referenced": sum(1 for entry in entries.values() if entry.refcount or entry.pins)
+            }
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.gc_interval)
+            try:
+                await asyncio.to_thread(self.collect)
+            except Exception as e:
+                logger.error(f"Attachment store clean-up failed: {e}")
+
+    def start(self) -> None:
+        """
+        Start periodic garbage collection
+        """
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
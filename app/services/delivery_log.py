@@ -0,0 +1,302 @@
+import asyncio
+import base64
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.config import settings
+from app.database import run_db, utcnow
+
+if TYPE_CHECKING:
+    from app.models.delivery_log import DeliveryLog
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = ("email_id", "recipient", "status", "email_type", "subject", "error", "created_at")
+
+
+class InvalidCursorError(ValueError):
+    """A pagination cursor that was not issued by query()"""
+
+
+def _encode_cursor(created_at: datetime, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{row_id}".encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except ValueError as e:
+        raise InvalidCursorError("Invalid cursor") from e
+
+
+def _entry(row: dict) -> dict:
+    return {**row, "created_at": row["created_at"].isoformat()}
+
+
+def _row(log: "DeliveryLog") -> dict:
+    row = {name: getattr(log, name) for name in _COLUMNS}
+    if row["created_at"].tzinfo is None:
+        # SQLite hands back naive datetimes; they are stored in UTC
+        row["created_at"] = row["created_at"].replace(tzinfo=timezone.utc)
+    return row
+
+
+class DeliveryLogService:
+    """
+    Per-recipient delivery log in the delivery_logs table.
+
+    record() only appends rows to an in-memory buffer, so logging never adds
+    a database round trip to the send path. A background task writes the
+    buffer with one bulk insert per delivery_log_batch_size rows, every
+    delivery_log_flush_interval seconds or as soon as a batch is full. If
+    the database is unreachable the rows are kept (up to
+    delivery_log_max_buffer, oldest dropped first) and retried.
+    """
+
+    def __init__(self):
+        self.enabled = settings.delivery_log_enabled
+        self.flush_interval = settings.delivery_log_flush_interval
+        self.batch_size = settings.delivery_log_batch_size
+        self.max_buffer = settings.delivery_log_max_buffer
+        self._buffer: Deque[dict] = deque()
+        self._flushing: List[dict] = []  # Rows being inserted, still visible to get()
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.dropped = 0
+
+    # Send path
+
+    def record(
+        self,
+        email_id: str,
+        email_type: str,
+        subject: Optional[str],
+        recipients: Iterable[str],
+        status: str,
+        message: Optional[str] = None,
+        rejected: Optional[Dict[str, str]] = None,
+        suppressed: Iterable[str] = ()
+    ) -> None:
+        """
+        Buffer the outcome of one delivery attempt, one row per recipient.
+
+        status is the send result (success, partial or failed); rejected
+        maps the recipients the relay refused to the reason. suppressed
+        recipients were on the suppression list and not sent to.
+        """
+        if not self.enabled:
+            return
+        rejected = rejected or {}
+        now = utcnow()
+        for recipient in suppressed:
+            self._buffer.append({
+                "email_id": email_id,
+                "recipient": recipient,
+                "status": "suppressed",
+                "email_type": email_type,
+                "subject": subject,
+                "error": "Recipient is on the suppression list",
+                "created_at": now
+            })
+        for recipient in recipients:
+            if status == "failed":
+                row_status, error = "failed", rejected.get(recipient, message)
+            elif recipient in rejected:
+                row_status, error = "rejected", rejected[recipient]
+            else:
+                row_status, error = "sent", None
+            self._buffer.append({
+                "email_id": email_id,
+                "recipient": recipient,
+                "status": row_status,
+                "email_type": email_type,
+                "subject": subject,
+                "error": error,
+                "created_at": now
+            })
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow > 0:
+            for _ in range(overflow):
+                self._buffer.popleft()
+            self.dropped += overflow
+        if self._full is not None and len(self._buffer) >= self.batch_size:
+            self._full.set()
+
+    # Background flushing (database operations import SQLAlchemy and the
+    # models on first use, so a disabled log never loads them)
+
+    @staticmethod
+    def _insert(db, rows: List[dict]) -> None:
+        from sqlalchemy import insert
+        from app.models.delivery_log import DeliveryLog
+
+        db.execute(insert(DeliveryLog), rows)
+        db.commit()
+
+    async def flush(self) -> int:
+        """
+        Write buffered rows, batch_size at a time
+
+        Returns:
+            number of rows written
+        """
+        written = 0
+        while self._buffer:
+            rows = self._flushing = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            try:
+                await run_db(self._insert, rows)
+            except BaseException:
+                # Put the rows back in order for the next attempt
+                self._buffer.extendleft(reversed(rows))
+                raise
+            finally:
+                self._flushing = []
+            written += len(rows)
+        return written
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to write delivery log ({len(self._buffer)} rows pending): {e}")
+                await asyncio.sleep(self.flush_interval)
+            if self.dropped:
+                logger.warning(f"Delivery log buffer full, dropped {self.dropped} rows")
+                self.dropped = 0
+
+    def start(self) -> None:
+        """
+        Start the background flusher
+        """
+        if not self.enabled:
+            return
+        self._full = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop the flusher and write what is still buffered
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Lost {len(self._buffer)} delivery log rows on shutdown: {e}")
+
+    # Lookups
+
+    @staticmethod
+    def _fetch(db, email_id: str) -> Tuple[List[dict], Optional[str]]:
+        from sqlalchemy import select
+        from app.models import DeliveryLog, OutboundEmail
+
+        rows = db.execute(
+            select(DeliveryLog).where(DeliveryLog.email_id == email_id).order_by(DeliveryLog.id)
+        ).scalars().all()
+        queue_status = None
+        if settings.queue_enabled:
+            queue_status = db.execute(
+                select(OutboundEmail.status).where(OutboundEmail.id == email_id)
+            ).scalar_one_or_none()
+        return [_entry(_row(row)) for row in rows], queue_status
+
+    async def get(self, email_id: str) -> Optional[dict]:
+        """
+        Delivery history of one email, including rows not flushed yet
+
+        Returns:
+            {"email_id", "status", "recipients", "attempts"} or None if unknown
+        """
+        attempts, queue_status = await run_db(self._fetch, email_id)
+        stored = {(attempt["recipient"], attempt["created_at"]) for attempt in attempts}
+        for row in [*self._flushing, *self._buffer]:
+            if row["email_id"] == email_id:
+                attempt = _entry(row)
+                # A batch being flushed may already be committed
+                if (attempt["recipient"], attempt["created_at"]) not in stored:
+                    attempts.append(attempt)
+        if not attempts and queue_status is None:
+            return None
+
+        latest: Dict[str, str] = {}
+        for attempt in attempts:
+            latest[attempt["recipient"]] = attempt["status"]
+        if queue_status is not None and (queue_status not in ("sent", "failed") or not latest):
+            status = queue_status  # still queued, sending or retrying
+        elif all(value == "sent" for value in latest.values()):
+            status = "sent"
+        elif any(value == "sent" for value in latest.values()):
+            status = "partial"
+        elif all(value == "suppressed" for value in latest.values()):
+            status = "suppressed"
+        else:
+            status = "failed"
+        return {"email_id": email_id, "status": status, "recipients": latest, "attempts": attempts}
+
+    @staticmethod
+    def _query(
+        db,
+        status: Optional[str],
+        recipient: Optional[str],
+        since: Optional[datetime],
+        until: Optional[datetime],
+        after: Optional[Tuple[datetime, int]],
+        limit: int
+    ) -> List["DeliveryLog"]:
+        from sqlalchemy import select, tuple_
+        from app.models.delivery_log import DeliveryLog
+
+        statement = select(DeliveryLog)
+        if status:
+            statement = statement.where(DeliveryLog.status == status)
+        if recipient:
+            statement = statement.where(DeliveryLog.recipient == recipient)
+        if since:
+            statement = statement.where(DeliveryLog.created_at >= since)
+        if until:
+            statement = statement.where(DeliveryLog.created_at < until)
+        if after:
+            statement = statement.where(tuple_(DeliveryLog.created_at, DeliveryLog.id) < tuple_(*after))
+        statement = statement.order_by(DeliveryLog.created_at.desc(), DeliveryLog.id.desc()).limit(limit)
+        return db.execute(statement).scalars().all()
+
+    async def query(
+        self,
+        status: Optional[str] = None,
+        recipient: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100
+    ) -> dict:
+        """
+        Log rows, newest first, paginated by keyset: pass the returned
+        next_cursor to get the following page. Each page is one indexed
+        range scan regardless of how deep it is.
+
+        Raises:
+            InvalidCursorError: cursor was not returned by a previous query
+        """
+        after = _decode_cursor(cursor) if cursor else None
+        rows = await run_db(self._query, status, recipient, since, until, after, limit + 1)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(rows[-1].created_at, rows[-1].id)
+        return {
+            "items": [{"id": row.id, **_entry(_row(row))} for row in rows],
+            "next_cursor": next_cursor
+        }
@@ -1,50 +1,251 @@
+import asyncio
 import logging
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterable, AsyncIterator, Iterable, Set, Tuple, Union
 from uuid import uuid4
 
-from app.schemas.email import EmailSendRequest
-from app.utils.smtp_client import SMTPClient
+from app.config import settings
+from app.schemas.email import AttachmentRef, EmailSendRequest
+from app.services.attachment_store import AttachmentError, AttachmentStore
+from app.services.delivery_log import DeliveryLogService
+from app.services.pdf_preview import PDFPreviewService, embed_previews
+from app.services.suppression import SuppressionService
+from app.services.template_service import TemplateService
+from app.utils.delivery_planner import dedupe_recipients
+from app.utils.html_content import HTMLContentProcessor
+from app.utils.metrics import EMAILS_IN_FLIGHT, record_email
+from app.utils.mime_builder import FileAttachment
+from app.utils.smtp_client import SMTPClient, is_transient_error
+from app.utils.templates import TemplateError
 
 logger = logging.getLogger(__name__)
 
+_in_flight = EMAILS_IN_FLIGHT.labels()
+
+BatchItem = Tuple[int, Union[EmailSendRequest, str]]
+ChunkItem = Tuple[int, str, dict, List[AttachmentRef], List[str]]  # index, email_id, message fields, attachments, suppressed
+AttachmentRefs = List[Tuple[str, Optional[str]]]  # (attachment_id, filename override)
+
+
+async def _aiter(items: Union[Iterable[BatchItem], AsyncIterable[BatchItem]]) -> AsyncIterator[BatchItem]:
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
 class EmailService:
     def __init__(self):
         self.smtp_client = SMTPClient()
+        self.attachments = AttachmentStore()
+        self.previews = PDFPreviewService(self.attachments)
+        self.templates = TemplateService()
+        self.delivery_log = DeliveryLogService()
+        self.suppressions = SuppressionService()
+        self.html = HTMLContentProcessor(
+            settings.html_sanitize, settings.html_cache_max_bytes, settings.html_offload_bytes
+        )
+        self.batch_session_size = settings.batch_session_size
+        self.batch_max_sessions = settings.batch_max_sessions
 
-    async def send_email(self, email_request: EmailSendRequest) -> dict:
+    async def send_email(
+        self, email_request: EmailSendRequest, email_id: Optional[str] = None, only_to: Optional[List[str]] = None
+    ) -> dict:
         """
         Sends an email based on the request type (plain, html, or multipart).
+        Queue workers pass the email_id that was assigned at enqueue time,
+        and on a retry only_to, the recipients the relay deferred last time.
+        Suppressed recipients are dropped first; when none are left nothing
+        is rendered or sent and the status is "suppressed".
+
+        A partial result lists under "deferred" the rejected recipients worth
+        retrying (4xx replies, dropped sessions).
+
+        Raises:
+            AttachmentError: the request references an unknown attachment,
+                or asks for the preview of one that isn't a readable PDF
+            TemplateError: the template is unknown or its variables are missing
         """
-        email_id = str(uuid4())
+        email_id = email_id or str(uuid4())
+        email_request, suppressed = await self._without_suppressed(email_request)
+        if only_to is not None:
+            only_to = [address for address in only_to if address not in suppressed]
+            remaining = only_to
+        else:
+            remaining = email_request.recipients or email_request.cc or email_request.bcc
+        if suppressed and not remaining:
+            return self._all_suppressed(email_request, email_id, suppressed)
+        email_request = await self._prepare(email_request)
         logger.info(f"[{email_id}] Sending {email_request.email_type} email to {email_request.recipients}")
 
+        refs = self._attachment_refs(email_request)
+        attachments = await self._pin(refs) if refs else None
+        try:
+            attachment_fields = await self._attachment_fields(
+                email_request.attachments, email_request.html_body, attachments
+            ) if attachments else {}
+            _in_flight.inc()
+            try:
+                result = await self._send(email_request, email_id, attachment_fields, only_to)
+            finally:
+                _in_flight.dec()
+        finally:
+            if refs:
+                self.attachments.unpin([attachment_id for attachment_id, _ in refs])
+        record_email(email_request.email_type, result["status"])
+        if suppressed:
+            result["suppressed"] = suppressed
+        self.delivery_log.record(
+            email_id,
+            email_request.email_type,
+            email_request.subject,
+            only_to if only_to is not None else dedupe_recipients(
+                [*email_request.recipients, *(email_request.cc or ()), *(email_request.bcc or ())]
+            ),
+            result["status"],
+            result["message"],
+            result.get("rejected"),
+            suppressed
+        )
+        return result
+
+    async def _without_suppressed(self, email_request: EmailSendRequest) -> Tuple[EmailSendRequest, List[str]]:
+        """
+        The request without recipients on the suppression list, and those recipients
+        """
+        addresses = [*email_request.recipients, *(email_request.cc or ()), *(email_request.bcc or ())]
+        suppressed = await self.suppressions.check(addresses)
+        if not suppressed:
+            return email_request, []
+
+        def keep(values: Optional[List[str]]) -> Optional[List[str]]:
+            return [address for address in values if address not in suppressed] if values else values
+
+        update = {
+            "recipients": keep(email_request.recipients),
+            "cc": keep(email_request.cc) or None,
+            "bcc": keep(email_request.bcc) or None
+        }
+        return email_request.model_copy(update=update), dedupe_recipients(
+            address for address in addresses if address in suppressed
+        )
+
+    def _all_suppressed(self, email_request: EmailSendRequest, email_id: str, suppressed: List[str]) -> dict:
+        logger.info(f"[{email_id}] Not sent, all {len(suppressed)} recipients are suppressed")
+        record_email(email_request.email_type, "suppressed")
+        self.delivery_log.record(
+            email_id, email_request.email_type, email_request.subject, (), "suppressed", suppressed=suppressed
+        )
+        return {
+            "email_id": email_id,
+            "status": "suppressed",
+            "message": "Not sent: all recipients are on the suppression list.",
+            "suppressed": suppressed
+        }
+
+    async def _prepare(self, email_request: EmailSendRequest) -> EmailSendRequest:
+        """
+        Renders the template, or sanitizes html_body and generates the
+        missing plain-text part of a multipart email
+
+        Raises:
+            TemplateError: the template is unknown or its variables are missing
+        """
+        if email_request.template_id:
+            # Templates are sanitized once when compiled
+            return await self.templates.apply(email_request)
+        if email_request.email_type == "plain":
+            return email_request
+        with_text = email_request.email_type == "multipart" and not email_request.body
+        if not (with_text or self.html.sanitize):
+            return email_request
+        html_body, text = await self.html.prepare(email_request.html_body, with_text)
+        update = {"html_body": html_body}
+        if with_text:
+            update["body"] = text
+        return email_request.model_copy(update=update)
+
+    async def _attachment_fields(
+        self,
+        refs: List[AttachmentRef],
+        html_body: Optional[str],
+        attachments: List[FileAttachment]
+    ) -> dict:
+        """
+        build_message() arguments for pinned attachments. Requested PDF
+        previews are rendered and embedded in the HTML body as inline images.
+        """
+        fields: Dict[str, Any] = {"attachments": attachments}
+        inline: List[FileAttachment] = []
+        blocks = []
+        for ref, attachment in zip(refs, attachments):
+            if not ref.preview_page_count:
+                continue
+            images = await self.previews.render(ref.id, attachment, ref.preview_page_count)
+            inline.extend(images)
+            blocks.append(self.previews.preview_html(attachment.filename, images))
+        if inline:
+            fields["inline"] = inline
+            fields["html_body"] = embed_previews(html_body, blocks)
+        return fields
+
+    async def _send(
+        self,
+        email_request: EmailSendRequest,
+        email_id: str,
+        attachment_fields: dict,
+        only_to: Optional[List[str]] = None
+    ) -> dict:
         try:
-            if email_request.email_type == "plain":
-                await self.smtp_client.send_plain_email(
+            if attachment_fields:
+                attachments = attachment_fields["attachments"]
+                report = await self.smtp_client.send_email_with_attachments(
+                    email_type=email_request.email_type,
                     recipients=email_request.recipients,
                     subject=email_request.subject,
+                    attachments=attachments,
                     body=email_request.body,
+                    html_body=attachment_fields.get("html_body", email_request.html_body),
                     sender_email=email_request.sender_email,
                     sender_name=email_request.sender_name,
                     cc=email_request.cc,
-                    bcc=email_request.bcc
+                    bcc=email_request.bcc,
+                    inline=attachment_fields.get("inline"),
+                    priority=email_request.priority,
+                    only_to=only_to
+                )
+                message = f"Email with {len(attachments)} attachments sent successfully."
+
+            elif email_request.email_type == "plain":
+                report = await self.smtp_client.send_plain_email(
+                    recipients=email_request.recipients,
+                    subject=email_request.subject,
+                    body=email_request.body,
+                    sender_email=email_request.sender_email,
+                    sender_name=email_request.sender_name,
+                    cc=email_request.cc,
+                    bcc=email_request.bcc,
+                    priority=email_request.priority,
+                    only_to=only_to
                 )
                 message = "Plain text email sent successfully."
             
             elif email_request.email_type == "html":
-                await self.smtp_client.send_html_email(
+                report = await self.smtp_client.send_html_email(
                     recipients=email_request.recipients,
                     subject=email_request.subject,
                     html_body=email_request.html_body,
                     sender_email=email_request.sender_email,
                     sender_name=email_request.sender_name,
                     cc=email_request.cc,
-                    bcc=email_request.bcc
+                    bcc=email_request.bcc,
+                    priority=email_request.priority,
+                    only_to=only_to
                 )
                 message = "HTML email sent successfully."
             
             elif email_request.email_type == "multipart":
-                await self.smtp_client.send_multipart_email(
+                report = await self.smtp_client.send_multipart_email(
                     recipients=email_request.recipients,
                     subject=email_request.subject,
                     text_body=email_request.body,
@@ -52,13 +253,29 @@ class EmailService:
                     sender_email=email_request.sender_email,
                     sender_name=email_request.sender_name,
                     cc=email_request.cc,
-                    bcc=email_request.bcc
+                    bcc=email_request.bcc,
+                    priority=email_request.priority,
+                    only_to=only_to
                 )
                 message = "Multipart email sent successfully."
             
             else:
                 raise ValueError(f"Unsupported email type: {email_request.email_type}")
 
+            if report.rejected:
+                logger.warning(f"[{email_id}] Email partially sent, rejected: {report.errors()}")
+                result = {
+                    "email_id": email_id,
+                    "status": "partial",
+                    "message": report.summary(),
+                    "accepted": report.accepted,
+                    "rejected": report.errors()
+                }
+                deferred = [address for address, error in report.rejected.items() if is_transient_error(error)]
+                if deferred:
+                    result["deferred"] = deferred
+                return result
+
             logger.info(f"[{email_id}] Email sent successfully")
             return {
                 "email_id": email_id,
@@ -66,13 +283,196 @@ class EmailService:
                 "message": message
             }
         except Exception as e:
-            logger.error(f"[{email_id}] Failed to send email: {e}")
+            retryable = is_transient_error(e)
+            logger.error(f"[{email_id}] Failed to send email ({'transient' if retryable else 'permanent'}): {e}")
             return {
                 "email_id": email_id,
                 "status": "failed",
-                "message": f"Failed to send email: {e}"
+                "message": f"Failed to send email: {e}",
+                "retryable": retryable
             }
 
+    async def _pin(self, refs: AttachmentRefs) -> List[FileAttachment]:
+        """
+        AttachmentStore.pin() off the event loop. If the caller is cancelled
+        while the thread is still pinning, the pins are given back once taken.
+        """
+        pinning = asyncio.ensure_future(asyncio.to_thread(self.attachments.pin, refs))
+        try:
+            return await asyncio.shield(pinning)
+        except asyncio.CancelledError:
+            def unpin(future: asyncio.Future) -> None:
+                if not future.cancelled() and future.exception() is None:
+                    self.attachments.unpin([attachment_id for attachment_id, _ in refs])
+
+            pinning.add_done_callback(unpin)
+            raise
+
+    @staticmethod
+    def _attachment_refs(email_request: EmailSendRequest) -> AttachmentRefs:
+        return [(ref.id, ref.filename) for ref in email_request.attachments or ()]
+
+    @staticmethod
+    def _message_fields(email_request: EmailSendRequest) -> dict:
+        """
+        Maps a request onto SMTPClient.build_message() arguments
+        """
+        return {
+            "email_type": email_request.email_type,
+            "recipients": email_request.recipients,
+            "subject": email_request.subject,
+            "body": email_request.body,
+            "html_body": email_request.html_body,
+            "sender_email": email_request.sender_email,
+            "sender_name": email_request.sender_name,
+            "cc": email_request.cc,
+            "bcc": email_request.bcc
+        }
+
+    def _failed_item(self, index: int, email_id: str, fields: dict, suppressed: List[str], message: str) -> dict:
+        record_email(fields["email_type"], "failed")
+        self.delivery_log.record(
+            email_id, fields["email_type"], fields["subject"],
+            dedupe_recipients([*fields["recipients"], *(fields["cc"] or ()), *(fields["bcc"] or ())]),
+            "failed", message, suppressed=suppressed
+        )
+        return {"index": index, "email_id": email_id, "status": "failed", "message": message}
+
+    async def _send_chunk(self, chunk: List[ChunkItem], priority: str) -> List[dict]:
+        results = []
+        sendable = []
+        pinned = []
+        try:
+            for index, email_id, fields, attachment_refs, suppressed in chunk:
+                if attachment_refs:
+                    refs = [(ref.id, ref.filename) for ref in attachment_refs]
+                    ids = [attachment_id for attachment_id, _ in refs]
+                    attachments = None
+                    try:
+                        attachments = await self._pin(refs)
+                        fields.update(await self._attachment_fields(attachment_refs, fields["html_body"], attachments))
+                    except BaseException as e:
+                        if attachments is not None:
+                            self.attachments.unpin(ids)
+                        if not isinstance(e, Exception):
+                            raise  # Cancelled along with the batch
+                        # One item's attachments must not fail the rest of the batch
+                        if not isinstance(e, AttachmentError):
+                            logger.error(f"[{email_id}] Failed to prepare attachments: {e!r}")
+                        results.append(self._failed_item(index, email_id, fields, suppressed, str(e)))
+                        continue
+                    pinned.extend(ids)
+                sendable.append((index, email_id, fields, suppressed))
+
+            _in_flight.inc(len(sendable))
+            try:
+                reports = await self.smtp_client.send_batch([fields for _, _, fields, _ in sendable], priority)
+            finally:
+                _in_flight.dec(len(sendable))
+        finally:
+            self.attachments.unpin(pinned)
+        for (index, email_id, fields, suppressed), report in zip(sendable, reports):
+            record_email(fields["email_type"], report.status)
+            rejected = report.errors()
+            self.delivery_log.record(
+                email_id, fields["email_type"], fields["subject"],
+                [*report.accepted, *rejected], report.status, report.summary(), rejected, suppressed
+            )
+            result = {
+                "index": index,
+                "email_id": email_id,
+                "status": report.status,
+                "message": report.summary()
+            }
+            if report.status == "partial":
+                result["rejected"] = rejected
+            if suppressed:
+                result["suppressed"] = suppressed
+            results.append(result)
+        return results
+
+    async def send_batch(
+        self,
+        items: Union[Iterable[BatchItem], AsyncIterable[BatchItem]]
+    ) -> AsyncIterator[dict]:
+        """
+        Sends a batch of emails, yielding one result per item as it completes.
+
+        Valid items are grouped into chunks of batch_session_size, each sent
+        over one reused SMTP session in the priority lane of its items (a
+        change of priority starts a new chunk); at most batch_max_sessions
+        chunks are in flight, so memory stays bounded regardless of the
+        batch size. Items
+        are pulled lazily, so an async source (e.g. a streamed request body)
+        is only read as fast as delivery keeps up.
+
+        If a chunk raises, or the caller stops iterating (e.g. the client
+        went away), the chunks still in flight are cancelled and awaited, so
+        none keeps sending or holding attachment pins.
+
+        Args:
+            items: (index, request) pairs, or (index, error message) for items that failed validation
+        """
+        pending: Set[asyncio.Task] = set()
+        chunk: List[ChunkItem] = []
+        priority = "normal"
+        sent = failed = 0
+
+        async def drain(limit: int):
+            nonlocal pending
+            while len(pending) > limit:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    for result in task.result():
+                        yield result
+
+        try:
+            async for index, item in _aiter(items):
+                suppressed = []
+                if not isinstance(item, str):
+                    item, suppressed = await self._without_suppressed(item)
+                    if suppressed and not (item.recipients or item.cc or item.bcc):
+                        failed += 1
+                        yield {"index": index, **self._all_suppressed(item, str(uuid4()), suppressed)}
+                        continue
+                    try:
+                        # Templates and HTML are processed once and cached, so
+                        # repeated content only costs a lookup per item
+                        item = await self._prepare(item)
+                    except TemplateError as e:
+                        item = str(e)
+                if isinstance(item, str):
+                    failed += 1
+                    record_email("unknown", "invalid")
+                    yield {"index": index, "email_id": None, "status": "invalid", "message": item}
+                    continue
+                if chunk and item.priority != priority:
+                    pending.add(asyncio.create_task(self._send_chunk(chunk, priority)))
+                    chunk = []
+                priority = item.priority
+                chunk.append((index, str(uuid4()), self._message_fields(item), item.attachments or [], suppressed))
+                if len(chunk) >= self.batch_session_size:
+                    pending.add(asyncio.create_task(self._send_chunk(chunk, priority)))
+                    chunk = []
+                if len(pending) >= self.batch_max_sessions:
+                    async for result in drain(self.batch_max_sessions - 1):
+                        sent += result["status"] == "success"
+                        failed += result["status"] != "success"
+                        yield result
+
+            if chunk:
+                pending.add(asyncio.create_task(self._send_chunk(chunk, priority)))
+            async for result in drain(0):
+                sent += result["status"] == "success"
+                failed += result["status"] != "success"
+                yield result
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        logger.info(f"Batch finished: {sent} sent, {failed} failed, invalid or suppressed")
+
     async def send_plain_text_email(self, email_request: EmailSendRequest) -> dict:
         """
         Legacy method for backward compatibility.
@@ -90,3 +490,10 @@ class EmailService:
             dict: Connection test result
         """
         return self.smtp_client.test_connection()
+
+    def close(self) -> None:
+        """
+        Release SMTP delivery resources and the preview workers
+        """
+        self.smtp_client.close()
+        self.previews.close()
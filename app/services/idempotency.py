@@ -0,0 +1,238 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from app.config import settings
+from app.database import run_db, utcnow
+from app.utils.metrics import IDEMPOTENT_REPLAYS_COALESCED, IDEMPOTENT_REPLAYS_DATABASE, IDEMPOTENT_REPLAYS_MEMORY
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL = 600.0  # Seconds between deletes of expired keys from the database
+
+StoredKey = Tuple[str, Optional[dict], datetime]  # (fingerprint, response or None while in progress, expires_at)
+
+
+class IdempotencyKeyReusedError(ValueError):
+    """An Idempotency-Key was sent again with a different request"""
+
+
+class IdempotencyConflictError(RuntimeError):
+    """The first request with an Idempotency-Key is still running in another worker"""
+
+
+def fingerprint(payload: str) -> str:
+    """
+    Identifies the request a key was first used with
+    """
+    return hashlib.sha256(payload.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class IdempotencyService:
+    """
+    Results of requests sent with an Idempotency-Key header, so a client
+    retrying a send that timed out gets the first response back instead of
+    sending the email twice.
+
+    Successful responses are kept for idempotency_ttl seconds in an LRU of
+    idempotency_cache_size keys, so a replay is a dict lookup. A duplicate
+    arriving while the first request is still running waits for it and
+    shares its outcome. Errors are not stored: after a failed send the same
+    key can be retried.
+
+    With idempotency_persist, keys are also claimed in the idempotency_keys
+    table so that workers see each other's requests: a result stored by
+    another worker is replayed from the database, and a duplicate of a
+    request still running elsewhere is refused with IdempotencyConflictError.
+    """
+
+    def __init__(self):
+        self.cache_size = settings.idempotency_cache_size
+        self.ttl = settings.idempotency_ttl
+        self.persist = settings.idempotency_persist
+        self.lock_timeout = settings.idempotency_lock_timeout
+        self._cache: "OrderedDict[str, Tuple[str, dict, float]]" = OrderedDict()
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self._next_purge = 0.0
+        self._purge_task: Optional[asyncio.Task] = None
+
+    # In-memory cache
+
+    def _lookup(self, key: str, request_fingerprint: str) -> Optional[dict]:
+        cached = self._cache.get(key)
+        if cached is None:
+            return None
+        stored_fingerprint, response, expires_at = cached
+        if expires_at <= time.monotonic():
+            del self._cache[key]
+            return None
+        if stored_fingerprint != request_fingerprint:
+            raise IdempotencyKeyReusedError("Idempotency-Key was already used with a different request")
+        self._cache.move_to_end(key)
+        return response
+
+    def _remember(self, key: str, request_fingerprint: str, response: dict, ttl: float) -> None:
+        self._cache[key] = (request_fingerprint, response, time.monotonic() + ttl)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    # Database operations (synchronous ORM code, run via run_db; SQLAlchemy
+    # and the model are imported on first use)
+
+    def _claim(self, db, key: str, request_fingerprint: str) -> Optional[StoredKey]:
+        from sqlalchemy import and_, or_, select, update
+        from sqlalchemy.exc import IntegrityError
+        from app.models.idempotency_key import IdempotencyKey
+
+        now = utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+        db.add(IdempotencyKey(key=key, fingerprint=request_fingerprint, created_at=now, expires_at=expires_at))
+        try:
+            db.commit()
+            return None
+        except IntegrityError:
+            db.rollback()
+
+        # Take the key over if it expired or its first request died with its worker
+        taken = db.execute(
+            update(IdempotencyKey)
+            .where(
+                IdempotencyKey.key == key,
+                or_(
+                    IdempotencyKey.expires_at <= now,
+                    and_(
+                        IdempotencyKey.response.is_(None),
+                        IdempotencyKey.created_at <= now - timedelta(seconds=self.lock_timeout)
+                    )
+                )
+            )
+            .values(fingerprint=request_fingerprint, response=None, created_at=now, expires_at=expires_at)
+        )
+        db.commit()
+        if taken.rowcount:
+            return None
+        row = db.execute(
+            select(IdempotencyKey.fingerprint, IdempotencyKey.response, IdempotencyKey.expires_at)
+            .where(IdempotencyKey.key == key)
+        ).one_or_none()
+        # A row released right after our insert failed counts as in progress
+        return tuple(row) if row is not None else (request_fingerprint, None, expires_at)
+
+    @staticmethod
+    def _complete(db, key: str, response: dict) -> None:
+        from sqlalchemy import update
+        from app.models.idempotency_key import IdempotencyKey
+
+        db.execute(update(IdempotencyKey).where(IdempotencyKey.key == key).values(response=response))
+        db.commit()
+
+    @staticmethod
+    def _release(db, key: str) -> None:
+        from sqlalchemy import delete
+        from app.models.idempotency_key import IdempotencyKey
+
+        db.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key, IdempotencyKey.response.is_(None)))
+        db.commit()
+
+    @staticmethod
+    def _purge(db) -> int:
+        from sqlalchemy import delete
+        from app.models.idempotency_key import IdempotencyKey
+
+        purged = db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= utcnow()))
+        db.commit()
+        return purged.rowcount
+
+    async def _purge_expired(self) -> None:
+        try:
+            purged = await run_db(self._purge)
+            if purged:
+                logger.info(f"Purged {purged} expired idempotency keys")
+        except Exception as e:
+            logger.error(f"Failed to purge idempotency keys: {e}")
+
+    # Request handling
+
+    async def _execute(self, key: str, request_fingerprint: str, call: Callable[[], Awaitable[dict]]) -> Tuple[dict, bool]:
+        if self.persist:
+            if time.monotonic() >= self._next_purge:
+                self._next_purge = time.monotonic() + PURGE_INTERVAL
+                self._purge_task = asyncio.create_task(self._purge_expired())
+            stored = await run_db(self._claim, key, request_fingerprint)
+            if stored is not None:
+                stored_fingerprint, response, expires_at = stored
+                if stored_fingerprint != request_fingerprint:
+                    raise IdempotencyKeyReusedError("Idempotency-Key was already used with a different request")
+                if response is None:
+                    raise IdempotencyConflictError("A request with this Idempotency-Key is still in progress")
+                if expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=timezone.utc)  # SQLite drops the UTC offset
+                self._remember(key, request_fingerprint, response, (expires_at - utcnow()).total_seconds())
+                IDEMPOTENT_REPLAYS_DATABASE.inc()
+                return response, True
+
+        try:
+            response = await call()
+        except BaseException:
+            if self.persist:
+                try:
+                    await run_db(self._release, key)
+                except Exception as e:
+                    logger.error(f"Failed to release idempotency key {key}: {e}")
+            raise
+
+        self._remember(key, request_fingerprint, response, self.ttl)
+        if self.persist:
+            try:
+                await run_db(self._complete, key, response)
+            except Exception as e:
+                # The send went through; other workers take the key over after lock_timeout
+                logger.error(f"Failed to store the result of idempotency key {key}: {e}")
+        return response, False
+
+    async def run(self, key: str, request_fingerprint: str, call: Callable[[], Awaitable[dict]]) -> Tuple[dict, bool]:
+        """
+        Runs call() at most once per key and returns (response, replayed);
+        replayed is True when the response was produced by an earlier or
+        concurrent request with the same key.
+
+        Raises:
+            IdempotencyKeyReusedError: key was first used with another request
+            IdempotencyConflictError: key is in progress in another worker
+            Whatever call() raises, also to duplicates waiting on it
+        """
+        response = self._lookup(key, request_fingerprint)
+        if response is not None:
+            IDEMPOTENT_REPLAYS_MEMORY.inc()
+            return response, True
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            inflight_fingerprint, future = inflight
+            if inflight_fingerprint != request_fingerprint:
+                raise IdempotencyKeyReusedError("Idempotency-Key was already used with a different request")
+            IDEMPOTENT_REPLAYS_COALESCED.inc()
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting for the outcome; don't warn about unretrieved errors
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._inflight[key] = (request_fingerprint, future)
+        try:
+            response, replayed = await self._execute(key, request_fingerprint, call)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(response)
+        finally:
+            self._inflight.pop(key, None)
+        return response, replayed
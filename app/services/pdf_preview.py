@@ -0,0 +1,192 @@
+import asyncio
+import html
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.services.attachment_store import AttachmentError, AttachmentStore
+from app.utils.mime_builder import FileAttachment
+
+logger = logging.getLogger(__name__)
+
+PAGE_COUNT_FILE = "pages"  # Number of pages in the PDF, next to the rendered pages
+_BODY_END = re.compile(r"</body\s*>", re.IGNORECASE)
+
+
+class PDFPreviewError(AttachmentError):
+    """A preview was requested for an attachment that isn't a readable PDF, or rendering it failed"""
+
+
+def _page_path(output_dir: str, page: int, dpi: int) -> str:
+    return os.path.join(output_dir, f"{dpi}-{page}.png")
+
+
+def render_pages(pdf_path: str, output_dir: str, first_page: int, last_page: int, dpi: int) -> int:
+    """
+    Rasterizes pages first_page..last_page of a PDF to PNG files in
+    output_dir. Runs in a worker process; poppler (pdftoppm) writes the
+    images straight to disk, so no image data travels back to the API.
+
+    Returns:
+        number of pages in the PDF
+    """
+    from pdf2image import convert_from_path, pdfinfo_from_path
+
+    os.makedirs(output_dir, exist_ok=True)
+    page_count = int(pdfinfo_from_path(pdf_path)["Pages"])
+    last_page = min(last_page, page_count)
+    if first_page <= last_page:
+        with tempfile.TemporaryDirectory(dir=output_dir) as temp:
+            paths = convert_from_path(
+                pdf_path, dpi=dpi, first_page=first_page, last_page=last_page,
+                fmt="png", output_folder=temp, paths_only=True
+            )
+            # pdftoppm zero-pads page numbers, so names sort in page order
+            for page, path in enumerate(sorted(paths), start=first_page):
+                os.replace(path, _page_path(output_dir, page, dpi))
+
+    temp = os.path.join(output_dir, f"{PAGE_COUNT_FILE}.{os.getpid()}.tmp")
+    with open(temp, "w") as f:
+        f.write(str(page_count))
+    os.replace(temp, os.path.join(output_dir, PAGE_COUNT_FILE))
+    return page_count
+
+
+def embed_previews(html_body: str, blocks: List[str]) -> str:
+    """
+    Inserts preview blocks at the end of the HTML body
+    """
+    previews = "".join(blocks)
+    matches = list(_BODY_END.finditer(html_body))
+    if not matches:
+        return html_body + previews
+    end = matches[-1].start()
+    return html_body[:end] + previews + html_body[end:]
+
+
+class PDFPreviewService:
+    """
+    Renders the first pages of PDF attachments as PNG images to embed in
+    the HTML body of an email.
+
+    Rasterizing is CPU-bound, so it runs in a pool of worker processes
+    (pdf_preview_workers, one per core by default) instead of on the event
+    loop. Rendered pages are kept next to the attachment in the store,
+    keyed by (content hash, page, dpi): repeated sends of the same PDF
+    reuse them, and concurrent sends of a PDF that is still being rendered
+    wait for the same render.
+    """
+
+    def __init__(self, store: AttachmentStore):
+        self.store = store
+        self.dpi = settings.pdf_preview_dpi
+        self.max_pages = settings.pdf_preview_pages_max
+        self.workers = settings.pdf_preview_workers or os.cpu_count() or 1
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._rendering: Dict[Tuple[str, int, int], asyncio.Future] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Worker processes are only started once the first preview is needed
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            logger.info(f"Started {self.workers} PDF preview workers")
+        return self._executor
+
+    def _reset_executor(self, executor: Optional[ProcessPoolExecutor]) -> None:
+        # A worker died (e.g. killed for memory) and the pool is unusable, so
+        # the next preview starts a new one; a pool already replaced is left alone
+        if executor is not None and executor is self._executor:
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            logger.warning("PDF preview workers crashed, restarting them on the next preview")
+
+    def _render_done(self, key: Tuple[str, int, int], executor: ProcessPoolExecutor, future: asyncio.Future) -> None:
+        self._rendering.pop(key, None)
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._reset_executor(executor)
+
+    def _cached(self, output_dir: str, pages: int) -> Tuple[Optional[int], int]:
+        """
+        (page count if known, first page still to render)
+        """
+        try:
+            with open(os.path.join(output_dir, PAGE_COUNT_FILE)) as f:
+                page_count: Optional[int] = int(f.read())
+        except (OSError, ValueError):
+            return None, 1
+        for page in range(1, min(pages, page_count) + 1):
+            if not os.path.exists(_page_path(output_dir, page, self.dpi)):
+                return page_count, page
+        return page_count, 0
+
+    async def render(self, attachment_id: str, attachment: FileAttachment, pages: int) -> List[FileAttachment]:
+        """
+        Inline PNG parts for the first pages of a pinned PDF attachment,
+        rendering the pages that are not cached yet
+
+        Raises:
+            PDFPreviewError: the attachment is not a PDF or can't be rendered
+        """
+        if attachment.content_type != "application/pdf":
+            raise PDFPreviewError(f"Previews are only available for PDF attachments, not {attachment.filename}")
+        pages = min(pages, self.max_pages)
+        output_dir = self.store.preview_dir(attachment_id)
+
+        page_count, first_missing = self._cached(output_dir, pages)
+        if first_missing:
+            key = (attachment_id, pages, self.dpi)
+            executor = None
+            try:
+                future = self._rendering.get(key)
+                if future is None:
+                    executor = self._get_executor()
+                    future = asyncio.get_running_loop().run_in_executor(
+                        executor, render_pages,
+                        attachment.path, output_dir, first_missing, pages, self.dpi
+                    )
+                    self._rendering[key] = future
+                    future.add_done_callback(lambda done: self._render_done(key, executor, done))
+                page_count = await asyncio.shield(future)
+            except Exception as e:
+                # Anything from a corrupt PDF to a missing poppler install or
+                # a crashed worker fails this preview only
+                if isinstance(e, BrokenProcessPool):
+                    self._reset_executor(executor)  # Also when it broke before the render was submitted
+                raise PDFPreviewError(f"Could not render {attachment.filename}: {e}") from e
+
+        stem = os.path.splitext(attachment.filename)[0] or "preview"
+        return [
+            FileAttachment(
+                _page_path(output_dir, page, self.dpi),
+                f"{stem}-page{page}.png",
+                "image/png",
+                content_id=f"{attachment_id[:16]}.p{page}.{self.dpi}@notifyhub"
+            )
+            for page in range(1, min(pages, page_count) + 1)
+        ]
+
+    @staticmethod
+    def preview_html(filename: str, images: List[FileAttachment]) -> str:
+        """
+        HTML block showing the rendered pages of one attachment
+        """
+        name = html.escape(filename)
+        figures = "".join(
+            f'<img src="cid:{image.content_id}" alt="{name} page {page}" '
+            f'style="display:block;max-width:100%;margin:8px 0;border:1px solid #ddd">'
+            for page, image in enumerate(images, start=1)
+        )
+        return f'<div class="pdf-preview"><p><strong>{name}</strong></p>{figures}</div>'
+
+    def close(self) -> None:
+        """
+        Stop the worker processes
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,293 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from uuid import uuid4
+
+from app.config import settings
+from app.database import bulk_update, run_db, utcnow
+from app.schemas.email import EmailSendRequest
+from app.services.email_service import EmailService
+from app.services.retry_scheduler import RetryScheduler, retry_delay
+
+logger = logging.getLogger(__name__)
+
+ClaimedEmail = Tuple[str, dict, int]  # (email_id, payload, attempts)
+
+
+class DeliveryQueue:
+    """
+    Durable outbound queue backed by the outbound_emails table.
+
+    The API persists requests with enqueue(); a dispatcher claims queued rows
+    (queued -> sending) and feeds a fixed pool of async workers, which deliver
+    through EmailService.send_email and record the outcome (sent / failed).
+
+    Transient failures (4xx, dropped connections) are parked as 'retrying'
+    with an exponential, jittered next_attempt_at and handed back to the
+    workers by a heap-based RetryScheduler; permanent failures and emails out
+    of attempts are marked failed. When the relay accepts some recipients
+    and defers others, only the deferred ones are retried: they are kept in
+    the payload's "envelope", and the email is marked sent once what is
+    left is delivered, permanently rejected or out of attempts. Rows left in 'sending' or 'retrying' by a
+    crashed process are requeued after queue_visibility_timeout.
+
+    Outcomes finished while an earlier one is being written are recorded
+    together with one bulk UPDATE, so status writes don't grow one round
+    trip per email under load.
+    """
+
+    def __init__(self, email_service: EmailService):
+        self.email_service = email_service
+        self.workers = settings.queue_workers
+        self.poll_interval = settings.queue_poll_interval
+        self.claim_batch = settings.queue_claim_batch
+        self.visibility_timeout = settings.queue_visibility_timeout
+        self.max_attempts = settings.retry_max_attempts
+        self.retries = RetryScheduler(self._retry_due)
+        self._pending: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._transitions: List[Tuple[dict, asyncio.Future]] = []
+        self._flusher: Optional[asyncio.Task] = None
+
+    # Database operations (synchronous ORM code, run via run_db; SQLAlchemy
+    # and the model are imported on first use)
+
+    @staticmethod
+    def _insert(db, email_id: str, payload: dict) -> None:
+        from app.models.outbound_email import OutboundEmail
+
+        db.add(OutboundEmail(id=email_id, status="queued", payload=payload))
+        db.commit()
+
+    def _claim(self, db, limit: int) -> List[ClaimedEmail]:
+        from sqlalchemy import select
+        from app.models.outbound_email import OutboundEmail
+
+        ids = db.execute(
+            select(OutboundEmail.id)
+            .where(OutboundEmail.status == "queued")
+            .order_by(OutboundEmail.created_at)
+            .limit(limit)
+        ).scalars().all()
+        if not ids:
+            return []
+        return self._mark_sending(db, ids, from_status="queued")
+
+    def _claim_retries(self, db, ids: List[str]) -> List[ClaimedEmail]:
+        return self._mark_sending(db, ids, from_status="retrying")
+
+    @staticmethod
+    def _mark_sending(db, ids: List[str], from_status: str) -> List[ClaimedEmail]:
+        from sqlalchemy import update
+        from app.models.outbound_email import OutboundEmail
+
+        # The status guard makes the claim safe against other processes
+        claimed = db.execute(
+            update(OutboundEmail)
+            .where(OutboundEmail.id.in_(ids), OutboundEmail.status == from_status)
+            .values(status="sending", attempts=OutboundEmail.attempts + 1, next_attempt_at=None)
+            .returning(OutboundEmail.id, OutboundEmail.payload, OutboundEmail.attempts)
+        ).all()
+        db.commit()
+        return [(row.id, row.payload, row.attempts) for row in claimed]
+
+    @staticmethod
+    def _write_transitions(db, rows: List[dict]) -> None:
+        from app.models.outbound_email import OutboundEmail
+
+        bulk_update(db, OutboundEmail, rows)
+        db.commit()
+
+    def _requeue_stale(self, db) -> int:
+        from sqlalchemy import update
+        from app.models.outbound_email import OutboundEmail
+
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.visibility_timeout)
+        stuck = db.execute(
+            update(OutboundEmail)
+            .where(OutboundEmail.status == "sending", OutboundEmail.updated_at < cutoff)
+            .values(status="queued")
+        )
+        # Retries whose timer lived in a process that has since gone away
+        orphaned = db.execute(
+            update(OutboundEmail)
+            .where(OutboundEmail.status == "retrying", OutboundEmail.next_attempt_at < cutoff)
+            .values(status="queued", next_attempt_at=None)
+        )
+        db.commit()
+        return stuck.rowcount + orphaned.rowcount
+
+    # Status transitions (group commit)
+
+    async def _flush_transitions(self) -> None:
+        while self._transitions:
+            batch, self._transitions = self._transitions, []
+            try:
+                await run_db(self._write_transitions, [row for row, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for _, future in batch:
+                    future.set_result(None)
+
+    async def _transition(self, email_id: str, status: str, last_error: Optional[str] = None,
+                          next_attempt_at: Optional[datetime] = None, payload: Optional[dict] = None) -> None:
+        """
+        Record the outcome of a delivery. Workers finishing while a write is
+        in flight have their rows written together in the next bulk update,
+        so under load one UPDATE round trip covers many emails.
+        """
+        future = asyncio.get_running_loop().create_future()
+        row = {
+            "id": email_id,
+            "status": status,
+            "last_error": last_error,
+            "next_attempt_at": next_attempt_at,
+            "updated_at": utcnow()
+        }
+        if payload is not None:
+            row["payload"] = payload
+        self._transitions.append((row, future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_transitions())
+        await future
+
+    # API side
+
+    async def enqueue(self, email_request: EmailSendRequest) -> str:
+        """
+        Persist a send request and return its email_id
+
+        Raises:
+            AttachmentNotFoundError: the request references an unknown attachment
+            TemplateNotFoundError: the request references an unknown template
+        """
+        email_id = str(uuid4())
+        if email_request.template_id:
+            # Rendered at delivery time; only make sure it exists
+            await self.email_service.templates.get(email_request.template_id)
+        # Queued emails hold a reference so their attachments outlive store clean-ups
+        attachment_ids = [ref.id for ref in email_request.attachments or ()]
+        if attachment_ids:
+            await asyncio.to_thread(self.email_service.attachments.retain, attachment_ids)
+        try:
+            await run_db(self._insert, email_id, email_request.model_dump(mode="json"))
+        except Exception:
+            if attachment_ids:
+                await asyncio.to_thread(self.email_service.attachments.release, attachment_ids)
+            raise
+        if self._wakeup is not None:
+            self._wakeup.set()
+        logger.info(f"[{email_id}] Queued {email_request.email_type} email")
+        return email_id
+
+    # Worker side
+
+    async def _dispatch(self) -> None:
+        while True:
+            try:
+                requeued = await run_db(self._requeue_stale)
+                if requeued:
+                    logger.warning(f"Requeued {requeued} stale emails")
+                claimed = await run_db(self._claim, self.claim_batch)
+            except Exception as e:
+                logger.error(f"Failed to claim queued emails: {e}")
+                claimed = []
+
+            for item in claimed:
+                await self._pending.put(item)  # blocks while all workers are busy
+
+            if len(claimed) < self.claim_batch:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def _retry_due(self, ids: List[str]) -> None:
+        claimed = await run_db(self._claim_retries, ids)
+        for item in claimed:
+            await self._pending.put(item)
+
+    async def _finish(self, email_id: str, attempts: int, payload: dict, result: dict) -> None:
+        status = result.get("status")
+        if attempts < self.max_attempts and (
+            (status == "failed" and result.get("retryable")) or (status == "partial" and result.get("deferred"))
+        ):
+            delay = retry_delay(attempts)
+            next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+            # Recipients that accepted it must not get it twice
+            retry_payload = {**payload, "envelope": result["deferred"]} if status == "partial" else None
+            await self._transition(email_id, "retrying", result.get("message"), next_attempt_at, retry_payload)
+            self.retries.schedule(delay, email_id)
+            logger.warning(f"[{email_id}] Transient failure on attempt {attempts}, retrying in {delay:.0f}s")
+        else:
+            # An earlier attempt already reached the recipients outside the envelope
+            succeeded = status in ("success", "partial") or "envelope" in payload
+            # Partial sends keep the rejection summary for inspection
+            error = None if status == "success" else result.get("message")
+            await self._transition(email_id, "sent" if succeeded else "failed", error)
+            attachment_ids = [ref["id"] for ref in payload.get("attachments") or ()]
+            if attachment_ids:
+                await asyncio.to_thread(self.email_service.attachments.release, attachment_ids)
+
+    async def _work(self) -> None:
+        while True:
+            email_id, payload, attempts = await self._pending.get()
+            try:
+                email_request = EmailSendRequest.model_validate(payload)
+                result = await self.email_service.send_email(
+                    email_request, email_id=email_id, only_to=payload.get("envelope")
+                )
+            except Exception as e:
+                logger.error(f"[{email_id}] Queued delivery failed: {e}")
+                result = {"email_id": email_id, "status": "failed", "message": str(e)}
+            try:
+                await self._finish(email_id, attempts, payload, result)
+            except Exception as e:
+                logger.error(f"[{email_id}] Failed to record delivery result: {e}")
+            finally:
+                self._pending.task_done()
+
+    def stats(self) -> dict:
+        """
+        In-process queue depths
+        """
+        return {
+            "workers": self.workers,
+            "pending": self._pending.qsize() if self._pending is not None else 0,
+            "retry_depth": self.retries.depth
+        }
+
+    async def start(self) -> None:
+        """
+        Start the dispatcher and worker tasks
+        """
+        self._pending = asyncio.Queue(maxsize=self.workers)
+        self._wakeup = asyncio.Event()
+        self._worker_tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        self.retries.start()
+        logger.info(f"Delivery queue started with {self.workers} workers")
+
+    async def stop(self) -> None:
+        """
+        Stop claiming new work, finish already-claimed emails, then stop workers
+        """
+        if self._dispatcher is None:
+            return
+        # Parked retries stay 'retrying' in the database and are recovered later
+        await self.retries.stop()
+        self._dispatcher.cancel()
+        await asyncio.gather(self._dispatcher, return_exceptions=True)
+        await self._pending.join()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._dispatcher = None
+        self._worker_tasks = []
+        logger.info("Delivery queue stopped")
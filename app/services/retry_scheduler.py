@@ -0,0 +1,92 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def retry_delay(attempt: int) -> float:
+    """
+    Exponential backoff with jitter for the given attempt number (1-based).
+
+    Uses "equal jitter": half of the capped exponential delay is fixed and the
+    other half random, so retries after a relay outage spread out instead of
+    arriving in lockstep, while still backing off.
+    """
+    ceiling = min(settings.retry_max_delay, settings.retry_base_delay * 2 ** max(attempt - 1, 0))
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+class RetryScheduler:
+    """
+    Delayed retries on a min-heap driven by a single task.
+
+    Items are kept as (due time, sequence, item) entries; the runner sleeps
+    until the earliest entry is due (or a sooner one is scheduled) and hands
+    every due item to the handler in one call. Thousands of pending retries
+    therefore cost one heap entry each rather than one sleeping task each.
+    """
+
+    def __init__(self, handler: Callable[[List[Any]], Awaitable[None]]):
+        self._handler = handler
+        self._heap: List[Tuple[float, int, Any]] = []
+        self._sequence = itertools.count()
+        self._changed: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        """
+        Number of retries waiting to become due
+        """
+        return len(self._heap)
+
+    def schedule(self, delay: float, item: Any) -> None:
+        """
+        Schedule item to be handed to the handler after delay seconds
+        """
+        due = asyncio.get_running_loop().time() + delay
+        heapq.heappush(self._heap, (due, next(self._sequence), item))
+        if self._changed is not None and self._heap[0][0] == due:
+            self._changed.set()  # new earliest entry, re-arm the timer
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[2])
+            if due:
+                try:
+                    await self._handler(due)
+                except Exception as e:
+                    logger.error(f"Failed to dispatch {len(due)} retries: {e}")
+                continue
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop the timer; entries still waiting are dropped from memory
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._heap.clear()
@@ -0,0 +1,346 @@
+import asyncio
+import logging
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from pydantic import ValidationError
+
+from app.config import settings
+from app.database import run_db, utcnow
+from app.utils.addresses import normalize_address
+from app.utils.metrics import SUPPRESSED_RECIPIENTS
+from app.utils.suppression_index import BloomFilter, HashedAddressSet, address_hash, normalize_suppressed
+
+logger = logging.getLogger(__name__)
+
+INDEX_MODES = ("set", "bloom")
+
+_suppressed = SUPPRESSED_RECIPIENTS.labels()
+
+# Changes are picked up by updated_at; each refresh re-reads this much
+# history so rows committed late, or stamped by a worker whose clock is a
+# little behind, aren't missed
+_REFRESH_OVERLAP = timedelta(seconds=10)
+_LOAD_PAGE_SIZE = 50000
+_MAX_IMPORT_ERRORS = 20
+
+SuppressionIndex = Union[HashedAddressSet, BloomFilter]
+
+
+def _aware(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes; they are stored in UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+class SuppressionService:
+    """
+    Addresses that must not be mailed again (hard bounces, unsubscribes,
+    complaints), stored in the suppressions table and mirrored in memory
+    so checking a recipient never costs a database round trip.
+
+    The in-memory index holds a 64-bit hash per address, not the address:
+    - "set" (default): a sorted array of hashes, 8 bytes per entry and
+      exact up to hash collisions (negligible)
+    - "bloom": a Bloom filter of suppression_bloom_capacity entries, under
+      2 bytes per entry; its hits are confirmed with one query per email,
+      so only suppressed addresses and rare false positives reach the
+      database
+
+    Changes made through this service apply locally at once; other workers
+    pick them up every suppression_refresh_interval seconds. Until the
+    first load finishes, sends wait for it; if it fails they go out
+    unfiltered (logged) while the load is retried.
+    """
+
+    def __init__(self):
+        if settings.suppression_index not in INDEX_MODES:
+            raise ValueError(f"suppression_index must be one of {INDEX_MODES}, not {settings.suppression_index!r}")
+        self.enabled = settings.suppression_enabled
+        self.mode = settings.suppression_index
+        self.refresh_interval = settings.suppression_refresh_interval
+        self.import_batch_size = settings.suppression_import_batch_size
+        self._index: SuppressionIndex = self._new_index()
+        self._refreshed_at: Optional[datetime] = None  # Start of the last load or refresh
+        self._ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _new_index(self, sorted_hashes: Iterable[int] = ()) -> SuppressionIndex:
+        if self.mode == "bloom":
+            index = BloomFilter(settings.suppression_bloom_capacity, settings.suppression_bloom_error_rate)
+            for key in sorted_hashes:
+                index.add(key)
+            return index
+        return HashedAddressSet(sorted_hashes)
+
+    # Database operations (synchronous ORM code, run via run_db; SQLAlchemy
+    # and the model are imported on first use)
+
+    @staticmethod
+    def _upsert(db, rows: List[dict]) -> None:
+        from sqlalchemy.dialects import postgresql, sqlite
+        from app.models.suppression import Suppression
+
+        now = utcnow()
+        values = [{**row, "active": True, "created_at": now, "updated_at": now} for row in rows]
+        dialect = {"postgresql": postgresql, "sqlite": sqlite}.get(db.get_bind().dialect.name)
+        if dialect is None:
+            for value in values:
+                db.merge(Suppression(**value))
+        else:
+            statement = dialect.insert(Suppression)
+            db.execute(statement.on_conflict_do_update(
+                index_elements=[Suppression.address],
+                set_={"reason": statement.excluded.reason, "active": True, "updated_at": statement.excluded.updated_at}
+            ), values)
+        db.commit()
+
+    @staticmethod
+    def _deactivate(db, address: str) -> bool:
+        from sqlalchemy import update
+        from app.models.suppression import Suppression
+
+        result = db.execute(
+            update(Suppression)
+            .where(Suppression.address == address, Suppression.active.is_(True))
+            .values(active=False, updated_at=utcnow())
+        )
+        db.commit()
+        return result.rowcount > 0
+
+    @staticmethod
+    def _sorted_hashes(db) -> array:
+        """
+        Hashes of all active entries in ascending order, read in keyset pages
+        """
+        from sqlalchemy import select
+        from app.models.suppression import Suppression
+
+        hashes = array("q")
+        last = None
+        while True:
+            statement = select(Suppression.address_hash).where(Suppression.active.is_(True))
+            if last is not None:
+                statement = statement.where(Suppression.address_hash > last)
+            page = db.execute(statement.order_by(Suppression.address_hash).limit(_LOAD_PAGE_SIZE)).scalars().all()
+            hashes.extend(page)
+            if len(page) < _LOAD_PAGE_SIZE:
+                return hashes
+            last = page[-1]
+
+    @staticmethod
+    def _changes(db, since: datetime) -> List[tuple]:
+        from sqlalchemy import select
+        from app.models.suppression import Suppression
+
+        return db.execute(
+            select(Suppression.address_hash, Suppression.active).where(Suppression.updated_at >= since)
+        ).all()
+
+    @staticmethod
+    def _active(db, addresses: List[str]) -> Set[str]:
+        from sqlalchemy import select
+        from app.models.suppression import Suppression
+
+        return set(db.execute(
+            select(Suppression.address).where(Suppression.address.in_(addresses), Suppression.active.is_(True))
+        ).scalars())
+
+    @staticmethod
+    def _fetch(db, address: str) -> Optional[dict]:
+        from app.models.suppression import Suppression
+
+        row = db.get(Suppression, address)
+        if row is None or not row.active:
+            return None
+        return {
+            "address": row.address,
+            "reason": row.reason,
+            "created_at": _aware(row.created_at).isoformat(),
+            "updated_at": _aware(row.updated_at).isoformat()
+        }
+
+    # Index maintenance
+
+    async def load(self) -> None:
+        """
+        Rebuild the in-memory index from the table
+        """
+        started = utcnow()
+        hashes = await run_db(self._sorted_hashes)
+        self._index = await asyncio.to_thread(self._new_index, hashes)
+        self._refreshed_at = started
+        # Catch what changed while the table was being read
+        await self.refresh()
+        logger.info(f"Loaded {len(self._index)} suppressed addresses ({self.mode}, {self._index.nbytes} bytes)")
+
+    async def refresh(self) -> int:
+        """
+        Apply entries added or removed since the last load or refresh
+
+        Returns:
+            number of changed rows read
+        """
+        started = utcnow()
+        changes = await run_db(self._changes, self._refreshed_at - _REFRESH_OVERLAP)
+        for key, active in changes:
+            if active:
+                self._index.add(key)
+            elif self.mode == "set":
+                self._index.discard(key)  # Bloom hits are confirmed against the table instead
+        self._refreshed_at = started
+        return len(changes)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self._refreshed_at is None:
+                    await self.load()
+                else:
+                    await self.refresh()
+            except Exception as e:
+                action = "load" if self._refreshed_at is None else "refresh"
+                logger.error(f"Failed to {action} the suppression list: {e}")
+            finally:
+                self._ready.set()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> None:
+        """
+        Load the index and keep it in sync in the background
+        """
+        if not self.enabled:
+            return
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    # Send path
+
+    async def check(self, addresses: Iterable[str]) -> Set[str]:
+        """
+        The given addresses that are suppressed, as given
+        """
+        if self._ready is None:
+            return set()
+        if not self._ready.is_set():
+            await self._ready.wait()
+        index = self._index
+        if not len(index):
+            return set()
+        hits: Dict[str, List[str]] = {}
+        for address in addresses:
+            normalized = normalize_suppressed(address)
+            if address_hash(normalized) in index:
+                hits.setdefault(normalized, []).append(address)
+        if hits and self.mode == "bloom":
+            try:
+                confirmed = await run_db(self._active, list(hits))
+            except Exception as e:
+                logger.error(f"Could not confirm {len(hits)} possibly suppressed addresses, sending to them: {e}")
+                confirmed = set()
+            hits = {normalized: given for normalized, given in hits.items() if normalized in confirmed}
+        suppressed = {address for given in hits.values() for address in given}
+        if suppressed:
+            _suppressed.inc(len(suppressed))
+        return suppressed
+
+    # Management
+
+    async def _write(self, rows: Dict[str, dict]) -> None:
+        values = list(rows.values())
+        for start in range(0, len(values), self.import_batch_size):
+            await run_db(self._upsert, values[start:start + self.import_batch_size])
+        for row in values:
+            self._index.add(row["address_hash"])
+
+    @staticmethod
+    def _row(address: str, reason: str) -> dict:
+        normalized = normalize_suppressed(address)
+        return {"address": normalized, "address_hash": address_hash(normalized), "reason": reason}
+
+    async def add(self, addresses: Iterable[str], reason: str = "manual") -> int:
+        """
+        Suppress validated addresses (re-adding one updates its reason)
+
+        Returns:
+            number of distinct addresses written
+        """
+        rows = {}
+        for address in addresses:
+            row = self._row(address, reason)
+            rows[row["address"]] = row
+        await self._write(rows)
+        logger.info(f"Suppressed {len(rows)} addresses ({reason})")
+        return len(rows)
+
+    async def import_lines(
+        self,
+        lines: AsyncIterable[Tuple[int, Optional[bytes]]],
+        reason: str = "manual"
+    ) -> dict:
+        """
+        Bulk import: one address per line (the first column of CSV lines),
+        written import_batch_size rows at a time, so memory use doesn't
+        depend on the size of the upload. Invalid lines are skipped and
+        reported.
+
+        Args:
+            lines: (line index, line) pairs from iter_ndjson_lines(), with
+                None for lines that were too long
+        """
+        rows: Dict[str, dict] = {}
+        imported = invalid = 0
+        errors = []
+        async for index, line in lines:
+            value = line.decode(errors="replace").split(",", 1)[0].strip().strip('"') if line is not None else None
+            try:
+                if not value:
+                    raise ValueError("Line too long" if line is None else "Empty address")
+                row = self._row(normalize_address(value), reason)
+            except (ValidationError, ValueError) as e:
+                invalid += 1
+                if len(errors) < _MAX_IMPORT_ERRORS:
+                    message = e.errors()[0]["msg"] if isinstance(e, ValidationError) else str(e)
+                    errors.append({"line": index + 1, "message": message})
+            else:
+                rows[row["address"]] = row
+                if len(rows) >= self.import_batch_size:
+                    await self._write(rows)
+                    imported += len(rows)
+                    rows = {}
+        if rows:
+            await self._write(rows)
+            imported += len(rows)
+        logger.info(f"Imported {imported} suppressed addresses ({reason}), {invalid} invalid lines")
+        return {"imported": imported, "invalid": invalid, "errors": errors}
+
+    async def remove(self, address: str) -> bool:
+        """
+        Allow mail to an address again
+
+        Returns:
+            False if it wasn't suppressed
+        """
+        normalized = normalize_suppressed(address)
+        removed = await run_db(self._deactivate, normalized)
+        if removed and self.mode == "set":
+            self._index.discard(address_hash(normalized))
+        return removed
+
+    async def get(self, address: str) -> Optional[dict]:
+        return await run_db(self._fetch, normalize_suppressed(address))
+
+    def stats(self) -> dict:
+        return {
+            "index": self.mode,
+            "entries": len(self._index),
+            "bytes": self._index.nbytes,
+            "loaded": self._refreshed_at is not None
+        }
@@ -0,0 +1,205 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from app.config import settings
+from app.database import run_db
+from app.schemas.email import EmailSendRequest, EmailTemplateRequest
+from app.utils.html_content import html_to_text, sanitize_html
+from app.utils.templates import CompiledTemplate, TemplateError, compile_email_template
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateNotFoundError(TemplateError, LookupError):
+    """A template_id is not registered"""
+
+
+class TemplateService:
+    """
+    Server-side email templates, stored in the email_templates table.
+
+    Each template version is compiled once into render functions (with
+    html_body sanitized and a missing text part derived from it) and kept
+    in an LRU of template_cache_size entries, so rendering a send only
+    formats the variables. Updating a template bumps its version: the local
+    copy is dropped right away, and other workers notice the new version
+    when their copy is older than template_cache_ttl.
+    """
+
+    def __init__(self):
+        self.cache_size = settings.template_cache_size
+        self.ttl = settings.template_cache_ttl
+        self._cache: "OrderedDict[str, Tuple[CompiledTemplate, float]]" = OrderedDict()
+
+    # Database operations (synchronous ORM code, run via run_db, which
+    # creates the tables; SQLAlchemy and the model are imported on first use)
+
+    def _load(self, db, template_id: str) -> Optional[CompiledTemplate]:
+        from app.models.email_template import EmailTemplate
+
+        row = db.get(EmailTemplate, template_id)
+        if row is None:
+            return None
+        return compile_email_template(
+            row.id, row.version, row.email_type, row.subject, row.body, row.html_body,
+            sanitize=sanitize_html if settings.html_sanitize else None,
+            to_text=html_to_text
+        )
+
+    def _version(self, db, template_id: str) -> Optional[int]:
+        from sqlalchemy import select
+        from app.models.email_template import EmailTemplate
+
+        return db.execute(
+            select(EmailTemplate.version).where(EmailTemplate.id == template_id)
+        ).scalar_one_or_none()
+
+    def _save(self, db, template_id: str, request: EmailTemplateRequest) -> Tuple[int, bool]:
+        from sqlalchemy.exc import IntegrityError
+        from app.models.email_template import EmailTemplate
+
+        fields = request.model_dump()
+        for _ in range(2):
+            row = db.get(EmailTemplate, template_id)
+            created = row is None
+            if created:
+                row = EmailTemplate(id=template_id, version=1, **fields)
+                db.add(row)
+            else:
+                for name, value in fields.items():
+                    setattr(row, name, value)
+                row.version = EmailTemplate.version + 1
+            try:
+                db.commit()
+            except IntegrityError:
+                # Registered concurrently by another request; update it instead
+                db.rollback()
+                continue
+            db.refresh(row)
+            return row.version, created
+        raise RuntimeError(f"Could not save template {template_id}")
+
+    def _delete(self, db, template_id: str) -> bool:
+        from app.models.email_template import EmailTemplate
+
+        row = db.get(EmailTemplate, template_id)
+        if row is None:
+            return False
+        db.delete(row)
+        db.commit()
+        return True
+
+    def _fetch(self, db, template_id: str) -> Optional[dict]:
+        from app.models.email_template import EmailTemplate
+
+        row = db.get(EmailTemplate, template_id)
+        if row is None:
+            return None
+        return {
+            "template_id": row.id,
+            "version": row.version,
+            "email_type": row.email_type,
+            "subject": row.subject,
+            "body": row.body,
+            "html_body": row.html_body,
+            "updated_at": row.updated_at.isoformat()
+        }
+
+    # Compiled template cache
+
+    def _remember(self, compiled: CompiledTemplate, checked_at: float) -> None:
+        self._cache[compiled.template_id] = (compiled, checked_at)
+        self._cache.move_to_end(compiled.template_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def get(self, template_id: str) -> CompiledTemplate:
+        """
+        Compiled template, from the cache when it is current
+
+        Raises:
+            TemplateNotFoundError: template_id is not registered
+        """
+        now = time.monotonic()
+        cached = self._cache.get(template_id)
+        if cached is not None:
+            compiled, checked_at = cached
+            if now - checked_at < self.ttl:
+                self._cache.move_to_end(template_id)
+                return compiled
+            # Only the version is read to find out whether another worker updated it
+            if await run_db(self._version, template_id) == compiled.version:
+                self._remember(compiled, now)
+                return compiled
+
+        compiled = await run_db(self._load, template_id)
+        if compiled is None:
+            self._cache.pop(template_id, None)
+            raise TemplateNotFoundError(f"Unknown template {template_id}")
+        self._remember(compiled, now)
+        return compiled
+
+    async def apply(self, email_request: EmailSendRequest) -> EmailSendRequest:
+        """
+        Renders the template of a request into its subject, body and
+        html_body. Requests without template_id are returned unchanged.
+
+        Raises:
+            TemplateNotFoundError: template_id is not registered
+            TemplateError: variables are missing, or the template can't carry the request
+        """
+        if not email_request.template_id:
+            return email_request
+        compiled = await self.get(email_request.template_id)
+        rendered = compiled.render(email_request.variables or {})
+        if email_request.subject:
+            rendered["subject"] = email_request.subject
+        if compiled.email_type == "plain" and any(ref.preview_page_count for ref in email_request.attachments or ()):
+            raise TemplateError("PDF previews require an html or multipart template")
+        return email_request.model_copy(update={**rendered, "email_type": compiled.email_type})
+
+    async def save(self, template_id: str, request: EmailTemplateRequest) -> dict:
+        """
+        Registers or replaces a template
+
+        Raises:
+            TemplateSyntaxError: a part contains a malformed placeholder
+        """
+        # Compile before storing so broken templates are rejected up front
+        compiled = compile_email_template(
+            template_id, 0, request.email_type, request.subject, request.body, request.html_body
+        )
+        version, created = await run_db(self._save, template_id, request)
+        self._cache.pop(template_id, None)
+        logger.info(f"Template {template_id} {'registered' if created else 'updated'} (version {version})")
+        return {
+            "template_id": template_id,
+            "version": version,
+            "created": created,
+            "variables": compiled.variables
+        }
+
+    async def describe(self, template_id: str) -> dict:
+        """
+        Stored template with the variables it uses
+
+        Raises:
+            TemplateNotFoundError: template_id is not registered
+        """
+        template = await run_db(self._fetch, template_id)
+        if template is None:
+            raise TemplateNotFoundError(f"Unknown template {template_id}")
+        template["variables"] = (await self.get(template_id)).variables
+        return template
+
+    async def delete(self, template_id: str) -> None:
+        """
+        Raises:
+            TemplateNotFoundError: template_id is not registered
+        """
+        deleted = await run_db(self._delete, template_id)
+        self._cache.pop(template_id, None)
+        if not deleted:
+            raise TemplateNotFoundError(f"Unknown template {template_id}")
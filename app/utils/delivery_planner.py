@@ -0,0 +1,94 @@
+"""
+Envelope planning and per-recipient delivery reports
+"""
+import smtplib
+from typing import Dict, Iterable, List, Optional
+
+
+def _split_address(address: str):
+    local, _, domain = address.rpartition("@")
+    return local, domain.lower()
+
+
+def dedupe_recipients(addresses: Iterable[str]) -> List[str]:
+    """
+    Removes duplicate addresses (domains compare case-insensitively), keeping first occurrence order
+    """
+    seen = set()
+    unique = []
+    for address in addresses:
+        key = _split_address(address)
+        if key not in seen:
+            seen.add(key)
+            unique.append(address)
+    return unique
+
+
+def plan_envelopes(addresses: Iterable[str], max_rcpt: int) -> List[List[str]]:
+    """
+    Groups recipients into SMTP envelopes.
+
+    Addresses are deduplicated and ordered by domain, then cut into envelopes
+    of at most max_rcpt RCPT TO commands. This gives the minimum number of
+    transactions while keeping each domain's recipients together, so the
+    relay can hand them to the destination in as few deliveries as possible.
+    """
+    unique = dedupe_recipients(addresses)
+    if len(unique) <= max_rcpt:
+        return [unique] if unique else []
+    ordered = sorted(unique, key=lambda address: _split_address(address)[1])
+    return [ordered[i:i + max_rcpt] for i in range(0, len(ordered), max_rcpt)]
+
+
+class DeliveryReport:
+    """Per-recipient outcome of one email, across all of its envelopes"""
+
+    def __init__(self):
+        self.accepted: List[str] = []
+        self.rejected: Dict[str, Exception] = {}
+
+    def add_envelope(self, envelope: List[str], refused: Optional[dict] = None) -> None:
+        """
+        Records a completed transaction; refused is smtplib's {address: (code, message)}
+        """
+        refused = refused or {}
+        for address in envelope:
+            if address in refused:
+                code, message = refused[address]
+                self.rejected[address] = smtplib.SMTPResponseException(code, message)
+            else:
+                self.accepted.append(address)
+
+    def reject_envelope(self, envelope: List[str], error: Exception) -> None:
+        """
+        Records a transaction that failed as a whole
+        """
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            # Every RCPT TO was refused, each with its own reply
+            self.add_envelope(envelope, error.recipients)
+            return
+        for address in envelope:
+            self.rejected[address] = error
+
+    @property
+    def status(self) -> str:
+        if not self.rejected:
+            return "success"
+        if not self.accepted:
+            return "failed"
+        return "partial"
+
+    def errors(self) -> Dict[str, str]:
+        """
+        Rejected recipients with a printable reason
+        """
+        return {address: str(error) for address, error in self.rejected.items()}
+
+    def summary(self) -> str:
+        if self.status == "success":
+            return "Email sent successfully."
+        if self.status == "partial":
+            total = len(self.accepted) + len(self.rejected)
+            return f"Email sent to {len(self.accepted)} of {total} recipients."
+        first_error = next(iter(self.rejected.values()), None)
+        return f"Failed to send email: {first_error}"
@@ -0,0 +1,220 @@
+"""
+HTML body sanitization and plain-text derivation, memoized by content hash
+"""
+import asyncio
+import hashlib
+import importlib.util
+import re
+import threading
+from collections import OrderedDict
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+
+# bleach (and its vendored html5lib) is imported by the first sanitization,
+# not at startup; inline styles are dropped without tinycss2 (bleach[css])
+_has_css_sanitizer = importlib.util.find_spec("tinycss2") is not None
+
+# Markup commonly used in email bodies; anything else is stripped
+ALLOWED_TAGS = frozenset({
+    "a", "abbr", "address", "b", "big", "blockquote", "br", "caption", "center", "cite",
+    "code", "col", "colgroup", "dd", "del", "div", "dl", "dt", "em", "font", "h1", "h2",
+    "h3", "h4", "h5", "h6", "hr", "i", "img", "ins", "kbd", "li", "ol", "p", "pre", "q",
+    "s", "small", "span", "strike", "strong", "style", "sub", "sup", "table", "tbody",
+    "td", "tfoot", "th", "thead", "tr", "tt", "u", "ul",
+})
+_COMMON_ATTRIBUTES = ["align", "class", "dir", "id", "lang", "title"] + (["style"] if _has_css_sanitizer else [])
+_CELL_ATTRIBUTES = ["bgcolor", "colspan", "height", "rowspan", "valign", "width"]
+ALLOWED_ATTRIBUTES = {
+    "*": _COMMON_ATTRIBUTES,
+    "a": _COMMON_ATTRIBUTES + ["href", "name", "rel", "target"],
+    "img": _COMMON_ATTRIBUTES + ["alt", "border", "height", "src", "width"],
+    "table": _COMMON_ATTRIBUTES + ["bgcolor", "border", "cellpadding", "cellspacing", "width"],
+    "td": _COMMON_ATTRIBUTES + _CELL_ATTRIBUTES,
+    "th": _COMMON_ATTRIBUTES + _CELL_ATTRIBUTES,
+    "col": _COMMON_ATTRIBUTES + ["span", "width"],
+    "font": _COMMON_ATTRIBUTES + ["color", "face", "size"],
+}
+# cid: keeps inline images (e.g. PDF previews) working
+ALLOWED_PROTOCOLS = frozenset({"http", "https", "mailto", "tel", "cid"})
+
+# bleach strips disallowed tags but keeps their text; drop these with their content
+_DROPPED_ELEMENTS = re.compile(
+    r"<(script|iframe|object|embed|noscript|title)\b[^>]*>.*?</\1\s*>", re.IGNORECASE | re.DOTALL
+)
+
+_cleaners = threading.local()  # bleach.Cleaner is not thread-safe
+
+
+def sanitize_html(source: str) -> str:
+    """
+    Removes scripts, event handlers and markup outside the email allowlist
+    """
+    cleaner = getattr(_cleaners, "cleaner", None)
+    if cleaner is None:
+        import bleach
+
+        css_sanitizer = None
+        if _has_css_sanitizer:
+            from bleach.css_sanitizer import CSSSanitizer
+            css_sanitizer = CSSSanitizer()
+        cleaner = _cleaners.cleaner = bleach.Cleaner(
+            tags=ALLOWED_TAGS,
+            attributes=ALLOWED_ATTRIBUTES,
+            protocols=ALLOWED_PROTOCOLS,
+            css_sanitizer=css_sanitizer,
+            strip=True,
+            strip_comments=True
+        )
+    return cleaner.clean(_DROPPED_ELEMENTS.sub("", source))
+
+
+class _TextExtractor(HTMLParser):
+    BLOCKS = frozenset({
+        "address", "blockquote", "center", "div", "dl", "dt", "dd", "h1", "h2", "h3",
+        "h4", "h5", "h6", "hr", "ol", "p", "pre", "table", "tr", "ul",
+    })
+    SKIPPED = frozenset({"head", "script", "style", "title"})
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.skip = 0
+        self.pre = 0
+        self.links: List[Optional[str]] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED:
+            self.skip += 1
+        elif tag == "br":
+            self.parts.append("\n")
+        elif tag == "li":
+            self.parts.append("\n- ")
+        elif tag in ("td", "th"):
+            self.parts.append(" ")
+        elif tag == "img":
+            alt = dict(attrs).get("alt")
+            if alt:
+                self.parts.append(f"[{alt}]")
+        elif tag in self.BLOCKS:
+            self.parts.append("\n\n")
+            if tag == "pre":
+                self.pre += 1
+        if tag == "a":
+            self.links.append(dict(attrs).get("href"))
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED:
+            self.skip = max(self.skip - 1, 0)
+        elif tag in self.BLOCKS:
+            self.parts.append("\n\n")
+            if tag == "pre" and self.pre:
+                self.pre -= 1
+        elif tag == "a" and self.links:
+            href = self.links.pop()
+            # "{{" keeps placeholder links of templates
+            if href and href.startswith(("http:", "https:", "mailto:", "tel:", "{{")):
+                self.parts.append(f" ({href.removeprefix('mailto:')})")
+
+    def handle_data(self, data):
+        if self.skip:
+            return
+        self.parts.append(data if self.pre else re.sub(r"\s+", " ", data))
+
+
+def html_to_text(source: str) -> str:
+    """
+    Plain-text rendering of an HTML body: block elements become
+    paragraphs, list items bullets and links "text (url)"
+    """
+    extractor = _TextExtractor()
+    extractor.feed(source)
+    extractor.close()
+    text = "".join(extractor.parts)
+    lines = [line.strip(" ") for line in text.split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip() + "\n"
+
+
+class HTMLContentProcessor:
+    """
+    Prepares html_body for sending: bleach sanitization (html_sanitize) and,
+    when a multipart email has no body, a generated plain-text part.
+
+    Results are memoized by a SHA-256 of the HTML in an LRU bounded to
+    html_cache_max_bytes, so bulk sends of identical HTML process it once.
+    Cache misses on bodies larger than html_offload_bytes are processed in
+    a worker thread to keep the event loop responsive.
+    """
+
+    def __init__(self, sanitize: bool, cache_max_bytes: int, offload_bytes: int):
+        self.sanitize = sanitize
+        self.cache_max_bytes = cache_max_bytes
+        self.offload_bytes = offload_bytes
+        self._cache: "OrderedDict[bytes, Tuple[str, Optional[str]]]" = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size(entry: Tuple[str, Optional[str]]) -> int:
+        return len(entry[0]) + len(entry[1] or "")
+
+    def _cached(self, key: bytes, with_text: bool) -> Optional[Tuple[str, Optional[str]]]:
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and (cached[1] is not None or not with_text):
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+            return None
+
+    def _process(self, key: bytes, html_body: str, with_text: bool) -> Tuple[str, Optional[str]]:
+        with self._lock:
+            cached = self._cache.get(key)
+        # Only the text may be missing from a cached entry
+        if cached is not None:
+            clean = cached[0]
+        else:
+            clean = sanitize_html(html_body) if self.sanitize else html_body
+        entry = (clean, html_to_text(clean) if with_text else None)
+
+        size = self._size(entry)
+        if size <= self.cache_max_bytes:
+            with self._lock:
+                previous = self._cache.pop(key, None)
+                if previous is not None:
+                    self._cache_bytes -= self._size(previous)
+                self._cache[key] = entry
+                self._cache_bytes += size
+                while self._cache_bytes > self.cache_max_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cache_bytes -= self._size(evicted)
+        return entry
+
+    async def prepare(self, html_body: str, with_text: bool) -> Tuple[str, Optional[str]]:
+        """
+        (sanitized HTML, plain text or None unless with_text). Cache hits
+        return inline; misses on bodies over html_offload_bytes run in a
+        worker thread.
+        """
+        key = hashlib.sha256(html_body.encode("utf-8", "surrogatepass")).digest()
+        cached = self._cached(key, with_text)
+        if cached is not None:
+            return cached
+        if len(html_body) > self.offload_bytes:
+            return await asyncio.to_thread(self._process, key, html_body, with_text)
+        return self._process(key, html_body, with_text)
+
+    def stats(self) -> dict:
+        """
+        Cache statistics
+        """
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "bytes": self._cache_bytes,
+                "max_bytes": self.cache_max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
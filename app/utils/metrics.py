@@ -0,0 +1,306 @@
+"""
+Lightweight Prometheus-style metrics
+
+Metric objects and their label children are created once, at import time.
+Recording a value on the hot path is a dict lookup plus a lock-protected
+increment or bucket update; no strings are built until /metrics is scraped
+and the text exposition format is rendered.
+"""
+import bisect
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, LabelValues, float]  # (name suffix, label values, value)
+
+
+class _Value:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class _HistogramValue:
+    __slots__ = ("_lock", "_bounds", "counts", "sum")
+
+    def __init__(self, bounds: Sequence[float]):
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+
+    def register(self, metric: "_Metric") -> None:
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition format (version 0.0.4)
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.family} {metric.documentation}")
+            lines.append(f"# TYPE {metric.family} {metric.kind}")
+            for suffix, label_values, value in metric.samples():
+                labels = metric.format_labels(label_values)
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Registry = REGISTRY
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[LabelValues, object] = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    @property
+    def family(self) -> str:
+        """Name on the HELP and TYPE lines; it must match the sample names"""
+        return self.name
+
+    def labels(self, *values: str):
+        """
+        Child for the given label values; resolve once and keep it on hot paths
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def format_labels(self, values: LabelValues, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> Iterator[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    @property
+    def family(self) -> str:
+        # Samples are name_total, so HELP/TYPE use it too (as prometheus_client does)
+        return f"{self.name}_total"
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def samples(self) -> Iterator[Sample]:
+        for values, child in list(self._children.items()):
+            yield "_total", values, child.value
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down, either recorded directly or read from a
+    function at scrape time (see set_function)
+    """
+
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[], Union[float, Dict[LabelValues, float]]]] = None
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], Union[float, Dict[LabelValues, float]]]) -> None:
+        """
+        Read the gauge from function when scraped. Labelled gauges return
+        {label values: value}, unlabelled ones a number.
+        """
+        self._function = function
+
+    def samples(self) -> Iterator[Sample]:
+        if self._function is not None:
+            try:
+                current = self._function()
+            except Exception:
+                return
+            if isinstance(current, dict):
+                for values, value in current.items():
+                    yield "", values, value
+            else:
+                yield "", (), current
+            return
+        for values, child in list(self._children.items()):
+            yield "", values, child.value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (e.g. latencies in seconds)"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def format_labels(self, values: LabelValues, extra: str = "") -> str:
+        # Bucket samples carry their bound in the label values tuple
+        if len(values) > len(self.labelnames):
+            return super().format_labels(values[:-1], f'le="{values[-1]}"')
+        return super().format_labels(values, extra)
+
+    def samples(self) -> Iterator[Sample]:
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", values + (_format_value(bound),), cumulative
+            yield "_count", values, cumulative
+            yield "_sum", values, total
+
+
+# Metric catalogue. Children for known label values are pre-created below so
+# the hot path never allocates.
+
+EMAIL_TYPES = ("plain", "html", "multipart", "unknown")
+OUTCOMES = ("success", "partial", "failed", "invalid", "suppressed")
+SMTP_PHASES = ("connect", "tls", "login", "data")
+
+EMAILS = Counter("notifyhub_emails", "Emails processed, by email type and outcome", ("email_type", "outcome"))
+VALIDATION_SECONDS = Histogram("notifyhub_validation_seconds", "Time to validate one EmailSendRequest")
+MIME_BUILD_SECONDS = Histogram("notifyhub_mime_build_seconds", "Time to build one serialized message")
+SMTP_PHASE_SECONDS = Histogram(
+    "notifyhub_smtp_phase_seconds",
+    "Time spent per SMTP phase (data covers MAIL FROM through the end of DATA)",
+    ("phase",)
+)
+EMAILS_IN_FLIGHT = Gauge("notifyhub_emails_in_flight", "Emails currently being delivered")
+SMTP_POOL_CONNECTIONS = Gauge("notifyhub_smtp_pool_connections", "SMTP pool connections by state", ("state",))
+SMTP_RELAY_UP = Gauge("notifyhub_smtp_relay_up", "1 while an SMTP relay is in rotation, 0 while its circuit breaker has it ejected", ("relay",))
+SMTP_RELAY_OUTSTANDING = Gauge("notifyhub_smtp_relay_outstanding", "Sends in progress per SMTP relay", ("relay",))
+SMTP_LANE_DEPTH = Gauge("notifyhub_smtp_lane_depth", "Sends waiting for an SMTP executor slot, by priority lane", ("lane",))
+SMTP_LANE_WAIT_SECONDS = Histogram(
+    "notifyhub_smtp_lane_wait_seconds",
+    "Time a send waited for an SMTP executor slot, by priority lane",
+    ("lane",)
+)
+QUEUE_DEPTH = Gauge("notifyhub_queue_depth", "Delivery queue depth (pending in memory, waiting for retry)", ("queue",))
+RATE_LIMITED = Counter(
+    "notifyhub_rate_limited_requests",
+    "Requests refused with 429, by API key name and exceeded limit (rate or concurrency)",
+    ("api_key", "limit")
+)
+SUPPRESSED_RECIPIENTS = Counter(
+    "notifyhub_suppressed_recipients",
+    "Recipients dropped before sending because they are on the suppression list"
+)
+IDEMPOTENT_REPLAYS = Counter(
+    "notifyhub_idempotent_replays",
+    "Requests answered with the stored result of their Idempotency-Key, by where it came from",
+    ("source",)
+)
+
+EMAIL_OUTCOMES: Dict[Tuple[str, str], _Value] = {
+    (email_type, outcome): EMAILS.labels(email_type, outcome)
+    for email_type in EMAIL_TYPES
+    for outcome in OUTCOMES
+}
+SMTP_CONNECT_SECONDS = SMTP_PHASE_SECONDS.labels("connect")
+SMTP_TLS_SECONDS = SMTP_PHASE_SECONDS.labels("tls")
+SMTP_LOGIN_SECONDS = SMTP_PHASE_SECONDS.labels("login")
+SMTP_DATA_SECONDS = SMTP_PHASE_SECONDS.labels("data")
+VALIDATION_SECONDS.labels()
+IDEMPOTENT_REPLAYS_MEMORY = IDEMPOTENT_REPLAYS.labels("memory")
+IDEMPOTENT_REPLAYS_DATABASE = IDEMPOTENT_REPLAYS.labels("database")
+IDEMPOTENT_REPLAYS_COALESCED = IDEMPOTENT_REPLAYS.labels("coalesced")
+MIME_BUILD_SECONDS.labels()
+EMAILS_IN_FLIGHT.labels()
+SUPPRESSED_RECIPIENTS.labels()
+
+
+def record_email(email_type: str, outcome: str, count: int = 1) -> None:
+    """
+    Count processed emails without allocating label strings
+    """
+    child = EMAIL_OUTCOMES.get((email_type, outcome)) or EMAIL_OUTCOMES[("unknown", outcome)]
+    child.inc(count)
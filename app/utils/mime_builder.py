@@ -0,0 +1,329 @@
+"""
+MIME message building with a cache of pre-rendered message bodies
+"""
+import base64
+import hashlib
+import mmap
+import os
+import secrets
+import threading
+from collections import OrderedDict
+from email import policy
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formataddr
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Union
+
+# base64 output is wrapped at 76 characters per line (RFC 2045); 57 input
+# bytes encode to exactly one line. Attachments are encoded in blocks of
+# whole lines so only one block is ever held in memory.
+BASE64_LINE_INPUT = 57
+BASE64_BLOCK_LINES = 1024
+ENCODED_BLOCK_BYTES = 1048576  # Chunk size when sending already encoded content
+
+
+class FileAttachment(NamedTuple):
+    """
+    A file on disk to be sent as a base64 attachment. encoded_path, when
+    set, points at a cached copy of the base64 content that is sent as is.
+    Parts with a content_id are inline (e.g. images referenced from the
+    HTML body as cid:<content_id>).
+    """
+
+    path: str
+    filename: str
+    content_type: str = "application/octet-stream"
+    encoded_path: Optional[str] = None
+    content_id: Optional[str] = None
+
+    def part_headers(self) -> bytes:
+        """
+        Serializes the Content-* headers of the attachment part, including
+        the blank line that separates them from the encoded content
+        """
+        maintype, _, subtype = self.content_type.partition("/")
+        part = MIMEBase(maintype or "application", subtype or "octet-stream")
+        if self.content_id:
+            part.add_header("Content-Disposition", "inline", filename=self.filename)
+            part["Content-ID"] = f"<{self.content_id}>"
+        else:
+            part.add_header("Content-Disposition", "attachment", filename=self.filename)
+        part["Content-Transfer-Encoding"] = "base64"
+        del part["MIME-Version"]
+        return part.as_bytes(policy=policy.SMTP)
+
+    def encoded_size(self) -> int:
+        """
+        Size of the base64 content, line breaks included
+        """
+        if self.encoded_path:
+            return os.path.getsize(self.encoded_path)
+        return base64_encoded_size(os.path.getsize(self.path))
+
+    def iter_base64(self) -> Iterator[bytes]:
+        """
+        Yields the base64 content in CRLF-terminated 76 character lines,
+        block by block straight from a memory map of the (encoded) file
+        """
+        if self.encoded_path:
+            block = ENCODED_BLOCK_BYTES
+            encode = bytes
+            path = self.encoded_path
+        else:
+            block = BASE64_LINE_INPUT * BASE64_BLOCK_LINES
+            encode = encode_base64_lines
+            path = self.path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, len(mapped), block):
+                        yield encode(view[offset:offset + block])
+                finally:
+                    view.release()
+
+
+def base64_encoded_size(size: int) -> int:
+    """
+    Size of base64 content for size input bytes, CRLF line breaks included
+    """
+    lines = -(-size // BASE64_LINE_INPUT)
+    return -(-size // 3) * 4 + 2 * lines
+
+
+def encode_base64_lines(data) -> bytes:
+    """
+    base64-encodes data (a whole number of lines' worth, except at the end)
+    into CRLF-terminated 76 character lines
+    """
+    encoded = base64.b64encode(data)
+    return b"".join(encoded[i:i + 76] + b"\r\n" for i in range(0, len(encoded), 76))
+
+
+class MessageStream:
+    """
+    A message too large to serialize up front: pre-rendered byte segments
+    interleaved with file attachments that are encoded while being sent.
+    Every segment starts at the beginning of a line.
+    """
+
+    def __init__(self, segments: Sequence[Union[bytes, FileAttachment]]):
+        self.segments = list(segments)
+
+    @property
+    def size(self) -> int:
+        """
+        Size of the serialized message in bytes
+        """
+        return sum(
+            len(segment) if isinstance(segment, bytes) else segment.encoded_size()
+            for segment in self.segments
+        )
+
+
+class OutgoingMessage(NamedTuple):
+    """A fully serialized (or streamed) message plus its SMTP envelope"""
+
+    from_addr: str
+    to_addrs: List[str]
+    data: Union[bytes, MessageStream]
+
+
+class MessageBuilder:
+    """
+    Builds wire-format messages for plain, html and multipart emails.
+
+    The MIME body entity (Content-Type headers plus the encoded parts) only
+    depends on the content, so it is rendered once, stored as bytes in an
+    LRU cache keyed by a SHA-256 of the content, and reused. Each send only
+    serializes its own Subject/From/To/Cc headers in front of it, which makes
+    fan-out sends of the same body cheap.
+    """
+
+    def __init__(self, cache_max_bytes: int):
+        self.cache_max_bytes = cache_max_bytes
+        self._cache: "OrderedDict[bytes, bytes]" = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _content_key(email_type: str, body: Optional[str], html_body: Optional[str]) -> bytes:
+        digest = hashlib.sha256(email_type.encode())
+        for part in (body, html_body):
+            encoded = b"" if part is None else part.encode("utf-8", "surrogatepass")
+            # Length prefixes keep ("ab", "c") and ("a", "bc") apart
+            digest.update(len(encoded).to_bytes(8, "big"))
+            digest.update(encoded)
+        return digest.digest()
+
+    @staticmethod
+    def render_body(email_type: str, body: Optional[str], html_body: Optional[str]) -> bytes:
+        """
+        Serializes the MIME body entity, including its Content-* headers
+        """
+        if email_type == "plain":
+            entity = MIMEText(body, "plain", "utf-8")
+        elif email_type == "html":
+            entity = MIMEText(html_body, "html", "utf-8")
+        elif email_type == "multipart":
+            entity = MIMEMultipart("alternative")
+            # Order matters: plain text first, then HTML
+            entity.attach(MIMEText(body, "plain", "utf-8"))
+            entity.attach(MIMEText(html_body, "html", "utf-8"))
+        else:
+            raise ValueError(f"Unsupported email type: {email_type}")
+        return entity.as_bytes(policy=policy.SMTP)
+
+    def body(self, email_type: str, body: Optional[str], html_body: Optional[str]) -> bytes:
+        """
+        Returns the rendered body entity, from the cache when possible
+        """
+        key = self._content_key(email_type, body, html_body)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        rendered = self.render_body(email_type, body, html_body)
+        if len(rendered) <= self.cache_max_bytes:
+            with self._lock:
+                if key not in self._cache:
+                    self._cache[key] = rendered
+                    self._cache_bytes += len(rendered)
+                    while self._cache_bytes > self.cache_max_bytes:
+                        _, evicted = self._cache.popitem(last=False)
+                        self._cache_bytes -= len(evicted)
+        return rendered
+
+    @staticmethod
+    def _header(name: str, value: str, header_policy: policy.EmailPolicy) -> bytes:
+        if "\r" in value or "\n" in value:
+            raise ValueError(f"{name} header may not contain line breaks")
+        line = f"{name}: {value}"
+        # Fast path: short ASCII headers need no folding or encoding
+        if len(line) <= 78 and line.isascii():
+            return line.encode("ascii") + b"\r\n"
+        return header_policy.fold_binary(name, header_policy.header_factory(name, value))
+
+    @classmethod
+    def render_headers(
+        cls,
+        subject: str,
+        sender_name: str,
+        sender_email: str,
+        recipients: List[str],
+        cc: Optional[List[str]] = None
+    ) -> bytes:
+        """
+        Serializes the per-message headers. Bcc is never written to the message.
+        """
+        addresses = [sender_email, *recipients, *(cc or [])]
+        header_policy = policy.SMTP if all(addr.isascii() for addr in addresses) else policy.SMTPUTF8
+        headers = [
+            cls._header("Subject", subject, header_policy),
+            cls._header("From", formataddr((sender_name, sender_email)), header_policy)
+        ]
+        if recipients:  # Empty when every To address was suppressed and only Cc/Bcc remain
+            headers.append(cls._header("To", ", ".join(recipients), header_policy))
+        if cc:
+            headers.append(cls._header("Cc", ", ".join(cc), header_policy))
+        return b"".join(headers)
+
+    def build(
+        self,
+        email_type: str,
+        recipients: List[str],
+        subject: str,
+        sender_name: str,
+        sender_email: str,
+        body: Optional[str] = None,
+        html_body: Optional[str] = None,
+        cc: Optional[List[str]] = None,
+        bcc: Optional[List[str]] = None,
+        attachments: Optional[List[FileAttachment]] = None,
+        inline: Optional[List[FileAttachment]] = None
+    ) -> OutgoingMessage:
+        """
+        Builds a message ready for SMTP DATA, with recipients + cc + bcc as the envelope.
+        With attachments or inline parts the message is a multipart/mixed MessageStream.
+        """
+        entity = self.body(email_type, body, html_body)
+        headers = self.render_headers(subject, sender_name, sender_email, recipients, cc)
+        to_addrs = [*recipients, *(cc or []), *(bcc or [])]
+        if not attachments and not inline:
+            return OutgoingMessage(sender_email, to_addrs, headers + entity)
+        related_type = "multipart/alternative" if email_type == "multipart" else "text/html"
+        return OutgoingMessage(
+            sender_email, to_addrs, self.mixed(headers, entity, attachments or [], inline or [], related_type)
+        )
+
+    @staticmethod
+    def _boundary() -> bytes:
+        # base64 and the rendered body never contain "=_", so the boundary can't collide
+        return f"=_{secrets.token_hex(16)}".encode("ascii")
+
+    @classmethod
+    def mixed(
+        cls,
+        headers: bytes,
+        entity: bytes,
+        attachments: List[FileAttachment],
+        inline: Sequence[FileAttachment] = (),
+        related_type: str = "text/html"
+    ) -> MessageStream:
+        """
+        Wraps a body entity and attachments into a multipart/mixed message.
+        Inline parts are grouped with the body in a multipart/related part.
+        """
+        if not entity.endswith(b"\r\n"):
+            entity += b"\r\n"
+        body: List[Union[bytes, FileAttachment]] = [entity]
+        if inline:
+            related = cls._boundary()
+            body = [
+                b'Content-Type: multipart/related; type="' + related_type.encode("ascii")
+                + b'"; boundary="' + related + b'"\r\n\r\n'
+                + b"--" + related + b"\r\n"
+                + entity
+            ]
+            for part in inline:
+                body.append(b"--" + related + b"\r\n" + part.part_headers())
+                body.append(part)
+            body.append(b"--" + related + b"--\r\n")
+
+        boundary = cls._boundary()
+        delimiter = b"--" + boundary + b"\r\n"
+        segments: List[Union[bytes, FileAttachment]] = [
+            headers
+            + b"MIME-Version: 1.0\r\n"
+            + b'Content-Type: multipart/mixed; boundary="' + boundary + b'"\r\n\r\n'
+            + delimiter
+            + body[0]
+        ]
+        segments.extend(body[1:])
+        for attachment in attachments:
+            segments.append(delimiter + attachment.part_headers())
+            segments.append(attachment)
+        segments.append(b"--" + boundary + b"--\r\n")
+        return MessageStream(segments)
+
+    def stats(self) -> dict:
+        """
+        Cache statistics
+        """
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "bytes": self._cache_bytes,
+                "max_bytes": self.cache_max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -0,0 +1,78 @@
+"""
+Incremental NDJSON (newline-delimited JSON) helpers
+"""
+from typing import AsyncIterator, Optional, Tuple
+
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+NDJSON_MEDIA_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+
+
+async def iter_ndjson_lines(
+    chunks: AsyncIterator[bytes],
+    max_line_bytes: int
+) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """
+    Split a byte stream into lines without buffering more than one line.
+
+    Yields:
+        tuple: (line index, line bytes) for non-blank lines, or
+        (line index, None) for lines longer than max_line_bytes, which are
+        skipped rather than buffered
+    """
+    buffer = bytearray()
+    index = 0
+    oversized = False
+
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end == -1:
+                if not oversized:
+                    buffer += chunk[start:]
+                    if len(buffer) > max_line_bytes:
+                        oversized = True
+                        buffer.clear()
+                break
+
+            if oversized:
+                yield index, None
+                oversized = False
+            else:
+                buffer += chunk[start:end]
+                if len(buffer) > max_line_bytes:
+                    yield index, None
+                elif buffer.strip():
+                    yield index, bytes(buffer)
+                buffer.clear()
+            index += 1
+            start = end + 1
+
+    if oversized:
+        yield index, None
+    elif buffer.strip():
+        yield index, bytes(buffer)
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    Streaming NDJSON response that leaves `receive` to the endpoint.
+
+    The stock StreamingResponse listens for client disconnects by calling
+    `receive()`, which would steal request body chunks from an endpoint that
+    is still reading its input while results stream out. Disconnects are
+    detected on send instead.
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,53 @@
+"""
+Token bucket rate limiting
+"""
+import math
+import time
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average and bursts of up to capacity.
+
+    Tokens are refilled lazily from the time elapsed since the last call, so
+    an idle bucket costs nothing. Not thread-safe: buckets are used from the
+    event loop only.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def configure(self, rate: float, capacity: float) -> None:
+        """
+        Change the limits, keeping the tokens already earned
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+
+    def take(self) -> float:
+        """
+        Take one token
+
+        Returns:
+            0.0 if a token was taken, otherwise seconds until one is available
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+def default_burst(rate: float) -> int:
+    """
+    Bucket size used when none is configured: one second worth of requests
+    """
+    return max(1, math.ceil(rate))
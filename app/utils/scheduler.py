@@ -0,0 +1,133 @@
+"""
+Priority lanes for SMTP delivery
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+
+from app.utils.metrics import SMTP_LANE_WAIT_SECONDS
+
+PRIORITIES = ("high", "normal", "bulk")
+
+
+class Lane:
+    """Sends of one priority: waiting callers, sends running, fair-share state"""
+
+    def __init__(self, name: str, weight: int):
+        self.name = name
+        self.weight = max(weight, 1)
+        self.waiters: Deque[Tuple[asyncio.Future, float]] = deque()
+        self.in_flight = 0
+        self.finish = 0.0  # virtual finish time of the last send started (WFQ tag)
+        self.wait_seconds = SMTP_LANE_WAIT_SECONDS.labels(name)
+
+    def stats(self) -> dict:
+        return {
+            "weight": self.weight,
+            "depth": len(self.waiters),
+            "in_flight": self.in_flight
+        }
+
+
+class LaneScheduler:
+    """
+    Admits sends to the SMTP executor through one lane per priority, so a
+    bulk campaign can't hold up transactional mail.
+
+    At most capacity sends run at once, one per executor thread, so an
+    admitted send starts right away instead of queueing behind others in
+    the executor; callers over the limit wait in their lane. Whenever a
+    send finishes the next one is picked by weighted fair queuing: lanes
+    with work queued share the capacity in proportion to their weights, so
+    bulk keeps moving under transactional load but can't starve it. On top
+    of that, reserved slots are only ever used by the high lane, which
+    leaves it threads (and pooled connections) even while the other lanes
+    are saturated.
+
+    Not thread-safe: used from the event loop only.
+    """
+
+    def __init__(self, capacity: int, weights: Dict[str, int], reserved_high: int):
+        self.capacity = capacity
+        self.reserved_high = min(max(reserved_high, 0), capacity - 1)
+        self.lanes = {name: Lane(name, weights.get(name, 1)) for name in PRIORITIES}
+        self.in_flight = 0
+        self._virtual_time = 0.0
+
+    def _lane(self, priority: str) -> Lane:
+        lane = self.lanes.get(priority)
+        if lane is None:
+            raise ValueError(f"Unknown priority {priority!r}, expected one of {PRIORITIES}")
+        return lane
+
+    def _can_start(self, lane: Lane) -> bool:
+        if self.in_flight >= self.capacity:
+            return False
+        if lane.name == "high":
+            return True
+        others = self.in_flight - self.lanes["high"].in_flight
+        return others < self.capacity - self.reserved_high
+
+    def _tag(self, lane: Lane) -> float:
+        return max(lane.finish, self._virtual_time) + 1.0 / lane.weight
+
+    def _start(self, lane: Lane, queued_at: float) -> None:
+        self._virtual_time = max(lane.finish, self._virtual_time)
+        lane.finish = self._virtual_time + 1.0 / lane.weight
+        lane.in_flight += 1
+        self.in_flight += 1
+        lane.wait_seconds.observe(time.monotonic() - queued_at)
+
+    def _dispatch(self) -> None:
+        """
+        Hand free slots to waiting callers, lane with the smallest tag first
+        """
+        while self.in_flight < self.capacity:
+            best: Optional[Lane] = None
+            for lane in self.lanes.values():
+                while lane.waiters and lane.waiters[0][0].done():
+                    lane.waiters.popleft()  # caller gave up
+                if lane.waiters and self._can_start(lane) and (best is None or self._tag(lane) < self._tag(best)):
+                    best = lane
+            if best is None:
+                return
+            future, queued_at = best.waiters.popleft()
+            self._start(best, queued_at)
+            future.set_result(None)
+
+    def _release(self, lane: Lane) -> None:
+        lane.in_flight -= 1
+        self.in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: str = "normal") -> AsyncIterator[None]:
+        """
+        Hold one executor slot of the given priority for the duration of the block
+
+        Raises:
+            ValueError: unknown priority
+        """
+        lane = self._lane(priority)
+        queued_at = time.monotonic()
+        if not lane.waiters and self._can_start(lane):
+            self._start(lane, queued_at)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            lane.waiters.append((future, queued_at))
+            self._dispatch()  # the lane may only have been blocked by callers who gave up
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release(lane)  # admitted just as we were cancelled
+                raise
+        try:
+            yield
+        finally:
+            self._release(lane)
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: lane.stats() for name, lane in self.lanes.items()}
@@ -1,23 +1,530 @@
+import asyncio
+import re
 import smtplib
 import ssl
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from typing import List, Optional
+import threading
+import time
+from time import perf_counter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Deque, Iterator, List, Optional, Tuple
 import logging
 
-from app.config import settings
+from app.config import SMTPRelay, settings
+from app.utils.delivery_planner import DeliveryReport, plan_envelopes
+from app.utils.metrics import (
+    MIME_BUILD_SECONDS,
+    SMTP_CONNECT_SECONDS,
+    SMTP_DATA_SECONDS,
+    SMTP_LOGIN_SECONDS,
+    SMTP_TLS_SECONDS,
+)
+from app.utils.mime_builder import FileAttachment, MessageBuilder, MessageStream, OutgoingMessage
+from app.utils.scheduler import LaneScheduler
+from app.utils.smtp_relays import NoRelayAvailableError, Relay, RelayRouter
+
+_mime_build_seconds = MIME_BUILD_SECONDS.labels()
 
 logger = logging.getLogger(__name__)
 
+# SMTP transparency (RFC 5321 4.5.2): lines starting with "." get another one
+_LEADING_DOT = re.compile(rb"(?m)^\.")
+
+# Errors where the relay answered, so the session itself is still usable
+RECOVERABLE_SMTP_ERRORS = (
+    smtplib.SMTPRecipientsRefused,
+    smtplib.SMTPSenderRefused,
+    smtplib.SMTPDataError,
+    smtplib.SMTPResponseException,
+)
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    Classifies a delivery error: 4xx replies, dropped sessions and network
+    errors are worth retrying; 5xx replies and local errors are permanent.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        # Protocol/feature errors (e.g. unsupported AUTH) won't fix themselves
+        return False
+    # Connection refused, resets, timeouts
+    return isinstance(error, OSError)
+
+
+class PooledConnection:
+    """An open SMTP session plus the bookkeeping the pool needs"""
+
+    def __init__(self, server: smtplib.SMTP):
+        self.server = server
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages_sent = 0
+
+    def close(self) -> None:
+        try:
+            self.server.quit()
+        except Exception:
+            self.server.close()
+
+
+class SMTPConnectionPool:
+    """
+    Thread-safe pool of connected (and authenticated) SMTP sessions.
+
+    Mirrors the DB engine settings: idle connections are checked with NOOP
+    before reuse (pre-ping) and recycled after an idle timeout or a fixed
+    number of messages.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], smtplib.SMTP],
+        size: int,
+        idle_timeout: float,
+        max_messages: int,
+        pre_ping: bool = True
+    ):
+        self._connect = connect
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.pre_ping = pre_ping
+        self._idle: Deque[PooledConnection] = deque()
+        self._lock = threading.Lock()
+        self._capacity = threading.BoundedSemaphore(size)
+        self._open = 0
+
+    def _is_reusable(self, conn: PooledConnection) -> bool:
+        if time.monotonic() - conn.last_used > self.idle_timeout:
+            return False
+        if not self.pre_ping:
+            return True
+        try:
+            return conn.server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _discard(self, conn: PooledConnection) -> None:
+        conn.close()
+        with self._lock:
+            self._open -= 1
+
+    def acquire(self) -> PooledConnection:
+        """
+        Take an idle connection (or open a new one), blocking while the pool is exhausted
+        """
+        self._capacity.acquire()
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    break
+                if self._is_reusable(conn):
+                    return conn
+                logger.debug("Discarding stale SMTP connection")
+                self._discard(conn)
+
+            conn = PooledConnection(self._connect())
+            with self._lock:
+                self._open += 1
+            return conn
+        except Exception:
+            self._capacity.release()
+            raise
+
+    def release(self, conn: PooledConnection, discard: bool = False) -> None:
+        """
+        Return a connection to the pool, or close it if it is broken or worn out
+        """
+        try:
+            conn.last_used = time.monotonic()
+            if discard or conn.messages_sent >= self.max_messages:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            self._capacity.release()
+
+    @contextmanager
+    def connection(self, conn: Optional[PooledConnection] = None) -> Iterator[PooledConnection]:
+        """
+        Borrow a connection for one or more SMTP transactions (or look after
+        one already taken with acquire())
+        """
+        if conn is None:
+            conn = self.acquire()
+        try:
+            yield conn
+        except RECOVERABLE_SMTP_ERRORS:
+            # The relay rejected the transaction but the session is alive;
+            # RSET clears the half-finished envelope so it can be reused.
+            try:
+                conn.server.rset()
+                self.release(conn)
+            except Exception:
+                self.release(conn, discard=True)
+            raise
+        except Exception:
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self) -> dict:
+        """
+        Current pool utilisation
+        """
+        with self._lock:
+            idle = len(self._idle)
+            return {
+                "size": self.size,
+                "open": self._open,
+                "idle": idle,
+                "in_use": self._open - idle
+            }
+
+    def close(self) -> None:
+        """
+        Close all idle connections
+        """
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+            self._open -= len(idle)
+        for conn in idle:
+            conn.close()
+
+
 class SMTPClient:
     def __init__(self):
-        self.smtp_server = settings.smtp_host
-        self.smtp_port = settings.smtp_port
         self.smtp_username = settings.smtp_username
         self.smtp_password = settings.smtp_password
         self.smtp_use_tls = settings.smtp_use_tls
         self.smtp_from_name = settings.smtp_from_name
         self.smtp_from_email = settings.smtp_from_email
+        self.smtp_timeout = settings.smtp_timeout
+        self.max_rcpt = settings.smtp_max_rcpt
+
+        # smtplib is blocking, so every SMTP session runs on a dedicated thread
+        # pool. Sends wait for a thread in their priority lane (backpressure)
+        # instead of piling up in the executor, where they would be FIFO.
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.smtp_max_workers,
+            thread_name_prefix="smtp"
+        )
+        # Health probes of ejected relays get threads of their own, so they
+        # neither wait behind queued sends nor take a thread from their lanes
+        self._probe_executor = ThreadPoolExecutor(
+            max_workers=max(len(settings.smtp_relays), 1),
+            thread_name_prefix="smtp-probe"
+        )
+        self.scheduler = LaneScheduler(
+            capacity=settings.smtp_max_workers,
+            weights=settings.smtp_lane_weights,
+            reserved_high=settings.smtp_reserved_high
+        )
+
+        # Renders each distinct body once; sends only add their own headers
+        self.builder = MessageBuilder(cache_max_bytes=settings.mime_cache_max_bytes)
+
+        # One pool per relay, reusing sessions across sends instead of
+        # redoing connect/STARTTLS/login; the router spreads sends over them
+        relays = settings.smtp_relays or [SMTPRelay(host=settings.smtp_host, port=settings.smtp_port)]
+        self.relays = [
+            Relay(relay.host, relay.port, relay.weight, SMTPConnectionPool(
+                connect=partial(self._open_connection, relay.host, relay.port),
+                size=relay.pool_size or settings.smtp_pool_size,
+                idle_timeout=settings.smtp_pool_idle_timeout,
+                max_messages=settings.smtp_pool_max_messages,
+                pre_ping=settings.smtp_pool_pre_ping
+            ))
+            for relay in relays
+        ]
+        self.router = RelayRouter(
+            self.relays,
+            strategy=settings.smtp_routing,
+            breaker_failures=settings.smtp_breaker_failures,
+            slow_seconds=settings.smtp_breaker_slow_seconds,
+            cooldown=settings.smtp_breaker_cooldown,
+            probe=self._start_probe
+        )
+
+    def _open_connection(self, host: str, port: int) -> smtplib.SMTP:
+        """
+        Open an SMTP session (connect, optional STARTTLS, optional login).
+        Blocking - only call from the executor.
+        """
+        start = perf_counter()
+        server = smtplib.SMTP(host, port, timeout=self.smtp_timeout)
+        SMTP_CONNECT_SECONDS.observe(perf_counter() - start)
+        try:
+            if self.smtp_use_tls:
+                start = perf_counter()
+                context = ssl.create_default_context()
+                server.starttls(context=context)
+                SMTP_TLS_SECONDS.observe(perf_counter() - start)
+            if self.smtp_username and self.smtp_password:
+                start = perf_counter()
+                server.login(self.smtp_username, self.smtp_password)
+                SMTP_LOGIN_SECONDS.observe(perf_counter() - start)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    @staticmethod
+    def _sendmail(server: smtplib.SMTP, message: OutgoingMessage, envelope: List[str]) -> dict:
+        """
+        Run one MAIL FROM/RCPT TO/DATA transaction; returns smtplib's refused recipients
+        """
+        mail_options = ()
+        if not all(addr.isascii() for addr in (message.from_addr, *envelope)):
+            mail_options = ("SMTPUTF8", "BODY=8BITMIME")
+        start = perf_counter()
+        try:
+            if isinstance(message.data, MessageStream):
+                return SMTPClient._sendmail_stream(server, message.from_addr, envelope, message.data, mail_options)
+            return server.sendmail(message.from_addr, envelope, message.data, mail_options=mail_options)
+        finally:
+            SMTP_DATA_SECONDS.observe(perf_counter() - start)
+
+    @staticmethod
+    def _sendmail_stream(
+        server: smtplib.SMTP,
+        from_addr: str,
+        envelope: List[str],
+        stream: MessageStream,
+        mail_options: tuple
+    ) -> dict:
+        """
+        smtplib.SMTP.sendmail() for a MessageStream: DATA is written segment
+        by segment and attachments block by block, so a large attachment is
+        never held in memory as a whole, however many envelopes it goes to.
+        """
+        def reset():
+            try:
+                server.rset()
+            except smtplib.SMTPServerDisconnected:
+                pass
+
+        server.ehlo_or_helo_if_needed()
+        options = []
+        if server.does_esmtp:
+            if server.has_extn("size"):
+                options.append(f"size={stream.size}")
+            options.extend(mail_options)
+
+        code, response = server.mail(from_addr, options)
+        if code != 250:
+            if code == 421:
+                server.close()
+            else:
+                reset()
+            raise smtplib.SMTPSenderRefused(code, response, from_addr)
+
+        refused = {}
+        for address in envelope:
+            code, response = server.rcpt(address)
+            if code not in (250, 251):
+                refused[address] = (code, response)
+            if code == 421:
+                server.close()
+                raise smtplib.SMTPRecipientsRefused(refused)
+        if len(refused) == len(envelope):
+            reset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        code, response = server.docmd("data")
+        if code != 354:
+            reset()
+            raise smtplib.SMTPDataError(code, response)
+        for segment in stream.segments:
+            if isinstance(segment, bytes):
+                server.send(_LEADING_DOT.sub(b"..", segment))
+            else:
+                # base64 lines never start with "."
+                for block in segment.iter_base64():
+                    server.send(block)
+        server.send(b".\r\n")  # segments always end with CRLF
+        code, response = server.getreply()
+        if code != 250:
+            if code == 421:
+                server.close()
+            else:
+                reset()
+            raise smtplib.SMTPDataError(code, response)
+        return refused
+
+    def _checkout(self) -> Tuple[Relay, PooledConnection]:
+        """
+        A pooled session on a relay picked by the router; pair with
+        router.release(relay). A relay that can't be connected to is
+        reported to its breaker and the next one is tried, which is safe
+        because nothing was sent yet.
+        """
+        tried: List[Relay] = []
+        last_error = None
+        while True:
+            try:
+                relay = self.router.acquire(exclude=tried)
+            except NoRelayAvailableError:
+                if last_error is None:
+                    raise
+                raise last_error
+            start = perf_counter()
+            try:
+                return relay, relay.pool.acquire()
+            except Exception as e:
+                self.router.record(relay, perf_counter() - start, e)
+                self.router.release(relay)
+                logger.warning(f"Could not connect to SMTP relay {relay.name}: {e}")
+                tried.append(relay)
+                last_error = e
+
+    def _send_blocking(self, message: OutgoingMessage, envelope: List[str]) -> dict:
+        """
+        Deliver one envelope over a pooled SMTP session. Runs in the executor.
+        """
+        relay, conn = self._checkout()
+        start = perf_counter()
+        error = None
+        reused = conn.messages_sent > 0
+        try:
+            try:
+                with relay.pool.connection(conn) as conn:
+                    refused = self._sendmail(conn.server, message, envelope)
+                    conn.messages_sent += 1
+                    return refused
+            except smtplib.SMTPServerDisconnected:
+                # The relay dropped a reused session between the health check and
+                # MAIL FROM; retry once on a fresh connection.
+                if not reused:
+                    raise
+                logger.info("Pooled SMTP connection went stale, reconnecting")
+                with relay.pool.connection() as conn:
+                    refused = self._sendmail(conn.server, message, envelope)
+                    conn.messages_sent += 1
+                    return refused
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.router.record(relay, perf_counter() - start, error)
+            self.router.release(relay)
+
+    async def _send_envelope(self, message: OutgoingMessage, envelope: List[str], priority: str) -> dict:
+        async with self.scheduler.slot(priority):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._send_blocking, message, envelope)
+
+    async def _deliver(
+        self, message: OutgoingMessage, priority: str = "normal", only_to: Optional[List[str]] = None
+    ) -> DeliveryReport:
+        """
+        Deliver a message without blocking the event loop.
+
+        Recipients are deduplicated and split into envelopes of at most
+        smtp_max_rcpt addresses, which are sent in parallel over pooled
+        connections, in the given priority lane. Raises the first error if no
+        recipient was accepted.
+
+        only_to restricts delivery to some of the message's recipients (a
+        retry of those the relay deferred); the headers still list everyone.
+        """
+        envelopes = plan_envelopes(message.to_addrs if only_to is None else only_to, self.max_rcpt)
+        outcomes = await asyncio.gather(
+            *(self._send_envelope(message, envelope, priority) for envelope in envelopes),
+            return_exceptions=True
+        )
+
+        report = DeliveryReport()
+        first_error = None
+        for envelope, outcome in zip(envelopes, outcomes):
+            if isinstance(outcome, Exception):
+                report.reject_envelope(envelope, outcome)
+                first_error = first_error or outcome
+            else:
+                report.add_envelope(envelope, outcome)
+
+        if not report.accepted and first_error is not None:
+            raise first_error
+        if report.rejected:
+            logger.warning(f"Delivered to {len(report.accepted)} recipients, rejected {report.errors()}")
+        return report
+
+    def _start_probe(self, relay: Relay) -> None:
+        try:
+            self._probe_executor.submit(self._probe, relay)
+        except RuntimeError:
+            pass  # shutting down
+
+    def _probe(self, relay: Relay) -> None:
+        result = self.test_connection(relay)
+        self.router.probed(relay, result["success"])
+
+    def pool_stats(self) -> dict:
+        """
+        Connection pool utilisation summed over the relays
+        """
+        totals = {"size": 0, "open": 0, "idle": 0, "in_use": 0}
+        for relay in self.relays:
+            for name, value in relay.pool.stats().items():
+                totals[name] += value
+        return totals
+
+    def close(self) -> None:
+        """
+        Release delivery threads, waiting for in-flight sends to finish,
+        then close pooled connections
+        """
+        self._probe_executor.shutdown(wait=False, cancel_futures=True)
+        self._executor.shutdown(wait=True)
+        for relay in self.relays:
+            relay.pool.close()
+
+    def build_message(
+        self,
+        email_type: str,
+        recipients: List[str],
+        subject: str,
+        body: Optional[str] = None,
+        html_body: Optional[str] = None,
+        sender_email: Optional[str] = None,
+        sender_name: Optional[str] = None,
+        cc: Optional[List[str]] = None,
+        bcc: Optional[List[str]] = None,
+        attachments: Optional[List[FileAttachment]] = None,
+        inline: Optional[List[FileAttachment]] = None
+    ) -> OutgoingMessage:
+        """
+        Builds the serialized message for a plain, html or multipart email,
+        with recipients + cc + bcc as the envelope.
+        """
+        start = perf_counter()
+        message = self.builder.build(
+            email_type,
+            recipients,
+            subject,
+            sender_name=sender_name or self.smtp_from_name,
+            sender_email=sender_email or self.smtp_from_email,
+            body=body,
+            html_body=html_body,
+            cc=cc,
+            bcc=bcc,
+            attachments=attachments,
+            inline=inline
+        )
+        _mime_build_seconds.observe(perf_counter() - start)
+        return message
 
     async def send_plain_email(
         self,
@@ -27,38 +534,21 @@ class SMTPClient:
         sender_email: Optional[str] = None,
         sender_name: Optional[str] = None,
         cc: Optional[List[str]] = None,
-        bcc: Optional[List[str]] = None
-    ) -> str:
+        bcc: Optional[List[str]] = None,
+        priority: str = "normal",
+        only_to: Optional[List[str]] = None
+    ) -> DeliveryReport:
         """
         Sends a plain text email.
         """
-        msg = MIMEText(body, "plain", "utf-8")
-        msg["Subject"] = subject
-        msg["From"] = f"{sender_name or self.smtp_from_name} <{sender_email or self.smtp_from_email}>"
-        msg["To"] = ", ".join(recipients)
-        
-        if cc:
-            msg["Cc"] = ", ".join(cc)
-        if bcc:
-            msg["Bcc"] = ", ".join(bcc)
-
-        # Combine all recipients for sending
-        all_recipients = recipients[:]
-        if cc:
-            all_recipients.extend(cc)
-        if bcc:
-            all_recipients.extend(bcc)
-
+        message = self.build_message(
+            "plain", recipients, subject, body=body,
+            sender_email=sender_email, sender_name=sender_name, cc=cc, bcc=bcc
+        )
         try:
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                if self.smtp_use_tls:
-                    context = ssl.create_default_context()
-                    server.starttls(context=context)
-                if self.smtp_username and self.smtp_password:
-                    server.login(self.smtp_username, self.smtp_password)
-                server.send_message(msg, to_addrs=all_recipients)
-            logger.info(f"Plain text email sent successfully to {recipients}")
-            return "Email sent successfully"
+            report = await self._deliver(message, priority, only_to)
+            logger.info(f"Plain text email sent successfully to {report.accepted}")
+            return report
         except Exception as e:
             logger.error(f"Failed to send plain text email: {e}")
             raise
@@ -71,38 +561,21 @@ class SMTPClient:
         sender_email: Optional[str] = None,
         sender_name: Optional[str] = None,
         cc: Optional[List[str]] = None,
-        bcc: Optional[List[str]] = None
-    ) -> str:
+        bcc: Optional[List[str]] = None,
+        priority: str = "normal",
+        only_to: Optional[List[str]] = None
+    ) -> DeliveryReport:
         """
         Sends an HTML email.
         """
-        msg = MIMEText(html_body, "html", "utf-8")
-        msg["Subject"] = subject
-        msg["From"] = f"{sender_name or self.smtp_from_name} <{sender_email or self.smtp_from_email}>"
-        msg["To"] = ", ".join(recipients)
-        
-        if cc:
-            msg["Cc"] = ", ".join(cc)
-        if bcc:
-            msg["Bcc"] = ", ".join(bcc)
-
-        # Combine all recipients for sending
-        all_recipients = recipients[:]
-        if cc:
-            all_recipients.extend(cc)
-        if bcc:
-            all_recipients.extend(bcc)
-
+        message = self.build_message(
+            "html", recipients, subject, html_body=html_body,
+            sender_email=sender_email, sender_name=sender_name, cc=cc, bcc=bcc
+        )
         try:
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                if self.smtp_use_tls:
-                    context = ssl.create_default_context()
-                    server.starttls(context=context)
-                if self.smtp_username and self.smtp_password:
-                    server.login(self.smtp_username, self.smtp_password)
-                server.send_message(msg, to_addrs=all_recipients)
-            logger.info(f"HTML email sent successfully to {all_recipients}")
-            return "HTML email sent successfully"
+            report = await self._deliver(message, priority, only_to)
+            logger.info(f"HTML email sent successfully to {report.accepted}")
+            return report
         except Exception as e:
             logger.error(f"Failed to send HTML email: {e}")
             raise
@@ -116,77 +589,166 @@ class SMTPClient:
         sender_email: Optional[str] = None,
         sender_name: Optional[str] = None,
         cc: Optional[List[str]] = None,
-        bcc: Optional[List[str]] = None
-    ) -> str:
+        bcc: Optional[List[str]] = None,
+        priority: str = "normal",
+        only_to: Optional[List[str]] = None
+    ) -> DeliveryReport:
         """
         Sends a multipart email with both plain text and HTML versions.
         """
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = subject
-        msg["From"] = f"{sender_name or self.smtp_from_name} <{sender_email or self.smtp_from_email}>"
-        msg["To"] = ", ".join(recipients)
-        
-        if cc:
-            msg["Cc"] = ", ".join(cc)
-        if bcc:
-            msg["Bcc"] = ", ".join(bcc)
-
-        # Create the plain text and HTML parts
-        text_part = MIMEText(text_body, "plain", "utf-8")
-        html_part = MIMEText(html_body, "html", "utf-8")
-
-        # Add parts to message (order matters: plain text first, then HTML)
-        msg.attach(text_part)
-        msg.attach(html_part)
-
-        # Combine all recipients for sending
-        all_recipients = recipients[:]
-        if cc:
-            all_recipients.extend(cc)
-        if bcc:
-            all_recipients.extend(bcc)
-
+        message = self.build_message(
+            "multipart", recipients, subject, body=text_body, html_body=html_body,
+            sender_email=sender_email, sender_name=sender_name, cc=cc, bcc=bcc
+        )
         try:
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                if self.smtp_use_tls:
-                    context = ssl.create_default_context()
-                    server.starttls(context=context)
-                if self.smtp_username and self.smtp_password:
-                    server.login(self.smtp_username, self.smtp_password)
-                server.send_message(msg, to_addrs=all_recipients)
-            logger.info(f"Multipart email sent successfully to {all_recipients}")
-            return "Multipart email sent successfully"
+            report = await self._deliver(message, priority, only_to)
+            logger.info(f"Multipart email sent successfully to {report.accepted}")
+            return report
         except Exception as e:
             logger.error(f"Failed to send multipart email: {e}")
             raise
 
-    # TODO: Add send_html_email, send_email_with_attachments, etc.
+    def _send_batch_blocking(self, messages: List[dict]) -> List[DeliveryReport]:
+        """
+        Deliver many messages as consecutive MAIL FROM/RCPT TO/DATA
+        transactions over one pooled session. Runs in the executor.
+
+        Args:
+            messages: build_message() keyword arguments, one dict per email
+
+        Returns:
+            list: one DeliveryReport per message
+        """
+        reports: List[DeliveryReport] = []
+        relay = conn = None
+
+        def give_back(discard: bool = False) -> None:
+            relay.pool.release(conn, discard=discard)
+            self.router.release(relay)
+
+        try:
+            for fields in messages:
+                report = DeliveryReport()
+                reports.append(report)
+                try:
+                    message = self.build_message(**fields)
+                except Exception as e:
+                    report.reject_envelope(list(fields["recipients"]), e)
+                    continue
+
+                for envelope in plan_envelopes(message.to_addrs, self.max_rcpt):
+                    sent_on = None
+                    error = None
+                    try:
+                        if conn is None:
+                            relay, conn = self._checkout()
+                        sent_on = relay
+                        start = perf_counter()
+                        refused = self._sendmail(conn.server, message, envelope)
+                        conn.messages_sent += 1
+                        report.add_envelope(envelope, refused)
+                    except RECOVERABLE_SMTP_ERRORS as e:
+                        error = e
+                        report.reject_envelope(envelope, e)
+                        if conn is None:
+                            continue
+                        try:
+                            conn.server.rset()
+                        except Exception:
+                            give_back(discard=True)
+                            conn = None
+                    except Exception as e:
+                        error = e
+                        report.reject_envelope(envelope, e)
+                        if conn is not None:
+                            give_back(discard=True)
+                            conn = None
+                    else:
+                        if conn.messages_sent >= relay.pool.max_messages:
+                            give_back()
+                            conn = None
+                    finally:
+                        if sent_on is not None:
+                            self.router.record(sent_on, perf_counter() - start, error)
+        finally:
+            if conn is not None:
+                give_back()
+        return reports
+
+    async def send_batch(self, messages: List[dict], priority: str = "normal") -> List[DeliveryReport]:
+        """
+        Deliver a chunk of messages over a single SMTP session without
+        blocking the event loop
+        """
+        async with self.scheduler.slot(priority):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._send_batch_blocking, messages)
+
+    async def send_email_with_attachments(
+        self,
+        email_type: str,
+        recipients: List[str],
+        subject: str,
+        attachments: List[FileAttachment],
+        body: Optional[str] = None,
+        html_body: Optional[str] = None,
+        sender_email: Optional[str] = None,
+        sender_name: Optional[str] = None,
+        cc: Optional[List[str]] = None,
+        bcc: Optional[List[str]] = None,
+        inline: Optional[List[FileAttachment]] = None,
+        priority: str = "normal",
+        only_to: Optional[List[str]] = None
+    ) -> DeliveryReport:
+        """
+        Sends a plain, html or multipart email with file attachments.
+        Attachments are streamed from disk while the message is sent.
+        Inline parts (e.g. images referenced by cid: from html_body) are
+        sent alongside the body.
+        """
+        message = self.build_message(
+            email_type, recipients, subject, body=body, html_body=html_body,
+            sender_email=sender_email, sender_name=sender_name, cc=cc, bcc=bcc,
+            attachments=attachments, inline=inline
+        )
+        try:
+            report = await self._deliver(message, priority, only_to)
+            logger.info(f"Email with {len(attachments)} attachments sent successfully to {report.accepted}")
+            return report
+        except Exception as e:
+            logger.error(f"Failed to send email with attachments: {e}")
+            raise
     
-    def test_connection(self) -> dict:
+    def test_connection(self, relay: Optional[Relay] = None) -> dict:
         """
-        Test SMTP connection
+        Test SMTP connection to one relay, or to every relay when there
+        are several and none is given
         
         Returns:
             dict: Connection test result
         """
+        if relay is None and len(self.relays) > 1:
+            results = [self.test_connection(relay) for relay in self.relays]
+            success = all(result["success"] for result in results)
+            return {
+                "success": success,
+                "message": "SMTP connections successful" if success else "SMTP connection failed for some relays",
+                "relays": results
+            }
+        relay = relay or self.relays[0]
         try:
-            with smtplib.SMTP(self.host, self.port) as server:
-                if self.use_tls:
-                    server.starttls()
-                
-                if self.username and self.password:
-                    server.login(self.username, self.password)
-                
+            with self._open_connection(relay.host, relay.port):
                 return {
                     "success": True,
                     "message": "SMTP connection successful",
-                    "host": self.host,
-                    "port": self.port
+                    "host": relay.host,
+                    "port": relay.port
                 }
         except Exception as e:
             return {
                 "success": False,
+                "message": "SMTP connection failed",
                 "error": str(e),
-                "host": self.host,
-                "port": self.port
+                "host": relay.host,
+                "port": relay.port
             }
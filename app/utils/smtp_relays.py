@@ -0,0 +1,179 @@
+"""
+Relay selection and circuit breaking for SMTP delivery
+"""
+import logging
+import smtplib
+import threading
+import time
+from typing import Callable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+ROUTING_STRATEGIES = ("least_outstanding", "weighted_round_robin")
+
+# Circuit breaker states
+CLOSED = "closed"        # in rotation
+OPEN = "open"            # ejected, waiting for the cooldown
+PROBING = "probing"      # ejected, test_connection in progress
+
+
+class NoRelayAvailableError(ConnectionError):
+    """Every SMTP relay is ejected by its circuit breaker"""
+
+
+def is_relay_failure(error: BaseException) -> bool:
+    """
+    Errors that say the relay itself is unwell (unreachable, dropping
+    sessions, 421 "service not available"), as opposed to refusing a
+    particular message or recipient.
+    """
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code == 421 or isinstance(error, (smtplib.SMTPConnectError, smtplib.SMTPHeloError))
+    return isinstance(error, (smtplib.SMTPServerDisconnected, OSError))
+
+
+class Relay:
+    """One SMTP relay: its connection pool, load and circuit breaker state"""
+
+    def __init__(self, host: str, port: int, weight: int, pool):
+        self.host = host
+        self.port = port
+        self.name = f"{host}:{port}"
+        self.weight = max(weight, 1)
+        self.pool = pool  # SMTPConnectionPool
+        self.outstanding = 0      # sends (or batch sessions) currently using the relay
+        self.current_weight = 0   # smooth weighted round-robin state
+        self.state = CLOSED
+        self.failures = 0         # consecutive failed (or slow to fail) sends
+        self.opened_at = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "relay": self.name,
+            "weight": self.weight,
+            "state": self.state,
+            "outstanding": self.outstanding,
+            "consecutive_failures": self.failures,
+            "pool": self.pool.stats()
+        }
+
+
+class RelayRouter:
+    """
+    Spreads sends over the relays and ejects unhealthy ones. Thread-safe:
+    relays are picked from the SMTP executor threads.
+
+    Routing is either least_outstanding (the relay with the fewest sends in
+    progress relative to its weight) or weighted_round_robin (smooth WRR,
+    so a 3:1 split interleaves instead of sending bursts of three).
+
+    After breaker_failures consecutive sends that failed at the relay level,
+    or failed only after taking longer than slow_seconds, a relay is
+    ejected. A send that succeeds resets the count however long it took,
+    since large messages are slow to upload to a healthy relay too. Once cooldown has
+    passed, the next pick hands it to probe() (a test_connection run off the
+    caller's thread); a successful probe puts it back in rotation, a failed
+    one restarts the cooldown.
+    """
+
+    def __init__(
+        self,
+        relays: List[Relay],
+        strategy: str,
+        breaker_failures: int,
+        slow_seconds: float,
+        cooldown: float,
+        probe: Callable[[Relay], None]
+    ):
+        if strategy not in ROUTING_STRATEGIES:
+            raise ValueError(f"Unknown SMTP routing strategy {strategy!r}, expected one of {ROUTING_STRATEGIES}")
+        self.relays = relays
+        self.strategy = strategy
+        self.breaker_failures = breaker_failures
+        self.slow_seconds = slow_seconds
+        self.cooldown = cooldown
+        self._probe = probe
+        self._lock = threading.Lock()
+        self._next = 0  # rotates the starting point so ties are spread
+
+    def _pick(self, candidates: List[Relay]) -> Relay:
+        if self.strategy == "weighted_round_robin":
+            total = 0
+            best = None
+            for relay in candidates:
+                relay.current_weight += relay.weight
+                total += relay.weight
+                if best is None or relay.current_weight > best.current_weight:
+                    best = relay
+            best.current_weight -= total
+            return best
+        self._next = (self._next + 1) % len(candidates)
+        rotated = candidates[self._next:] + candidates[:self._next]
+        return min(rotated, key=lambda relay: relay.outstanding / relay.weight)
+
+    def acquire(self, exclude: Sequence[Relay] = ()) -> Relay:
+        """
+        Pick a relay in rotation and count a send against it; pair with release()
+
+        Raises:
+            NoRelayAvailableError: every relay (outside exclude) is ejected
+        """
+        probes = []
+        with self._lock:
+            now = time.monotonic()
+            for relay in self.relays:
+                if relay.state == OPEN and now - relay.opened_at >= self.cooldown:
+                    relay.state = PROBING
+                    probes.append(relay)
+            candidates = [relay for relay in self.relays if relay.state == CLOSED and relay not in exclude]
+            if candidates:
+                relay = self._pick(candidates)
+                relay.outstanding += 1
+        for probing in probes:
+            self._probe(probing)
+        if not candidates:
+            raise NoRelayAvailableError("No SMTP relay available, all are ejected after failures")
+        return relay
+
+    def release(self, relay: Relay) -> None:
+        with self._lock:
+            relay.outstanding -= 1
+
+    def record(self, relay: Relay, duration: float, error: Optional[BaseException] = None) -> None:
+        """
+        Feed the outcome of one send to the relay's circuit breaker
+        """
+        failed = error is not None and (
+            is_relay_failure(error) or 0 < self.slow_seconds < duration
+        )
+        with self._lock:
+            if not failed:
+                relay.failures = 0
+                return
+            relay.failures += 1
+            if relay.state != CLOSED or relay.failures < self.breaker_failures:
+                return
+            relay.state = OPEN
+            relay.opened_at = time.monotonic()
+        reason = error if is_relay_failure(error) else f"{error} after more than {self.slow_seconds}s"
+        logger.warning(f"Ejecting SMTP relay {relay.name} after {relay.failures} failures: {reason}")
+
+    def probed(self, relay: Relay, healthy: bool) -> None:
+        """
+        Result of a probe started by acquire()
+        """
+        with self._lock:
+            if healthy:
+                relay.state = CLOSED
+                relay.failures = 0
+            else:
+                relay.state = OPEN
+                relay.opened_at = time.monotonic()
+        if healthy:
+            logger.info(f"SMTP relay {relay.name} passed its probe, back in rotation")
+        else:
+            logger.warning(f"SMTP relay {relay.name} failed its probe, still ejected")
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [relay.stats() for relay in self.relays]
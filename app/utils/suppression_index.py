@@ -0,0 +1,145 @@
+"""
+Compact in-memory indexes of suppressed addresses
+"""
+import hashlib
+import heapq
+import math
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Set
+
+SUPPRESSION_REASONS = ("hard_bounce", "unsubscribe", "complaint", "manual")
+
+
+def normalize_suppressed(address: str) -> str:
+    """
+    Suppression entries match addresses case-insensitively
+    """
+    return address.strip().lower()
+
+
+def address_hash(address: str) -> int:
+    """
+    Signed 64-bit BLAKE2b hash of a normalized address, as stored in
+    suppressions.address_hash; two addresses share one with negligible
+    probability (about n / 2^64 per lookup)
+    """
+    return int.from_bytes(hashlib.blake2b(address.encode(), digest_size=8).digest(), "big", signed=True)
+
+
+class HashedAddressSet:
+    """
+    Set of 64-bit address hashes in 8 bytes per entry: a sorted array
+    searched by bisection, plus small sets of entries added and removed
+    since the array was last rebuilt. Python sets of ints take about 60
+    bytes per entry, which adds up with millions of suppressed addresses.
+
+    Not thread-safe: used from the event loop only (a new instance may be
+    built in a worker thread and swapped in).
+    """
+
+    def __init__(self, sorted_hashes: Iterable[int] = ()):
+        self._base = array("q", sorted_hashes)  # ascending
+        self._added: Set[int] = set()
+        self._removed: Set[int] = set()
+        self._size = len(self._base)
+
+    def _in_base(self, key: int) -> bool:
+        index = bisect_left(self._base, key)
+        return index < len(self._base) and self._base[index] == key
+
+    def __contains__(self, key: int) -> bool:
+        if key in self._added:
+            return True
+        return key not in self._removed and self._in_base(key)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, key: int) -> None:
+        if key in self:
+            return
+        if key in self._removed:
+            self._removed.discard(key)
+        else:
+            self._added.add(key)
+        self._size += 1
+        self._maybe_compact()
+
+    def discard(self, key: int) -> None:
+        if key in self._added:
+            self._added.discard(key)
+        elif key in self._removed or not self._in_base(key):
+            return
+        else:
+            self._removed.add(key)
+        self._size -= 1
+        self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        # Keep the sets small next to the array, so memory stays near 8 bytes per entry
+        if len(self._added) + len(self._removed) > max(4096, len(self._base) // 16):
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Merge pending additions and removals into the sorted array
+        """
+        removed = self._removed
+        kept = (key for key in self._base if key not in removed) if removed else self._base
+        self._base = array("q", heapq.merge(kept, sorted(self._added)))
+        self._added = set()
+        self._removed = set()
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory use"""
+        return self._base.itemsize * len(self._base) + 64 * (len(self._added) + len(self._removed))
+
+
+class BloomFilter:
+    """
+    Bloom filter over 64-bit address hashes: about 1.2 bytes per entry at a
+    1% false positive rate (1.8 bytes at 0.1%). Entries can't be removed,
+    so a hit only means "possibly suppressed" and must be confirmed.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.capacity = capacity
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    # Double hashing: k positions h1 + i * h2 from the two halves of the 64-bit hash
+
+    def add(self, key: int) -> None:
+        bits, size = self._bits, self.size
+        position, step = key & 0xFFFFFFFF, ((key >> 32) & 0xFFFFFFFF) | 1
+        new = False
+        for _ in range(self.hashes):
+            position %= size
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                new = True
+            position += step
+        self.count += new  # Entries added again (or colliding completely) aren't counted twice
+
+    def __contains__(self, key: int) -> bool:
+        bits, size = self._bits, self.size
+        position, step = key & 0xFFFFFFFF, ((key >> 32) & 0xFFFFFFFF) | 1
+        for _ in range(self.hashes):
+            position %= size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+            position += step
+        return True
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
@@ -0,0 +1,166 @@
+"""
+Compiled {{ variable }} templates for server-side email rendering
+"""
+import html
+import re
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+# {{ name }}, {{ user.first_name }}, {{ link | safe }}
+_PLACEHOLDER = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*)\s*(\|\s*safe\s*)?\}\}")
+_ANY_TAG = re.compile(r"\{\{.*?\}\}|\{\{", re.DOTALL)
+
+
+class TemplateError(ValueError):
+    """A template can't be compiled or rendered"""
+
+
+class TemplateSyntaxError(TemplateError):
+    """Malformed placeholder in a template"""
+
+
+class MissingVariableError(TemplateError):
+    """A template references variables that were not provided"""
+
+
+Renderer = Callable[[Mapping[str, Any]], str]
+
+
+def _lookup(variables: Mapping[str, Any], path: Tuple[str, ...]) -> Any:
+    value: Any = variables
+    for key in path:
+        value = value[key]
+    return value
+
+
+def compile_template(
+    source: str,
+    escape: Optional[Callable[[str], str]] = None,
+    safe: Optional[Callable[[str], str]] = None
+) -> Tuple[Renderer, List[str]]:
+    """
+    Compiles a template into a render function.
+
+    Literal text is turned into one str.format() pattern, so rendering only
+    looks up the variables and formats them in a single C-level call.
+    Values pass through escape (e.g. html.escape), or through safe when the
+    placeholder is marked "| safe".
+
+    Returns:
+        (render(variables) -> str, variable names used by the template)
+
+    Raises:
+        TemplateSyntaxError: a {{ ... }} tag is not a valid placeholder
+    """
+    pattern: List[str] = []
+    slots: List[Tuple[Tuple[str, ...], Optional[Callable[[str], str]]]] = []
+    position = 0
+    for match in _ANY_TAG.finditer(source):
+        placeholder = _PLACEHOLDER.fullmatch(match.group(0))
+        if placeholder is None:
+            raise TemplateSyntaxError(f"Invalid placeholder {match.group(0)[:40]!r} at offset {match.start()}")
+        literal = source[position:match.start()]
+        pattern.append(literal.replace("{", "{{").replace("}", "}}"))
+        pattern.append(f"{{{len(slots)}}}")
+        transform = safe if placeholder.group(2) else escape
+        slots.append((tuple(placeholder.group(1).split(".")), transform))
+        position = match.end()
+    literal = source[position:]
+    pattern.append(literal.replace("{", "{{").replace("}", "}}"))
+
+    names = list(dict.fromkeys(".".join(path) for path, _ in slots))
+    if not slots:
+        return (lambda variables: source), names
+
+    fmt = "".join(pattern).format
+
+    def render(variables: Mapping[str, Any]) -> str:
+        values = []
+        missing = None
+        for path, transform in slots:
+            try:
+                value = _lookup(variables, path)
+            except (KeyError, TypeError, IndexError):
+                missing = missing or []
+                missing.append(".".join(path))
+                continue
+            value = "" if value is None else str(value)
+            values.append(transform(value) if transform else value)
+        if missing:
+            raise MissingVariableError(f"Missing template variables: {', '.join(dict.fromkeys(missing))}")
+        return fmt(*values)
+
+    return render, names
+
+
+class CompiledTemplate(NamedTuple):
+    """Render functions for the subject and bodies of one template version"""
+
+    template_id: str
+    version: int
+    email_type: str
+    subject: Renderer
+    body: Optional[Renderer]
+    html_body: Optional[Renderer]
+    variables: List[str]
+
+    def render(self, variables: Mapping[str, Any]) -> Dict[str, Optional[str]]:
+        """
+        Renders subject, body and html_body for one set of variables
+
+        Raises:
+            MissingVariableError: a referenced variable is not in variables
+        """
+        try:
+            return {
+                "subject": self.subject(variables),
+                "body": self.body(variables) if self.body else None,
+                "html_body": self.html_body(variables) if self.html_body else None,
+            }
+        except MissingVariableError:
+            # Report every missing variable, not just those of the first part that failed
+            missing = []
+            for name in self.variables:
+                try:
+                    _lookup(variables, tuple(name.split(".")))
+                except (KeyError, TypeError, IndexError):
+                    missing.append(name)
+            raise MissingVariableError(f"Missing template variables: {', '.join(missing)}") from None
+
+
+def compile_email_template(
+    template_id: str,
+    version: int,
+    email_type: str,
+    subject: str,
+    body: Optional[str],
+    html_body: Optional[str],
+    sanitize: Optional[Callable[[str], str]] = None,
+    to_text: Optional[Callable[[str], str]] = None
+) -> CompiledTemplate:
+    """
+    Compiles the parts of an email template; variables in html_body are
+    HTML-escaped.
+
+    With sanitize, html_body is sanitized once here (and "| safe" values
+    when rendered). With to_text, a multipart template without body gets
+    one derived from html_body, placeholders included.
+
+    Raises:
+        TemplateSyntaxError: a part contains a malformed placeholder
+    """
+    if html_body is not None and sanitize:
+        html_body = sanitize(html_body)
+    parts = [(subject, None, None), (body, None, None), (html_body, html.escape, sanitize)]
+    if email_type == "multipart" and body is None and html_body is not None and to_text:
+        # "| safe" values hold markup, which the derived text part converts too
+        parts[1] = (to_text(html_body), None, lambda value: to_text(value).strip())
+    names: List[str] = []
+    renderers = []
+    for source, escape, safe in parts:
+        if source is None:
+            renderers.append(None)
+            continue
+        render, used = compile_template(source, escape, safe)
+        renderers.append(render)
+        names.extend(used)
+    return CompiledTemplate(template_id, version, email_type, *renderers, list(dict.fromkeys(names)))
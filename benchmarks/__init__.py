@@ -0,0 +1,3 @@
+"""
+NotifyHubLite benchmarks
+"""
@@ -0,0 +1,127 @@
+"""
+In-process fake SMTP sink for benchmarks
+
+Speaks just enough SMTP (EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP, QUIT) for
+smtplib to deliver messages. It can add a fixed per-command latency to mimic
+a remote relay, refuse recipients of given domains, and inject failures: a
+share of transactions answered with a transient 451 after DATA, and a share
+of connections dropped at MAIL FROM. Runs its own event loop on a background
+thread so that even blocking clients in the benchmarking process can talk
+to it.
+"""
+import asyncio
+import random
+import threading
+from typing import Iterable, Optional
+
+
+class FakeSMTPServer:
+    """Minimal asyncio SMTP server that accepts and discards mail"""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        reject_domains: Iterable[str] = (),
+        failure_rate: float = 0.0,
+        disconnect_rate: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.reject_domains = {domain.lower() for domain in reject_domains}
+        self.failure_rate = failure_rate
+        self.disconnect_rate = disconnect_rate
+        self._random = random.Random(seed)
+        self.messages = 0
+        self.connections = 0
+        self.max_rcpt_seen = 0
+        self.failures = 0
+        self.disconnects = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+
+    async def _reply(self, writer: asyncio.StreamWriter, line: str) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        writer.write(line.encode() + b"\r\n")
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            await self._reply(writer, "220 fake-smtp ESMTP ready")
+            rcpt = 0
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                verb = line[:4].upper()
+                if verb == b"RCPT":
+                    address = line.decode(errors="replace").strip().rstrip(">")
+                    if address.rpartition("@")[2].lower() in self.reject_domains:
+                        await self._reply(writer, "550 5.1.1 Recipient rejected")
+                        continue
+                    rcpt += 1
+                    self.max_rcpt_seen = max(self.max_rcpt_seen, rcpt)
+                    await self._reply(writer, "250 OK")
+                elif verb == b"MAIL" and self.disconnect_rate and self._random.random() < self.disconnect_rate:
+                    self.disconnects += 1
+                    break
+                elif verb in (b"MAIL", b"RSET"):
+                    rcpt = 0
+                    await self._reply(writer, "250 OK")
+                elif verb == b"EHLO":
+                    writer.write(b"250-fake-smtp\r\n250-8BITMIME\r\n")
+                    await self._reply(writer, "250 SIZE 52428800")
+                elif verb == b"DATA":
+                    await self._reply(writer, "354 End data with <CR><LF>.<CR><LF>")
+                    while True:
+                        chunk = await reader.readline()
+                        if not chunk or chunk == b".\r\n":
+                            break
+                    if self.failure_rate and self._random.random() < self.failure_rate:
+                        self.failures += 1
+                        await self._reply(writer, "451 4.3.0 Temporary failure, try again later")
+                        continue
+                    self.messages += 1
+                    await self._reply(writer, "250 OK queued")
+                elif verb == b"QUIT":
+                    await self._reply(writer, "221 Bye")
+                    break
+                else:
+                    await self._reply(writer, "250 OK")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        self._server.close()
+        self._loop.run_until_complete(self._server.wait_closed())
+        self._loop.close()
+
+    def start(self) -> "FakeSMTPServer":
+        """Start serving on a background thread and wait until bound"""
+        self._thread = threading.Thread(target=self._run, name="fake-smtp", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self) -> None:
+        """Stop the server and join its thread"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,309 @@
+"""
+API load test
+
+Drives the FastAPI application (app.main:app) in-process against the fake
+SMTP sink and reports latency percentiles and throughput as JSON. Requests
+go straight through the ASGI interface, so the numbers cover routing,
+validation, MIME building and SMTP delivery without any HTTP client or
+socket overhead on the API side.
+
+Each scenario is either single sends (POST /send, one message per request)
+or batches (POST /send-batch with --batch-sizes messages per request), with
+payloads drawn from the --mix of plain, html and multipart emails.
+
+Usage:
+    python -m benchmarks.load_test --requests 500 --concurrency 50 --latency 0.005
+    python -m benchmarks.load_test --mix plain=2,html=1,multipart=1 --batch-sizes 10,100
+    python -m benchmarks.load_test --failure-rate 0.05 --output results.json
+    python -m benchmarks.load_test --baseline results.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from benchmarks.fake_smtp import FakeSMTPServer
+
+EMAIL_TYPES = ("plain", "html", "multipart")
+TEXT_BODY = "Hello,\n\nThis is a NotifyHubLite load test message.\n\n" + "Lorem ipsum dolor sit amet. " * 20
+HTML_BODY = "<html><body><h1>Load test</h1><p>" + "Lorem <b>ipsum</b> dolor sit amet. " * 20 + "</p></body></html>"
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    """
+    "plain=2,html=1" -> {"plain": 2, "html": 1}
+    """
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in EMAIL_TYPES:
+            raise argparse.ArgumentTypeError(f"unknown email type {name!r}, expected one of {EMAIL_TYPES}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def make_payload(email_type: str, number: int) -> dict:
+    payload = {
+        "recipients": [f"user{number % 1000}@example.com"],
+        "subject": f"Load test {number}",
+        "email_type": email_type,
+        "sender_email": "loadtest@example.com",
+    }
+    if email_type in ("plain", "multipart"):
+        payload["body"] = TEXT_BODY
+    if email_type in ("html", "multipart"):
+        payload["html_body"] = HTML_BODY
+    return payload
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not ordered:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class ASGIDriver:
+    """Calls an ASGI app directly with JSON requests"""
+
+    def __init__(self, app, api_key: str):
+        self.app = app
+        self.headers = [
+            (b"authorization", f"Bearer {api_key}".encode()),
+            (b"content-type", b"application/json"),
+        ]
+
+    async def post(self, path: str, payload: dict) -> Tuple[int, bytes]:
+        body = json.dumps(payload).encode()
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0", "spec_version": "2.3"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": b"",
+            "headers": self.headers + [(b"content-length", str(len(body)).encode())],
+            "client": ("127.0.0.1", 0),
+            "server": ("loadtest", 80),
+        }
+        sent = False
+        status = 0
+        chunks = []
+        finished = asyncio.Event()
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    finished.set()
+
+        await self.app(scope, receive, send)
+        finished.set()
+        return status, b"".join(chunks)
+
+
+async def run_scenario(
+    driver: ASGIDriver,
+    sink: FakeSMTPServer,
+    mix: Dict[str, int],
+    requests: int,
+    concurrency: int,
+    batch_size: int,
+    seed: int
+) -> dict:
+    """
+    batch_size 0 sends one message per /send request, otherwise batch_size
+    messages per /send-batch request
+    """
+    rng = random.Random(seed)
+    types, weights = list(mix), list(mix.values())
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    counter = 0
+
+    def next_payload() -> dict:
+        nonlocal counter
+        counter += 1
+        return make_payload(rng.choices(types, weights)[0], counter)
+
+    def count(status: str, amount: int = 1) -> None:
+        statuses[status] = statuses.get(status, 0) + amount
+
+    async def one() -> None:
+        if batch_size:
+            path, payload = "/api/v1/emails/send-batch", {"messages": [next_payload() for _ in range(batch_size)]}
+        else:
+            path, payload = "/api/v1/emails/send", next_payload()
+        async with semaphore:
+            start = time.perf_counter()
+            status, body = await driver.post(path, payload)
+            latencies.append(time.perf_counter() - start)
+        if status != 200:
+            count(f"http_{status}", batch_size or 1)
+        elif batch_size:
+            for line in body.splitlines():
+                count(json.loads(line)["status"])
+        else:
+            count(json.loads(body)["status"])
+
+    delivered = sink.messages
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    messages = requests * (batch_size or 1)
+    return {
+        "endpoint": "send-batch" if batch_size else "send",
+        "batch_size": batch_size or 1,
+        "requests": requests,
+        "messages": messages,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 4),
+        "requests_per_sec": round(requests / elapsed, 1),
+        "messages_per_sec": round(messages / elapsed, 1),
+        "delivered": sink.messages - delivered,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "statuses": statuses,
+    }
+
+
+async def run_all(args: argparse.Namespace, sink: FakeSMTPServer) -> List[dict]:
+    # Settings are read at import, so the app is imported once the sink is up
+    from app.config import settings
+    from app.main import app
+
+    driver = ASGIDriver(app, settings.api_key)
+    results = []
+    async with app.router.lifespan_context(app):
+        for batch_size in args.batch_sizes:
+            # Keep the number of messages per scenario comparable
+            requests = args.requests if not batch_size else max(args.requests // batch_size, 1)
+            results.append(await run_scenario(
+                driver, sink, args.mix, requests, args.concurrency, batch_size, args.seed
+            ))
+    return results
+
+
+def compare(results: List[dict], baseline_path: str, tolerance: float) -> List[str]:
+    """
+    Scenarios whose throughput fell more than tolerance below the baseline
+    """
+    with open(baseline_path) as f:
+        baseline = {(s["endpoint"], s["batch_size"]): s for s in json.load(f)["scenarios"]}
+    regressions = []
+    for scenario in results:
+        previous = baseline.get((scenario["endpoint"], scenario["batch_size"]))
+        if previous is None:
+            continue
+        floor = previous["messages_per_sec"] * (1 - tolerance)
+        if scenario["messages_per_sec"] < floor:
+            regressions.append(
+                f"{scenario['endpoint']} x{scenario['batch_size']}: {scenario['messages_per_sec']} msg/s "
+                f"< {floor:.1f} (baseline {previous['messages_per_sec']})"
+            )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500, help="Messages per scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="Requests in flight")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("plain=1,html=1,multipart=1"),
+                        help="Weighted email types, e.g. plain=2,html=1,multipart=1")
+    parser.add_argument("--batch-sizes", type=lambda v: [int(x) for x in v.split(",")], default=[0, 50],
+                        help="Comma separated; 0 means single /send requests, N means /send-batch with N messages")
+    parser.add_argument("--latency", type=float, default=0.005, help="Fake relay delay per SMTP reply (seconds)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of transactions answered with 451")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="Share of transactions dropped at MAIL FROM")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--baseline", help="Previous JSON report; exit 1 if throughput regressed")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed throughput drop against --baseline")
+    args = parser.parse_args()
+
+    sink = FakeSMTPServer(
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        disconnect_rate=args.disconnect_rate,
+        seed=args.seed
+    ).start()
+    os.environ.update({
+        "NOTIFYHUB_SMTP_HOST": sink.host,
+        "NOTIFYHUB_SMTP_PORT": str(sink.port),
+        "NOTIFYHUB_SMTP_USE_TLS": "false",
+        "NOTIFYHUB_SMTP_USERNAME": "",
+        "NOTIFYHUB_SMTP_PASSWORD": "",
+        "NOTIFYHUB_QUEUE_ENABLED": "false",
+    })
+    # The delivery log is flushed in the background; an in-memory database will do
+    os.environ.setdefault("NOTIFYHUB_DATABASE_URL", "sqlite://")
+
+    try:
+        # Keep the app's startup/shutdown banners out of the JSON on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            scenarios = asyncio.run(run_all(args, sink))
+    finally:
+        sink.stop()
+
+    report = {
+        "config": {
+            "mix": args.mix,
+            "concurrency": args.concurrency,
+            "latency": args.latency,
+            "failure_rate": args.failure_rate,
+            "disconnect_rate": args.disconnect_rate,
+        },
+        "relay": {
+            "connections": sink.connections,
+            "delivered": sink.messages,
+            "injected_failures": sink.failures,
+            "injected_disconnects": sink.disconnects,
+        },
+        "scenarios": scenarios,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    if args.baseline:
+        regressions = compare(scenarios, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+MIME build microbenchmark
+
+Measures messages built per second for a fan-out send (same body, one
+recipient per message), comparing a fresh MIME tree per message with
+MessageBuilder's cached body entity.
+
+Usage:
+    python -m benchmarks.mime_build --messages 20000 --body-kb 20
+"""
+import argparse
+import json
+import time
+from email import policy
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from app.utils.mime_builder import MessageBuilder
+
+
+def legacy_build(recipient: str, text: str, html: str) -> bytes:
+    """The pre-builder behaviour: a new MIME tree per message"""
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = "Monthly report"
+    msg["From"] = "NotifyHub System <noreply@example.com>"
+    msg["To"] = recipient
+    msg.attach(MIMEText(text, "plain", "utf-8"))
+    msg.attach(MIMEText(html, "html", "utf-8"))
+    return msg.as_bytes(policy=policy.SMTP)
+
+
+def measure(build, messages: int) -> dict:
+    start = time.perf_counter()
+    for i in range(messages):
+        build(f"user{i}@example.com")
+    elapsed = time.perf_counter() - start
+    return {
+        "messages": messages,
+        "seconds": round(elapsed, 4),
+        "messages_per_sec": round(messages / elapsed, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--body-kb", type=int, default=20, help="Approximate size of each body part")
+    args = parser.parse_args()
+
+    text = ("Hello, your monthly report is ready. " * 30 + "\n") * max(1, args.body_kb)
+    html = f"<html><body><p>{text}</p></body></html>"
+    builder = MessageBuilder(cache_max_bytes=64 * 1024 * 1024)
+
+    def cached_build(recipient: str) -> bytes:
+        return builder.build(
+            "multipart", [recipient], "Monthly report",
+            sender_name="NotifyHub System", sender_email="noreply@example.com",
+            body=text, html_body=html
+        ).data
+
+    results = {
+        "body_bytes": len(text.encode()) + len(html.encode()),
+        "before_fresh_mime": measure(lambda r: legacy_build(r, text, html), args.messages),
+        "after_cached_body": measure(cached_build, args.messages),
+        "cache": builder.stats(),
+    }
+    results["speedup"] = round(
+        results["after_cached_body"]["messages_per_sec"] / results["before_fresh_mime"]["messages_per_sec"], 2
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
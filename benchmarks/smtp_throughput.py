@@ -0,0 +1,140 @@
+"""
+SMTP delivery throughput benchmark
+
+Posts the same plain text emails concurrently to POST /api/v1/emails/send of
+the in-process application (app.main:app) against the fake SMTP sink, once
+with the legacy delivery pattern (a blocking smtplib session opened inside
+the coroutine, on the event loop) and once through SMTPClient's
+non-blocking engine. Requests go through the ASGI interface, so the
+numbers include routing, validation and MIME building, and what each
+pattern does to everything else sharing the event loop: a monitor task
+measures how late its 1 ms sleeps wake up (loop lag) while the emails are
+sent.
+
+Usage:
+    python -m benchmarks.smtp_throughput --messages 200 --concurrency 50 --latency 0.005
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import smtplib
+import sys
+import time
+from typing import List
+
+from benchmarks.fake_smtp import FakeSMTPServer
+from benchmarks.load_test import ASGIDriver, percentile
+
+LAG_INTERVAL = 0.001
+
+
+def ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+async def monitor_loop_lag(lags: List[float]) -> None:
+    """Record how much later than asked each short sleep wakes up"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(max(time.perf_counter() - start - LAG_INTERVAL, 0.0))
+
+
+async def run(driver: ASGIDriver, sink: FakeSMTPServer, messages: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    lags: List[float] = []
+    statuses = {}
+
+    async def one(number: int) -> None:
+        payload = {
+            "recipients": [f"bench{number}@example.com"],
+            "subject": "benchmark",
+            "body": "benchmark body",
+            "sender_email": "noreply@example.com",
+        }
+        async with semaphore:
+            start = time.perf_counter()
+            status, body = await driver.post("/api/v1/emails/send", payload)
+            latencies.append(time.perf_counter() - start)
+        outcome = json.loads(body)["status"] if status == 200 else f"http_{status}"
+        statuses[outcome] = statuses.get(outcome, 0) + 1
+
+    connections = sink.connections
+    monitor = asyncio.create_task(monitor_loop_lag(lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(one(number) for number in range(messages)))
+    elapsed = time.perf_counter() - start
+    monitor.cancel()
+    await asyncio.gather(monitor, return_exceptions=True)
+
+    latencies.sort()
+    lags.sort()
+    return {
+        "messages": messages,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 4),
+        "messages_per_sec": round(messages / elapsed, 1),
+        "latency_ms": {"p50": ms(percentile(latencies, 50)), "p99": ms(percentile(latencies, 99))},
+        "loop_lag_ms": {"p99": ms(percentile(lags, 99)), "max": ms(lags[-1]) if lags else 0.0},
+        "relay_connections": sink.connections - connections,
+        "statuses": statuses,
+    }
+
+
+async def run_all(args: argparse.Namespace, sink: FakeSMTPServer) -> dict:
+    # Settings are read at import, so the app is imported once the sink is up
+    from app.config import settings
+    from app.main import app
+
+    driver = ASGIDriver(app, settings.api_key)
+    async with app.router.lifespan_context(app):
+        client = app.state.email_service.smtp_client
+        engine_send_envelope = client._send_envelope
+
+        async def blocking_send_envelope(message, envelope, priority):
+            """The pre-engine behaviour: a blocking smtplib session on the event loop"""
+            with smtplib.SMTP(sink.host, sink.port) as server:
+                return client._sendmail(server, message, envelope)
+
+        client._send_envelope = blocking_send_envelope
+        before = await run(driver, sink, args.messages, args.concurrency)
+        client._send_envelope = engine_send_envelope
+        after = await run(driver, sink, args.messages, args.concurrency)
+    return {"before_blocking": before, "after_engine": after}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.005, help="Fake relay delay per SMTP reply (seconds)")
+    args = parser.parse_args()
+
+    sink = FakeSMTPServer(latency=args.latency).start()
+    os.environ.update({
+        "NOTIFYHUB_SMTP_HOST": sink.host,
+        "NOTIFYHUB_SMTP_PORT": str(sink.port),
+        "NOTIFYHUB_SMTP_USE_TLS": "false",
+        "NOTIFYHUB_SMTP_USERNAME": "",
+        "NOTIFYHUB_SMTP_PASSWORD": "",
+        "NOTIFYHUB_QUEUE_ENABLED": "false",
+    })
+
+    try:
+        # Keep the app's startup/shutdown banners out of the JSON on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            results = {"latency": args.latency, **asyncio.run(run_all(args, sink))}
+    finally:
+        sink.stop()
+
+    results["speedup"] = round(
+        results["after_engine"]["messages_per_sec"] / results["before_blocking"]["messages_per_sec"], 2
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
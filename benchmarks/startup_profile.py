@@ -0,0 +1,172 @@
+"""
+Startup profile
+
+Starts a fresh interpreter that imports the application (app.main:app) with
+-X importtime and runs its lifespan startup, then reports as JSON:
+
+- import: wall-clock time to import app.main, the cumulative import time of
+  every app.* module (including the third-party modules it pulled in first)
+  and the self time of all third-party packages, summed per package
+- startup: time spent in each lifespan step (app.state.startup_timings)
+- database_loaded: whether import or startup loaded SQLAlchemy; with the
+  default settings (no database-backed feature on) it should not
+
+It runs with the environment it is given, so by default it profiles the
+default configuration.
+
+Each run is a cold start of a new process; the run with the median total is
+reported. Budgets make it usable as a CI check: exit 1 if import plus
+startup exceeds --budget-ms, or if a module got more than --tolerance
+slower than in a --baseline report (ignoring changes under --min-ms).
+
+Usage:
+    python -m benchmarks.startup_profile
+    python -m benchmarks.startup_profile --runs 5 --output startup.json
+    python -m benchmarks.startup_profile --budget-ms 1000 --baseline startup.json --tolerance 0.5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+REPORT_PREFIX = "STARTUP_PROFILE "
+
+# Runs in the child: import the app, run lifespan startup and shutdown
+CHILD = f"""
+import asyncio, json, sys, time
+start = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+
+async def run():
+    async with app.router.lifespan_context(app):
+        report = {{
+            "import_seconds": imported - start,
+            "startup_seconds": time.perf_counter() - imported,
+            "startup_timings": app.state.startup_timings,
+            "database_loaded": "sqlalchemy" in sys.modules,
+        }}
+    sys.__stdout__.write({REPORT_PREFIX!r} + json.dumps(report) + "\\n")
+
+asyncio.run(run())
+"""
+
+
+def ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+def parse_importtime(stderr: str) -> Dict[str, Dict[str, float]]:
+    """
+    -X importtime lines ("import time: self [us] | cumulative | name") into
+    cumulative ms per app.* module and self ms per third-party package
+    """
+    modules: Dict[str, float] = {}
+    packages: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # the header line
+        self_us, cumulative_us, name = int(fields[0]), int(fields[1]), fields[2].strip()
+        if name == "app" or name.startswith("app."):
+            modules[name] = round(cumulative_us / 1000, 2)
+        else:
+            package = name.split(".")[0]
+            packages[package] = packages.get(package, 0.0) + self_us / 1000
+    return {
+        "modules": dict(sorted(modules.items(), key=lambda item: -item[1])),
+        "packages": {name: round(value, 2) for name, value in sorted(packages.items(), key=lambda item: -item[1])},
+    }
+
+
+def profile_once() -> dict:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD],
+        capture_output=True, text=True, env=os.environ.copy()
+    )
+    report = None
+    for line in result.stdout.splitlines():
+        if line.startswith(REPORT_PREFIX):
+            report = json.loads(line[len(REPORT_PREFIX):])
+    if result.returncode != 0 or report is None:
+        sys.stderr.write(result.stderr[-4000:])
+        raise SystemExit(f"Application startup failed (exit code {result.returncode})")
+    imports = parse_importtime(result.stderr)
+    return {
+        "total_ms": ms(report["import_seconds"] + report["startup_seconds"]),
+        "database_loaded": report["database_loaded"],
+        "import": {"total_ms": ms(report["import_seconds"]), **imports},
+        "startup": {
+            "total_ms": ms(report["startup_seconds"]),
+            "steps": {step: ms(seconds) for step, seconds in report["startup_timings"].items()},
+        },
+    }
+
+
+def compare(report: dict, baseline_path: str, tolerance: float, min_ms: float) -> List[str]:
+    """
+    Modules and startup steps that got more than tolerance (and min_ms) slower than the baseline
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    pairs = [
+        ("total", report["total_ms"], baseline["total_ms"]),
+        *((f"import {name}", value, baseline["import"]["modules"].get(name))
+          for name, value in report["import"]["modules"].items()),
+        *((f"startup {step}", value, baseline["startup"]["steps"].get(step))
+          for step, value in report["startup"]["steps"].items()),
+    ]
+    regressions = []
+    for name, value, previous in pairs:
+        if previous is None:
+            continue
+        ceiling = max(previous * (1 + tolerance), previous + min_ms)
+        if value > ceiling:
+            regressions.append(f"{name}: {value} ms > {ceiling:.1f} ms (baseline {previous} ms)")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="Cold starts to measure; the median one is reported")
+    parser.add_argument("--top", type=int, default=15, help="Third-party packages to list")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--budget-ms", type=float, help="Exit 1 if import plus startup takes longer")
+    parser.add_argument("--baseline", help="Previous JSON report; exit 1 if a module or step regressed")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown against --baseline")
+    parser.add_argument("--min-ms", type=float, default=5.0, help="Ignore slowdowns smaller than this against --baseline")
+    args = parser.parse_args()
+
+    runs = sorted((profile_once() for _ in range(max(args.runs, 1))), key=lambda run: run["total_ms"])
+    report = runs[len(runs) // 2]
+    report["import"]["packages"] = dict(list(report["import"]["packages"].items())[:args.top])
+    report["runs_total_ms"] = {
+        "min": runs[0]["total_ms"],
+        "median": statistics.median(run["total_ms"] for run in runs),
+        "max": runs[-1]["total_ms"],
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    failures = []
+    if args.budget_ms is not None and report["total_ms"] > args.budget_ms:
+        failures.append(f"total: {report['total_ms']} ms > budget {args.budget_ms} ms")
+    if args.baseline:
+        failures += compare(report, args.baseline, args.tolerance, args.min_ms)
+    for line in failures:
+        print(f"REGRESSION {line}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Suppression index microbenchmark
+
+Builds the in-memory suppression indexes for --entries addresses and
+measures the cost per recipient of checking a --recipients batch (about
+--hit-rate of them suppressed) the way SuppressionService.check() does:
+normalize, hash, look up. A plain Python set of the address strings is
+included for comparison of speed and memory.
+
+Usage:
+    python -m benchmarks.suppression --entries 1000000 --recipients 10000
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from app.utils.suppression_index import BloomFilter, HashedAddressSet, address_hash, normalize_suppressed
+
+
+def per_address_us(contains, recipients) -> float:
+    start = time.perf_counter()
+    hits = 0
+    for address in recipients:
+        hits += contains(address)
+    return round((time.perf_counter() - start) / len(recipients) * 1e6, 3)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=1000000, help="Suppressed addresses")
+    parser.add_argument("--recipients", type=int, default=10000, help="Recipients checked")
+    parser.add_argument("--hit-rate", type=float, default=0.01, help="Share of recipients that are suppressed")
+    parser.add_argument("--error-rate", type=float, default=0.001, help="Bloom filter false positive rate")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    entries = [f"user.{i}@mail{i % 500}.example.com" for i in range(args.entries)]
+    recipients = [
+        random.choice(entries).upper() if random.random() < args.hit_rate else f"rcpt.{i}@mail{i % 500}.example.org"
+        for i in range(args.recipients)
+    ]
+
+    start = time.perf_counter()
+    hashed = HashedAddressSet(sorted(address_hash(normalize_suppressed(address)) for address in entries))
+    set_build = time.perf_counter() - start
+    start = time.perf_counter()
+    bloom = BloomFilter(args.entries, args.error_rate)
+    for address in entries:
+        bloom.add(address_hash(normalize_suppressed(address)))
+    bloom_build = time.perf_counter() - start
+    plain = set(entries)
+    plain_bytes = sys.getsizeof(plain) + sum(sys.getsizeof(address) for address in entries)
+
+    results = {
+        "entries": args.entries,
+        "recipients": args.recipients,
+        "python_set_of_addresses": {
+            "bytes_per_entry": round(plain_bytes / args.entries, 1),
+            "us_per_address": per_address_us(lambda address: normalize_suppressed(address) in plain, recipients),
+        },
+        "hashed_set": {
+            "build_seconds": round(set_build, 2),
+            "bytes_per_entry": round(hashed.nbytes / args.entries, 1),
+            "us_per_address": per_address_us(
+                lambda address: address_hash(normalize_suppressed(address)) in hashed, recipients
+            ),
+        },
+        "bloom": {
+            "build_seconds": round(bloom_build, 2),
+            "bytes_per_entry": round(bloom.nbytes / args.entries, 1),
+            "hashes": bloom.hashes,
+            "us_per_address": per_address_us(
+                lambda address: address_hash(normalize_suppressed(address)) in bloom, recipients
+            ),
+            "false_positives": sum(
+                address_hash(f"absent.{i}@nowhere.example.net") in bloom for i in range(args.recipients)
+            ) / args.recipients,
+        },
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Request validation benchmark
+
+Measures EmailSendRequest validations per second for requests with large
+recipient lists (split over recipients/cc/bcc, spread over a set of
+domains), comparing per-item EmailStr validation with the fast path
+(compiled address regex plus cached domain checks).
+
+Usage:
+    python -m benchmarks.validation --requests 200 --recipients 2000 --domains 50
+"""
+import argparse
+import json
+import time
+from typing import List, Optional
+
+from pydantic import BaseModel, EmailStr
+
+from app.config import settings
+from app.schemas.email import EmailSendRequest
+from app.utils.addresses import domain_cache_stats
+
+
+class LegacyRequest(BaseModel):
+    """The pre-fast-path address fields: email-validator in full for every item"""
+
+    recipients: List[EmailStr]
+    cc: Optional[List[EmailStr]] = None
+    bcc: Optional[List[EmailStr]] = None
+    subject: str
+    body: str
+
+
+def make_payload(recipients: int, domains: int) -> dict:
+    addresses = [f"user.{i}@mail{i % domains}.example.com" for i in range(recipients)]
+    cc_start = recipients * 8 // 10
+    bcc_start = recipients * 9 // 10
+    return {
+        "recipients": addresses[:cc_start],
+        "cc": addresses[cc_start:bcc_start],
+        "bcc": addresses[bcc_start:],
+        "subject": "Quarterly update",
+        "body": "Hello,\n\nHere is our quarterly update.",
+    }
+
+
+def measure(validate, payload: dict, requests: int) -> dict:
+    start = time.perf_counter()
+    for _ in range(requests):
+        validate(payload)
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "seconds": round(elapsed, 4),
+        "requests_per_sec": round(requests / elapsed, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--recipients", type=int, default=2000, help="Addresses per request, over recipients/cc/bcc")
+    parser.add_argument("--domains", type=int, default=50, help="Distinct recipient domains")
+    args = parser.parse_args()
+
+    payload = make_payload(args.recipients, args.domains)
+    results = {
+        "recipients_per_request": args.recipients,
+        "domains": args.domains,
+        "before_emailstr": measure(LegacyRequest.model_validate, payload, args.requests),
+    }
+    settings.validation_fast_mode = False
+    results["full_validation"] = measure(EmailSendRequest.model_validate, payload, args.requests)
+    settings.validation_fast_mode = True
+    results["after_fast_path"] = measure(EmailSendRequest.model_validate, payload, args.requests)
+    results["domain_cache"] = domain_cache_stats()
+    results["speedup"] = round(
+        results["after_fast_path"]["requests_per_sec"] / results["before_emailstr"]["requests_per_sec"], 2
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import hashlib
+import threading
+
+import pytest
+
+from app.services import attachment_store
+from app.services.attachment_service import UploadedFile
+from app.services.attachment_store import AttachmentNotFoundError, AttachmentStore
+from app.utils.mime_builder import FileAttachment
+
+
+def _upload(tmp_path, data: bytes) -> UploadedFile:
+    path = tmp_path / f"upload-{hashlib.sha1(data).hexdigest()}"
+    path.write_bytes(data)
+    return UploadedFile(FileAttachment(str(path), "report.txt", "text/plain"), len(data), hashlib.sha256(data).hexdigest())
+
+
+@pytest.fixture
+def stores(tmp_path):
+    """Two stores on one directory, like two worker processes"""
+    first, second = AttachmentStore(str(tmp_path / "store")), AttachmentStore(str(tmp_path / "store"))
+    first.stats()
+    second.stats()
+    for store in (first, second):
+        store.ttl = -1
+    return first, second
+
+
+def test_handle_uploaded_by_another_worker(tmp_path, stores):
+    first, second = stores
+    meta, existed = first.put(_upload(tmp_path, b"hello"))
+
+    assert not existed
+    assert second.get(meta.attachment_id) == meta
+    assert second.put(_upload(tmp_path, b"hello")) == (meta, True)
+
+
+def test_references_are_shared_on_disk(tmp_path, stores):
+    first, second = stores
+    attachment_id = first.put(_upload(tmp_path, b"queued"))[0].attachment_id
+
+    second.retain([attachment_id])
+    assert first.collect() == 0
+    first.release([attachment_id])  # The email was claimed by another worker
+    assert second.collect() == 1
+    with pytest.raises(AttachmentNotFoundError):
+        first.pin([(attachment_id, None)])
+
+
+def test_retain_rolls_back_on_unknown_handle(tmp_path, stores):
+    first, _ = stores
+    attachment_id = first.put(_upload(tmp_path, b"kept"))[0].attachment_id
+
+    with pytest.raises(AttachmentNotFoundError):
+        first.retain([attachment_id, "0" * 64])
+    assert first._read_meta(attachment_id).refcount == 0
+
+
+def test_collect_skips_files_pinned_by_another_worker(tmp_path, stores):
+    first, second = stores
+    attachment_id = first.put(_upload(tmp_path, b"sending"))[0].attachment_id
+
+    second.pin([(attachment_id, None)])
+    assert first.collect() == 0
+    second.unpin([attachment_id])
+    assert first.collect() == 1
+
+
+def test_unknown_handles_stay_inside_the_store(stores):
+    with pytest.raises(AttachmentNotFoundError):
+        stores[0].get("../../etc/passwd")
+
+
+def test_pin_waiting_for_a_clean_up_does_not_deadlock(tmp_path, stores, monkeypatch):
+    store, _ = stores
+    attachment_id = store.put(_upload(tmp_path, b"contended"))[0].attachment_id
+    collecting = threading.Event()
+    flock = attachment_store.fcntl.flock
+
+    def paused_flock(handle, operation):
+        flock(handle, operation)
+        if operation == attachment_store.fcntl.LOCK_EX | attachment_store.fcntl.LOCK_NB:
+            # Let the pin start while the clean-up holds the file lock
+            collecting.set()
+            pinning.join(0.2)
+
+    monkeypatch.setattr(attachment_store.fcntl, "flock", paused_flock)
+    errors = []
+
+    def pin():
+        collecting.wait(5)
+        try:
+            store.pin([(attachment_id, None)])
+        except AttachmentNotFoundError as e:
+            errors.append(e)
+
+    pinning = threading.Thread(target=pin, daemon=True)
+    pinning.start()
+    collected = []
+    collector = threading.Thread(target=lambda: collected.append(store.collect()), daemon=True)
+    collector.start()
+
+    collector.join(5)
+    pinning.join(5)
+    assert not collector.is_alive() and not pinning.is_alive()
+    assert collected == [1]
+    assert len(errors) == 1
+    store.unpin([attachment_id])  # Must not block either
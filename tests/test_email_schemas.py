@@ -0,0 +1,30 @@
+import pytest
+from pydantic import ValidationError
+
+from app.schemas.email import EmailBatchRequest
+
+TEMPLATE = {"subject": "Monthly Report", "body": "Your report is ready.", "email_type": "plain"}
+
+
+def test_bad_first_address_fails_only_its_item():
+    batch = EmailBatchRequest(template=TEMPLATE, recipients=["not-an-address", "user@example.com"])
+
+    (first_index, first), (second_index, second) = batch.iter_requests()
+    assert (first_index, second_index) == (0, 1)
+    assert isinstance(first, str)
+    assert second.recipients == ["user@example.com"]
+
+
+def test_invalid_template_rejects_the_batch():
+    with pytest.raises(ValidationError, match="Invalid template"):
+        EmailBatchRequest(template={**TEMPLATE, "email_type": "fax"}, recipients=["user@example.com"])
+
+
+def test_recipient_is_dropped_from_the_shared_cc_and_bcc():
+    template = {**TEMPLATE, "cc": ["boss@example.com", "user@example.com"], "bcc": ["audit@example.com", "other@example.com"]}
+    batch = EmailBatchRequest(template=template, recipients=["user@Example.com", "other@example.com"])
+
+    (_, first), (_, second) = batch.iter_requests()
+    assert first.recipients == ["user@example.com"]
+    assert (first.cc, first.bcc) == (["boss@example.com"], ["audit@example.com", "other@example.com"])
+    assert (second.cc, second.bcc) == (["boss@example.com", "user@example.com"], ["audit@example.com"])
@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import smtplib
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.schemas.email import EmailSendRequest
+from app.services import pdf_preview
+from app.services.attachment_service import UploadedFile
+from app.services.attachment_store import AttachmentStore
+from app.services.email_service import EmailService
+from app.services.pdf_preview import PDFPreviewError
+from app.utils.delivery_planner import DeliveryReport
+from app.utils.mime_builder import FileAttachment
+
+REPLIES = {"later@example.com": (451, b"try later"), "bad@example.com": (550, b"no such user")}
+
+
+def _upload(service, tmp_path, data: bytes, filename: str, content_type: str) -> str:
+    path = tmp_path / f"upload-{hashlib.sha1(data).hexdigest()}"
+    path.write_bytes(data)
+    upload = UploadedFile(FileAttachment(str(path), filename, content_type), len(data), hashlib.sha256(data).hexdigest())
+    return service.attachments.put(upload)[0].attachment_id
+
+
+def _html(subject: str, attachments=None) -> EmailSendRequest:
+    return EmailSendRequest(
+        recipients=["user@example.com"], subject=subject, email_type="html",
+        html_body="<p>Report</p>", attachments=attachments
+    )
+
+
+async def _delivered(messages, priority):
+    reports = []
+    for fields in messages:
+        report = DeliveryReport()
+        report.add_envelope(fields["recipients"])
+        reports.append(report)
+    return reports
+
+
+async def _collect(batch) -> list:
+    return [result async for result in batch]
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = EmailService()
+    service.attachments = AttachmentStore(str(tmp_path / "store"))
+    service.previews.store = service.attachments
+    yield service
+    service.close()
+
+
+def test_partial_send_lists_deferred_recipients(service):
+    envelopes = []
+
+    async def send_envelope(message, envelope, priority):
+        envelopes.append(envelope)
+        refused = {address: REPLIES[address] for address in envelope if address in REPLIES}
+        if len(refused) == len(envelope):
+            raise smtplib.SMTPRecipientsRefused(refused)
+        return refused
+
+    service.smtp_client._send_envelope = send_envelope
+    request = EmailSendRequest(
+        recipients=["ok@example.com", "later@example.com"], cc=["bad@example.com"], subject="Hi", body="Hello"
+    )
+
+    result = asyncio.run(service.send_email(request))
+    assert result["status"] == "partial"
+    assert result["deferred"] == ["later@example.com"]
+
+    retry = asyncio.run(service.send_email(request, only_to=result["deferred"]))
+    assert envelopes[-1] == ["later@example.com"]
+    assert retry["status"] == "failed" and retry["retryable"]
+
+
+def test_failed_preview_fails_only_its_item(service, tmp_path, monkeypatch):
+    attachment_id = _upload(service, tmp_path, b"%PDF-1.4 truncated", "report.pdf", "application/pdf")
+
+    def render_pages(*args):
+        raise OSError("Unable to get page count. Is poppler installed and in PATH?")
+
+    monkeypatch.setattr(pdf_preview, "render_pages", render_pages)
+    monkeypatch.setattr(service.previews, "_get_executor", lambda: ThreadPoolExecutor(1))
+    service.smtp_client.send_batch = _delivered
+    items = [
+        (0, _html("With preview", [{"id": attachment_id, "preview": True}])),
+        (1, _html("Without preview", [{"id": attachment_id}])),
+    ]
+
+    results = sorted(asyncio.run(_collect(service.send_batch(items))), key=lambda result: result["index"])
+    assert [result["status"] for result in results] == ["failed", "success"]
+    assert "poppler" in results[0]["message"]
+    assert service.attachments._entries[attachment_id].pins == 0
+
+
+def test_broken_preview_workers_are_replaced(service, tmp_path):
+    attachment_id = _upload(service, tmp_path, b"%PDF-1.4", "report.pdf", "application/pdf")
+    attachment = service.attachments.pin([(attachment_id, None)])[0]
+
+    class BrokenPool:
+        def submit(self, fn, *args):
+            future = Future()
+            future.set_exception(BrokenProcessPool("A worker was killed"))
+            return future
+
+        def shutdown(self, wait=True, cancel_futures=False):
+            pass
+
+    service.previews._executor = BrokenPool()
+    with pytest.raises(PDFPreviewError):
+        asyncio.run(service.previews.render(attachment_id, attachment, 1))
+    assert service.previews._executor is None
+    assert service.previews._rendering == {}
+    service.attachments.unpin([attachment_id])
+
+
+def test_failed_chunk_cancels_the_chunks_in_flight(service, tmp_path):
+    attachment_id = _upload(service, tmp_path, b"quarterly numbers", "report.txt", "text/plain")
+    service.batch_session_size = 1
+    service.batch_max_sessions = 2
+    cancelled = []
+    sending = None
+
+    async def send_batch(messages, priority):
+        nonlocal sending
+        sending = sending or asyncio.Event()
+        if messages[0]["subject"] == "Broken":
+            await sending.wait()
+            raise RuntimeError("relay went away")
+        sending.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(messages[0]["subject"])
+            raise
+
+    service.smtp_client.send_batch = send_batch
+    items = [(0, _html("Slow", [{"id": attachment_id}])), (1, _html("Broken"))]
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await _collect(service.send_batch(items))
+        # Settled by the time the batch has failed, not when the loop closes
+        assert cancelled == ["Slow"]
+        assert service.attachments._entries[attachment_id].pins == 0
+
+    asyncio.run(run())
@@ -0,0 +1,32 @@
+from app.utils.metrics import Counter, Gauge, Registry
+
+
+def _lines(registry: Registry) -> list:
+    return registry.render().splitlines()
+
+
+def test_counter_family_matches_samples():
+    registry = Registry()
+    counter = Counter("demo_requests", "Requests handled", ("status",), registry=registry)
+    counter.labels("ok").inc(3)
+
+    assert _lines(registry) == [
+        "# HELP demo_requests_total Requests handled",
+        "# TYPE demo_requests_total counter",
+        'demo_requests_total{status="ok"} 3',
+    ]
+
+
+def test_unlabelled_counter_and_gauge():
+    registry = Registry()
+    Counter("demo_drops", "Dropped items", registry=registry).inc()
+    Gauge("demo_depth", "Queue depth", registry=registry).set(2.5)
+
+    assert _lines(registry) == [
+        "# HELP demo_drops_total Dropped items",
+        "# TYPE demo_drops_total counter",
+        "demo_drops_total 1",
+        "# HELP demo_depth Queue depth",
+        "# TYPE demo_depth gauge",
+        "demo_depth 2.5",
+    ]
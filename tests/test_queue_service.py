@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.queue_service import DeliveryQueue
+
+PAYLOAD = {
+    "recipients": ["ok@example.com", "later@example.com"],
+    "cc": ["bad@example.com"],
+    "subject": "Report",
+    "body": "Attached",
+    "attachments": [{"id": "a" * 64}],
+}
+
+
+def _partial(deferred=None) -> dict:
+    result = {
+        "email_id": "email-1",
+        "status": "partial",
+        "message": "Email sent to 1 of 3 recipients.",
+        "accepted": ["ok@example.com"],
+        "rejected": {"later@example.com": "(451, b'try later')", "bad@example.com": "(550, b'no such user')"},
+    }
+    if deferred:
+        result["deferred"] = deferred
+    return result
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    released = []
+    service = SimpleNamespace(attachments=SimpleNamespace(release=released.extend))
+    queue = DeliveryQueue(service)
+    queue.max_attempts = 3
+    queue.transitions, queue.scheduled, queue.released = [], [], released
+
+    async def transition(email_id, status, last_error=None, next_attempt_at=None, payload=None):
+        queue.transitions.append((status, payload))
+
+    monkeypatch.setattr(queue, "_transition", transition)
+    monkeypatch.setattr(queue.retries, "schedule", lambda delay, email_id: queue.scheduled.append(email_id))
+    return queue
+
+
+def test_deferred_recipients_are_retried_alone(queue):
+    asyncio.run(queue._finish("email-1", 1, PAYLOAD, _partial(["later@example.com"])))
+
+    assert queue.transitions == [("retrying", {**PAYLOAD, "envelope": ["later@example.com"]})]
+    assert queue.scheduled == ["email-1"]
+    assert queue.released == []  # Still needed by the retry
+
+
+def test_permanent_rejections_finish_a_partial_send(queue):
+    asyncio.run(queue._finish("email-1", 1, PAYLOAD, _partial()))
+
+    assert queue.transitions == [("sent", None)]
+    assert queue.released == ["a" * 64]
+
+
+def test_partial_send_out_of_attempts_is_sent(queue):
+    asyncio.run(queue._finish("email-1", 3, PAYLOAD, _partial(["later@example.com"])))
+
+    assert queue.transitions == [("sent", None)]
+    assert queue.scheduled == []
+
+
+def test_failed_retry_of_an_envelope_is_still_sent(queue):
+    # The first attempt reached ok@example.com; the retry was refused for good
+    payload = {**PAYLOAD, "envelope": ["later@example.com"]}
+    result = {"email_id": "email-1", "status": "failed", "message": "Failed to send email", "retryable": False}
+    asyncio.run(queue._finish("email-1", 2, payload, result))
+
+    assert queue.transitions == [("sent", None)]
+
+
+def test_retry_is_sent_only_to_the_envelope(queue):
+    sent = []
+
+    async def send_email(email_request, email_id=None, only_to=None):
+        sent.append((email_request.recipients, only_to))
+        return {"email_id": email_id, "status": "success", "message": "Email sent successfully."}
+
+    queue.email_service.send_email = send_email
+
+    async def work():
+        queue._pending = asyncio.Queue()
+        await queue._pending.put(("email-1", {**PAYLOAD, "envelope": ["later@example.com"]}, 2))
+        worker = asyncio.create_task(queue._work())
+        await queue._pending.join()
+        worker.cancel()
+
+    asyncio.run(work())
+    assert sent == [(["ok@example.com", "later@example.com"], ["later@example.com"])]
+    assert queue.transitions == [("sent", None)]
@@ -0,0 +1,54 @@
+import smtplib
+import threading
+
+import pytest
+
+from app.utils.smtp_client import SMTPClient
+from app.utils.smtp_relays import CLOSED, OPEN, NoRelayAvailableError, Relay, RelayRouter
+
+
+def _router(probe=lambda relay: None) -> RelayRouter:
+    relay = Relay("relay-a", 25, 1, pool=None)
+    return RelayRouter([relay], "least_outstanding", breaker_failures=2, slow_seconds=1.0, cooldown=0, probe=probe)
+
+
+def test_slow_successful_sends_keep_the_relay():
+    router = _router()
+    relay = router.relays[0]
+    for _ in range(3):
+        router.record(relay, 30.0)  # A large message on a healthy relay
+
+    assert relay.state == CLOSED and relay.failures == 0
+
+
+def test_slow_rejections_eject_the_relay():
+    router = _router()
+    relay = router.relays[0]
+    rejected = smtplib.SMTPDataError(554, b"message refused")
+    router.record(relay, 0.1, rejected)
+    assert relay.failures == 0
+    router.record(relay, 5.0, rejected)
+    router.record(relay, 5.0, rejected)
+
+    assert relay.state == OPEN
+
+
+def test_probes_do_not_wait_for_send_threads(monkeypatch):
+    client = SMTPClient()
+    relay = client.relays[0]
+    probed = threading.Event()
+    monkeypatch.setattr(client, "test_connection", lambda relay: probed.set() or {"success": True})
+
+    # Every send thread is busy with a stuck delivery
+    release = threading.Event()
+    for _ in range(client._executor._max_workers):
+        client._executor.submit(release.wait, 5)
+    relay.state, relay.opened_at = OPEN, 0.0
+    with pytest.raises(NoRelayAvailableError):
+        client.router.acquire()  # The only relay is being probed
+
+    try:
+        assert probed.wait(2)
+    finally:
+        release.set()
+        client.close()